@@ -50,7 +50,13 @@ INSTALLED_APPS = [
     'drf_yasg',
 ]
 
+# Лукапы pg_trgm (trigram_word_similar) и полнотекстовый поиск для ?search= доступны только с PostgreSQL
+if os.getenv('DB_ENGINE') == 'django.db.backends.postgresql':
+    INSTALLED_APPS.append('django.contrib.postgres')
+
 MIDDLEWARE = [
+    'library.instrumentation.InstrumentationMiddleware',
+    'library.db_routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'library.query_budget.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -80,16 +87,55 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
+# Режим JWT аутентификации: 'db' - пользователь загружается из базы на каждый запрос,
+# 'claims' - пользователь строится из claims токена, состояние учетной записи перепроверяется
+# не чаще раза в JWT_CLAIMS_REVALIDATE_SECONDS секунд (users/authentication.py)
+JWT_AUTH_MODE = os.getenv('JWT_AUTH_MODE', 'db')
+JWT_AUTHENTICATION_CLASSES = {
+    'db': 'rest_framework_simplejwt.authentication.JWTAuthentication',
+    'claims': 'users.authentication.ClaimsJWTAuthentication',
+}
+JWT_CLAIMS_REVALIDATE_SECONDS = int(os.getenv('JWT_CLAIMS_REVALIDATE_SECONDS', 30))
+JWT_CLAIMS_CACHE_SIZE = 10000
+
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_RENDERER_CLASSES': [
+        'library.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'library.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        JWT_AUTHENTICATION_CLASSES[JWT_AUTH_MODE],
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ]
 }
 
+# JSON в API: 'stdlib' - стандартные JSONRenderer/JSONParser или 'orjson' (library/renderers.py).
+# orjson не входит в зависимости проекта: для 'orjson' пакет устанавливается отдельно (pip install orjson)
+API_JSON_BACKEND = os.getenv('API_JSON_BACKEND', 'stdlib')
+# Списки книг и выдач из .values() без сериализатора DRF (library/fast_lists.py)
+API_FAST_LISTS = os.getenv('API_FAST_LISTS', 'true').lower() == 'true'
+
+# Контроль бюджета SQL запросов представлений (query_budget): 'off', 'log' или 'raise'
+QUERY_BUDGET_MODE = os.getenv('QUERY_BUDGET_MODE', 'log' if DEBUG else 'off')
+
+# Инструментирование запросов (library/instrumentation.py): гистограммы маршрутов для /metrics/ по всем запросам,
+# SQL и сериализация с заголовком Server-Timing - для доли запросов INSTRUMENTATION_SAMPLE_RATE
+INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION_ENABLED', 'true').lower() == 'true'
+INSTRUMENTATION_SAMPLE_RATE = float(os.getenv('INSTRUMENTATION_SAMPLE_RATE', '1.0' if DEBUG else '0.1'))
+INSTRUMENTATION_TOP_QUERIES = 5
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'true').lower() == 'true'
+SLOW_REQUEST_THRESHOLD_MS = int(os.getenv('SLOW_REQUEST_THRESHOLD_MS', '500'))
+# Если задан, /metrics/ требует заголовок Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -104,6 +150,62 @@ DATABASES = {
     }
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Тестовая база SQLite в файле, а не в памяти: тесты конкурентного доступа работают из нескольких потоков,
+    # а при блокировке соединение ждет освобождения базы вместо ошибки. Транзакции сразу берут блокировку записи
+    # (IMMEDIATE): иначе транзакция, которая сначала читает, а потом пишет, при параллельной записи из другого
+    # процесса (scan_overdue_issues --workers) получает "database is locked" без ожидания
+    DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'test_db.sqlite3'}
+    DATABASES['default']['OPTIONS'] = {'timeout': 30, 'transaction_mode': 'IMMEDIATE'}
+    # Отдельная база SQLite для тестов чтения с реплики (ReplicaRoutingTestCase): данные в нее не реплицируются,
+    # поэтому по ответу видно, из какой базы он прочитан. Используется, только если указана в DATABASE_REPLICAS
+    DATABASES['replica'] = {
+        'ENGINE': DATABASES['default']['ENGINE'],
+        'NAME': f"{DATABASES['default']['NAME']}-replica",
+        'TEST': {'NAME': BASE_DIR / 'test_db_replica.sqlite3'},
+        'OPTIONS': {'timeout': 30},
+    }
+
+# Реплики для чтения (library/db_routing.py): DB_REPLICA_HOSTS=replica1,replica2 - хосты с копией основной базы,
+# имя базы, пользователь и порт как у основной. В тестах реплики смотрят на тестовую основную базу
+DATABASE_REPLICAS = []
+for number, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica_{number}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{number}')
+DATABASE_ROUTERS = ['library.db_routing.PrimaryReplicaRouter']
+# Сколько секунд после записи клиент читает с основной базы, больше максимального отставания реплик
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
+# Кеш закреплений клиентов за основной базой, при нескольких процессах - общий для них
+REPLICA_PIN_CACHE = 'default'
+
+# Кеш ответов книг и авторов (library/cache.py): 'locmem' - LRU в памяти процесса, 'file' - файлы на диске,
+# 'db' - таблица в базе (создается командой createcachetable)
+API_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'api',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': API_CACHE_BACKENDS[os.getenv('API_CACHE_BACKEND', 'locmem')],
+}
+API_CACHE_TIMEOUT = 300
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -143,10 +245,45 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 AUTH_USER_MODEL = 'users.User'
 
+# Поиск книг (?search=): 'auto' - PostgreSQL при соответствующей базе, иначе индекс в памяти процесса
+BOOK_SEARCH_BACKEND = os.getenv('BOOK_SEARCH_BACKEND', 'auto')
+BOOK_SEARCH_MAX_RESULTS = 200
+BOOK_SEARCH_INDEX_TTL = 300  # секунд до полного перестроения индекса в памяти
+
+# Подсказки по префиксу названия книги и имени автора (/autocomplete/, library/autocomplete.py)
+AUTOCOMPLETE_INDEX_TTL = 300  # секунд до полного перестроения индекса в памяти
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_RESULTS = 50
+AUTOCOMPLETE_CACHE_MIN_MATCHES = 500  # лучшие подсказки префиксов с большим числом совпадений запоминаются
+
+# Наибольшее число позиций в пакетной выдаче и возврате книг (/book-issues/bulk-issue/, /book-issues/bulk-return/)
+BOOK_ISSUE_BULK_MAX_ITEMS = 500
+
+# Срок выдачи книги в днях, после него выдача считается просроченной (scan_overdue_issues, library/overdue.py)
+BOOK_ISSUE_LOAN_DAYS = int(os.getenv('BOOK_ISSUE_LOAN_DAYS', 14))
+# Контрольная точка прогона scan_overdue_issues для продолжения после прерывания
+OVERDUE_SCAN_CHECKPOINT = os.getenv('OVERDUE_SCAN_CHECKPOINT', str(BASE_DIR / 'cache' / 'overdue_scan.json'))
+
+# Рекомендации "Читатели также брали" (build_book_similarity, library/similarity.py)
+BOOK_SIMILARITY_METRIC = os.getenv('BOOK_SIMILARITY_METRIC', 'cosine')  # 'cosine' или 'cooccurrence'
+BOOK_SIMILARITY_TOP_K = 20  # соседей у книги в таблице BookSimilarity
+BOOK_SIMILARITY_MAX_READER_BOOKS = 500  # читатели с большим числом книг не учитываются
+
+# Кеш ролей пользователей для проверок прав (users/roles.py)
+ROLE_CACHE_TTL = int(os.getenv('ROLE_CACHE_TTL', 60))  # секунд, за которые изменение групп дойдет до других процессов
+ROLE_CACHE_SIZE = 10000
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
+if JWT_AUTH_MODE == 'claims':
+    # Токены с claims пользователя и хешем пароля: смена пароля отзывает выданные токены.
+    # Токены, выданные до включения режима, не принимаются - нужен повторный вход
+    SIMPLE_JWT.update({
+        "CHECK_REVOKE_TOKEN": True,
+        "TOKEN_OBTAIN_SERIALIZER": "users.authentication.ClaimsTokenObtainPairSerializer",
+    })
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
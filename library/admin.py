@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from library.models import Book, Author, BookIssue
+from library.models import (
+    Book, Author, BookIssue, BookSimilarity, BookSimilarityBuild, OverdueNotice, ReadingStats,
+)
 
 
 @admin.register(Book)
@@ -35,3 +37,54 @@ class BookIssueAdmin(admin.ModelAdmin):
         'is_returned',
         'rating'
     )
+
+
+@admin.register(ReadingStats)
+class ReadingStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        'dimension',
+        'key',
+        'issues_count',
+        'open_issues_count',
+        'returned_count',
+        'days_held_total',
+        'rating_sum',
+        'rating_count',
+    )
+    list_filter = ('dimension',)
+
+
+@admin.register(OverdueNotice)
+class OverdueNoticeAdmin(admin.ModelAdmin):
+    list_display = (
+        'issue',
+        'due_date',
+        'days_overdue',
+        'created_at',
+        'updated_at',
+    )
+    list_select_related = ('issue__book', 'issue__user')
+
+
+@admin.register(BookSimilarity)
+class BookSimilarityAdmin(admin.ModelAdmin):
+    list_display = (
+        'book',
+        'rank',
+        'similar_book',
+        'score',
+        'co_readers',
+    )
+    list_select_related = ('book', 'similar_book')
+
+
+@admin.register(BookSimilarityBuild)
+class BookSimilarityBuildAdmin(admin.ModelAdmin):
+    list_display = (
+        'created_at',
+        'metric',
+        'top_k',
+        'is_full',
+        'books_updated',
+        'last_issue_id',
+    )
@@ -0,0 +1,134 @@
+"""
+    Async (ASGI) варианты чтения книг, авторов и выдач: /async/books/, /async/authors/, /async/book-issues/
+
+    Представления наследуют синхронные ViewSet, поэтому запросы к базе, фильтры, права, пагинация, выборочные поля
+    и кеш ответов те же самые. Отличается только выполнение:
+        - страница и карточка читаются async ORM (async for по запросу страницы, aget), кеш - через aget/aset
+        - аутентификация, проверка прав и построение фильтров (могут обращаться к базе) выполняются
+          в потоке запроса через sync_to_async
+    Пока запрос ждет базу или медленного клиента, поток сервера не занят, и один процесс ASGI сервера
+    обслуживает больше одновременных соединений, чем пул потоков WSGI. Сравнение - команда bench_concurrency.
+"""
+import inspect
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils.decorators import classonlymethod
+from rest_framework import status
+from rest_framework.response import Response
+
+from library.cache import aget_tokens
+from library.views import AuthorViewSet, BookIssueViewSet, BookViewSet
+
+
+class AsyncReadOnlyMixin:
+    """
+        Async list и retrieve для ViewSet. Изменяющие методы не поддерживаются (405),
+        дополнительные действия (@action) не регистрируются
+    """
+
+    http_method_names = ['get', 'head', 'options']
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        # Представление ViewSet возвращает результат dispatch, здесь - корутину
+        return markcoroutinefunction(super().as_view(actions, **initkwargs))
+
+    @classmethod
+    def get_extra_actions(cls):
+        return []
+
+    async def dispatch(self, request, *args, **kwargs):
+        """APIView.dispatch с async обработчиком"""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    @property
+    def cached(self):
+        return getattr(self, 'cache_namespace', None) is not None
+
+    async def list(self, request, *args, **kwargs):
+        if not self.cached:
+            return await self.list_response(request)
+        generation = ':'.join(await aget_tokens(self.list_token_key(), *self.dependency_token_keys()))
+        return await self._acached_response(self.list_cache_key(request, generation), self.list_response, request)
+
+    async def retrieve(self, request, *args, **kwargs):
+        if not self.cached:
+            return await self.retrieve_response(request)
+        version = ':'.join(await aget_tokens(self.detail_token_key(), *self.dependency_token_keys()))
+        etag, key = self.detail_cache_key(request, version)
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = await self._acached_response(key, self.retrieve_response, request)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
+    async def afilter_queryset(self):
+        # Фильтры могут обращаться к базе (поиск строит индекс книг), поэтому выполняются в потоке запроса
+        return await sync_to_async(self.filter_queryset)(self.get_queryset())
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+    async def list_response(self, request):
+        queryset = await self.afilter_queryset()
+        if getattr(self, 'use_values_list', lambda: False)():
+            representation, rows = self.get_values_rows(request, queryset)
+            page = await self.apaginate_queryset(rows)
+            if page is None:
+                return self.values_response(representation, [row async for row in rows], False)
+            return self.values_response(representation, page, True)
+
+        page = await self.apaginate_queryset(queryset)
+        if page is None:
+            return Response(self.get_serializer([row async for row in queryset], many=True).data)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    async def aget_object(self):
+        """GenericAPIView.get_object через aget"""
+        queryset = await self.afilter_queryset()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            instance = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+        await sync_to_async(self.check_object_permissions)(self.request, instance)
+        return instance
+
+    async def retrieve_response(self, request):
+        return Response(self.get_serializer(await self.aget_object()).data)
+
+
+class AsyncBookViewSet(AsyncReadOnlyMixin, BookViewSet):
+    """Async чтение книг, параметры как у /books/"""
+
+
+class AsyncAuthorViewSet(AsyncReadOnlyMixin, AuthorViewSet):
+    """Async чтение авторов, параметры как у /authors/"""
+
+
+class AsyncBookIssueViewSet(AsyncReadOnlyMixin, BookIssueViewSet):
+    """Async чтение выдач, параметры как у /book-issues/"""
@@ -0,0 +1,91 @@
+"""
+    Идентичность автора: один автор на нормализованное имя и дату рождения.
+
+    Ключ Author.identity_key - имя без учета регистра, ё/е и лишних пробелов плюс дата рождения,
+    уникальный индекс по нему. Автор книги ищется по ключу (одна строка по индексу) вместо сравнения
+    всех переданных полей, включая неиндексированную биографию: " Лев  Толстой" и "лев толстой"
+    с одной датой рождения - один автор, биография в идентичность не входит.
+
+    Модуль не импортирует модели: merge_duplicate_authors получает классы моделей, identity_key используется
+    в library.models. Миграция 0010_author_identity_key содержит свою копию этой логики.
+"""
+from collections import defaultdict
+
+from django.db.models import F, Sum
+
+# Имя до 255 символов, разделитель и дата
+IDENTITY_KEY_MAX_LENGTH = 300
+
+# Счетчики ReadingStats (library.stats.COUNTERS)
+STATS_COUNTERS = (
+    'issues_count', 'open_issues_count', 'returned_count', 'days_held_total', 'rating_sum', 'rating_count',
+)
+
+
+def identity_key(name, birth_date=None):
+    """Ключ автора 'имя|ГГГГ-ММ-ДД', без даты рождения - 'имя|'"""
+    name = ' '.join((name or '').casefold().replace('ё', 'е').split())
+    return f"{name}|{'' if birth_date is None else birth_date}"
+
+
+def merge_author_stats(ReadingStats, canonical, extra):
+    """Строки статистики чтения авторов extra прибавляются к строке автора canonical и удаляются"""
+    rows = ReadingStats.objects.filter(dimension=ReadingStats.AUTHOR, key__in=[str(pk) for pk in extra])
+    totals = rows.aggregate(**{name: Sum(name) for name in STATS_COUNTERS})
+    if totals['issues_count'] is None:
+        return
+    rows.delete()
+    updated = ReadingStats.objects.filter(dimension=ReadingStats.AUTHOR, key=str(canonical)).update(
+        **{name: F(name) + totals[name] for name in STATS_COUNTERS}
+    )
+    if not updated:
+        ReadingStats.objects.create(dimension=ReadingStats.AUTHOR, key=str(canonical), **totals)
+
+
+def merge_duplicate_authors(Author, Book, ReadingStats, dry_run=False, batch_size=1000, log=None):
+    """
+        Заполняет и исправляет identity_key, объединяет авторов с одинаковым ключом:
+        остается автор с меньшим id, книги дубликатов и их статистика чтения переходят к нему,
+        пустая биография берется у дубликата. Author, Book и ReadingStats - классы моделей, возвращает счетчики
+    """
+    log = log or (lambda message: None)
+    keys, renamed, groups = {}, set(), defaultdict(list)
+    rows = Author.objects.order_by('pk').values_list('pk', 'name', 'birth_date', 'identity_key')
+    for pk, name, birth_date, stored_key in rows.iterator(chunk_size=5000):
+        key = identity_key(name, birth_date)
+        groups[key].append(pk)
+        if key != stored_key:
+            keys[pk] = key
+            if stored_key is not None:
+                renamed.add(pk)
+    duplicates = {pks[0]: pks[1:] for pks in groups.values() if len(pks) > 1}
+    duplicate_ids = {pk for extra in duplicates.values() for pk in extra}
+    stale = {pk: key for pk, key in keys.items() if pk not in duplicate_ids}
+    report = {
+        'authors': sum(map(len, groups.values())),
+        'groups': len(duplicates),
+        'merged': len(duplicate_ids),
+        'books_moved': Book.objects.filter(author_id__in=duplicate_ids).count() if duplicate_ids else 0,
+        'keys_updated': len(stale),
+    }
+    if dry_run:
+        return report
+
+    for canonical, extra in duplicates.items():
+        Book.objects.filter(author_id__in=extra).update(author_id=canonical)
+        merge_author_stats(ReadingStats, canonical, extra)
+        if not Author.objects.filter(pk=canonical).exclude(biography='').exists():
+            biography = Author.objects.filter(pk__in=extra).exclude(biography='').order_by('pk').values_list(
+                'biography', flat=True).first()
+            if biography:
+                Author.objects.filter(pk=canonical).update(biography=biography)
+        Author.objects.filter(pk__in=extra).delete()
+        log(f"Автор {canonical}: объединены {', '.join(map(str, extra))}")
+
+    # Старый ключ одного автора может быть новым ключом другого: измененные ключи сначала заменяются временными
+    # без '|', с обычными ключами они не совпадают
+    Author.objects.bulk_update([Author(pk=pk, identity_key=str(pk)) for pk in renamed if pk in stale],
+                               ['identity_key'], batch_size=batch_size)
+    Author.objects.bulk_update([Author(pk=pk, identity_key=key) for pk, key in stale.items()],
+                               ['identity_key'], batch_size=batch_size)
+    return report
@@ -0,0 +1,237 @@
+"""
+    Подсказки по префиксу названия книги и имени автора (/autocomplete/?q=).
+
+    Индекс в памяти процесса - отсортированный массив начал слов: для каждого слова нормализованного текста
+    (normalize_text, как в поиске) хранится пара (id, смещение) в двух массивах array, порядок - по строке
+    текст[смещение:]. Сами строки не копируются: на каждое слово приходится 10 байт, текст хранится один раз.
+    Префикс запроса находится двоичным поиском, совпадения - непрерывный отрезок массива,
+    из него выбираются top-N по популярности (число выдач книги, у автора - сумма по его книгам).
+
+    Короткие префиксы (одна-две буквы) совпадают с тысячами слов, их лучшие подсказки запоминаются
+    до следующего изменения индекса.
+
+    Индекс строится лениво при первом запросе и целиком перестраивается не реже AUTOCOMPLETE_INDEX_TTL секунд
+    (изменения из других процессов), между перестроениями книги, авторы и выдачи применяются сигналами
+    после фиксации транзакции (library/signals.py).
+"""
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Count
+
+from library.models import Author, Book, BookIssue
+from library.search import TOKEN_RE, normalize_text
+
+BOOK = 'book'
+AUTHOR = 'author'
+KINDS = (BOOK, AUTHOR)
+
+# Больше любого символа: строки с префиксом p лежат в отрезке [p, p + PREFIX_END)
+PREFIX_END = chr(0x10FFFF)
+
+
+def get_autocomplete_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def normalize_query(value):
+    """Текст без повторных пробелов; пробел в конце запроса сохраняется: 'евгений ' не подходит к 'евгения'"""
+    text = ' '.join(normalize_text(value).split())
+    if text and value[-1:].isspace():
+        text += ' '
+    return text
+
+
+class PrefixIndex:
+    """Отсортированный массив начал слов: ids[i] и offsets[i] - объект и смещение слова в его тексте"""
+
+    def __init__(self, rows=()):
+        self.labels = {}
+        self.texts = {}
+        entries = []
+        for pk, label in rows:
+            text = normalize_query(label).rstrip()
+            self.labels[pk], self.texts[pk] = label, text
+            entries.extend((text[offset:], pk, offset) for offset in self.word_offsets(text))
+        entries.sort()
+        self.ids = array('q', (pk for _, pk, _ in entries))
+        self.offsets = array('H', (offset for _, _, offset in entries))
+
+    @staticmethod
+    def word_offsets(text):
+        return [match.start() for match in TOKEN_RE.finditer(text)]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _key(self, position):
+        return self.texts[self.ids[position]][self.offsets[position]:]
+
+    def _bisect(self, value):
+        return bisect_left(range(len(self.ids)), value, key=self._key)
+
+    def add(self, pk, label):
+        self.remove(pk)
+        text = normalize_query(label).rstrip()
+        self.labels[pk], self.texts[pk] = label, text
+        for offset in self.word_offsets(text):
+            position = self._bisect(text[offset:])
+            self.ids.insert(position, pk)
+            self.offsets.insert(position, offset)
+
+    def remove(self, pk):
+        text = self.texts.get(pk)
+        if text is None:
+            return
+        for offset in self.word_offsets(text):
+            position = self._bisect(text[offset:])
+            while position < len(self.ids) and (self.ids[position], self.offsets[position]) != (pk, offset):
+                position += 1
+            if position < len(self.ids):
+                del self.ids[position]
+                del self.offsets[position]
+        del self.texts[pk], self.labels[pk]
+
+    def bounds(self, prefix):
+        """Отрезок массива [начало, конец) слов, начинающихся с prefix (вместе с продолжением текста)"""
+        return self._bisect(prefix), self._bisect(prefix + PREFIX_END)
+
+    def match(self, prefix):
+        """id объектов, у которых с prefix начинается одно из слов"""
+        return set(self.ids[slice(*self.bounds(prefix))])
+
+
+class AutocompleteIndex:
+    """Индексы книг и авторов с популярностью, общая блокировка на чтение и обновления"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._indexes = {kind: PrefixIndex() for kind in KINDS}
+        self._popularity = {kind: Counter() for kind in KINDS}
+        self._book_authors = {}
+        # Лучшие подсказки широких префиксов: (префикс, типы) -> (сколько посчитано, список (выдач, тип, id))
+        self._top = {}
+
+    def reset(self):
+        with self._lock:
+            self._built_at = None
+            self._top = {}
+
+    def _ensure_built(self):
+        ttl = get_autocomplete_setting('AUTOCOMPLETE_INDEX_TTL', 300)
+        if self._built_at is not None and time.monotonic() - self._built_at < ttl:
+            return
+        books = list(Book.objects.values_list('id', 'title', 'author_id').iterator(chunk_size=5000))
+        issues = Counter(dict(BookIssue.objects.order_by().values('book').annotate(total=Count('pk')).values_list(
+            'book', 'total')))
+        self._book_authors = {book_id: author_id for book_id, _, author_id in books}
+        author_issues = Counter()
+        for book_id, author_id in self._book_authors.items():
+            author_issues[author_id] += issues[book_id]
+        self._indexes = {
+            BOOK: PrefixIndex((book_id, title) for book_id, title, _ in books),
+            AUTHOR: PrefixIndex(Author.objects.values_list('id', 'name').iterator(chunk_size=5000)),
+        }
+        self._popularity = {BOOK: issues, AUTHOR: author_issues}
+        self._top = {}
+        self._built_at = time.monotonic()
+
+    def _move_book(self, book_id, author_id):
+        """Выдачи книги переходят в популярность нового автора (None - книга удалена)"""
+        issues = self._popularity[BOOK][book_id]
+        old_author_id = self._book_authors.pop(book_id, None)
+        if old_author_id is not None:
+            self._popularity[AUTHOR][old_author_id] -= issues
+        if author_id is not None:
+            self._book_authors[book_id] = author_id
+            self._popularity[AUTHOR][author_id] += issues
+        else:
+            self._popularity[BOOK].pop(book_id, None)
+
+    def update_book(self, book_id):
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._top = {}
+            row = Book.objects.filter(pk=book_id).values_list('title', 'author_id').first()
+            if row is None:
+                self._indexes[BOOK].remove(book_id)
+                self._move_book(book_id, None)
+                return
+            self._indexes[BOOK].add(book_id, row[0])
+            self._move_book(book_id, row[1])
+
+    def remove_book(self, book_id):
+        with self._lock:
+            if self._built_at is not None:
+                self._top = {}
+                self._indexes[BOOK].remove(book_id)
+                self._move_book(book_id, None)
+
+    def update_author(self, author_id):
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._top = {}
+            name = Author.objects.filter(pk=author_id).values_list('name', flat=True).first()
+            if name is None:
+                self._indexes[AUTHOR].remove(author_id)
+            else:
+                self._indexes[AUTHOR].add(author_id, name)
+
+    def remove_author(self, author_id):
+        with self._lock:
+            if self._built_at is not None:
+                self._top = {}
+                self._indexes[AUTHOR].remove(author_id)
+                self._popularity[AUTHOR].pop(author_id, None)
+
+    def add_issues(self, deltas):
+        """Изменение числа выдач книг {id книги: разница}"""
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._top = {}
+            for book_id, delta in deltas.items():
+                self._popularity[BOOK][book_id] += delta
+                author_id = self._book_authors.get(book_id)
+                if author_id is not None:
+                    self._popularity[AUTHOR][author_id] += delta
+
+    def complete(self, query, limit, kinds=KINDS):
+        """Первые limit подсказок по убыванию числа выдач: словари type, id, text, issues_count"""
+        prefix = normalize_query(query)
+        if not prefix.strip():
+            return []
+        with self._lock:
+            self._ensure_built()
+            key = (prefix, tuple(kinds))
+            size, best = self._top.get(key, (0, None))
+            if size < limit:
+                size = max(limit, get_autocomplete_setting('AUTOCOMPLETE_MAX_RESULTS', 50))
+                best, matches = self._best(prefix, kinds, size)
+                if matches >= get_autocomplete_setting('AUTOCOMPLETE_CACHE_MIN_MATCHES', 500):
+                    self._top[key] = (size, best)
+            return [{'type': kind, 'id': pk, 'text': self._indexes[kind].labels[pk], 'issues_count': issues}
+                    for issues, kind, pk in best[:limit]]
+
+    def _best(self, prefix, kinds, limit):
+        """Лучшие limit совпадений (выдач, тип, id) и число совпавших слов"""
+        candidates, matches = [], 0
+        for kind in kinds:
+            index, popularity = self._indexes[kind], self._popularity[kind]
+            start, end = index.bounds(prefix)
+            matches += end - start
+            candidates.extend((popularity[pk], kind, pk) for pk in set(index.ids[start:end]))
+        # При равном числе выдач выше книги, затем объекты с меньшим id
+        best = heapq.nlargest(limit, candidates, key=lambda item: (item[0], item[1] == BOOK, -item[2]))
+        return best, matches
+
+
+autocomplete_index = AutocompleteIndex()
@@ -0,0 +1,248 @@
+"""
+    Нагрузочный прогон всех маршрутов library/urls.py и users/urls.py внутри процесса (команда bench_endpoints).
+
+    Каждый сценарий - один маршрут и метод. Запросы идут через APIClient с JWT токеном пользователя,
+    изменяющие запросы выполняются в транзакции с откатом, поэтому данные базы не меняются.
+    Для сценария измеряются задержки (p50/p95/p99), SQL запросы на ответ и пиковая память (tracemalloc,
+    отдельным коротким проходом, чтобы трассировка не искажала задержки).
+"""
+import datetime
+import itertools
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from django.db import connection, transaction
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from library.cache import get_cache
+from library.models import Author, Book, BookIssue, ReadingStats
+from library.query_budget import QueryCounter
+from library.seeding import SEED_PASSWORD
+from users.authentication import ClaimsTokenObtainPairSerializer
+
+# Маршруты rest_framework.urls (HTML формы входа Browsable API) не относятся к API и не измеряются
+EXCLUDED_ROUTES = {'library:login', 'library:logout'}
+
+# Размер пакета в сценариях пакетной выдачи и возврата
+BULK_SIZE = 30
+
+
+class Fixtures:
+    """Существующие объекты для подстановки в маршруты, выбираются один раз перед прогоном"""
+
+    def __init__(self, user):
+        self.user = user
+        self.book = Book.objects.order_by('-open_issues_count', 'pk').first()
+        self.available_book = Book.objects.available().order_by('pk').first()
+        self.author = Author.objects.order_by('pk').first()
+        self.open_issue = BookIssue.objects.filter(is_returned=False).order_by('pk').first()
+        # Пакет для класса: BULK_SIZE свободных книг и невозвращенных выдач
+        self.available_books = list(Book.objects.available().order_by('pk').values_list('pk', flat=True)[:BULK_SIZE])
+        self.open_issues = list(BookIssue.objects.filter(is_returned=False).order_by('pk')
+                                .values_list('pk', flat=True)[:BULK_SIZE])
+        self.returned_issue = BookIssue.objects.filter(is_returned=True).order_by('pk').first()
+        self.stats = ReadingStats.objects.order_by('pk').first()
+        # Удаление популярной книги или автора каскадно удаляет тысячи выдач, для удаления берем объекты без истории
+        self.disposable_book = Book.objects.filter(issues__isnull=True).order_by('pk').first() or self.book
+        self.disposable_author = (Author.objects.filter(books__isnull=True).order_by('pk').first()
+                                  or self.disposable_book.author)
+        self.refresh_token = str(ClaimsTokenObtainPairSerializer.get_token(user))
+        self.sequence = itertools.count()
+
+    def unique(self):
+        return next(self.sequence)
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    route: str
+    kwargs: Callable = lambda fixtures: {}
+    data: Optional[Callable] = None
+    params: dict = field(default_factory=dict)
+    content_type: str = 'application/json'
+    authenticated: bool = True
+
+    @property
+    def writes(self):
+        return self.method not in ('GET', 'HEAD', 'OPTIONS')
+
+
+def ndjson_books(fixtures, count=100):
+    return "\n".join(json.dumps({
+        'title': f"Книга {fixtures.unique()}", 'genre': "Роман", 'author': {'name': "Автор нагрузочного теста"},
+    }, ensure_ascii=False) for _ in range(count))
+
+
+def new_book(fixtures):
+    return {'title': f"Книга {fixtures.unique()}", 'genre': "Роман", 'author': {'name': "Пушкин А.С."}}
+
+
+SCENARIOS = [
+    Scenario('books list', 'GET', 'library:book-list', params={'page_size': 20}),
+    Scenario('books list by author', 'GET', 'library:book-list', params={'ordering': 'author__name'}),
+    Scenario('books available', 'GET', 'library:book-list', params={'is_returned': 'true'}),
+    Scenario('books search', 'GET', 'library:book-list', params={'search': 'война'}),
+    Scenario('autocomplete', 'GET', 'library:autocomplete', params={'q': 'во'}),
+    Scenario('books sparse', 'GET', 'library:book-list', params={'fields': 'id,title,author.name'}),
+    Scenario('book retrieve', 'GET', 'library:book-detail', lambda f: {'pk': f.book.pk}),
+    Scenario('book similar', 'GET', 'library:book-similar', lambda f: {'pk': f.book.pk}),
+    Scenario('book create', 'POST', 'library:book-list', data=new_book),
+    Scenario('book update', 'PATCH', 'library:book-detail', lambda f: {'pk': f.book.pk},
+             data=lambda f: {'title': f"Книга {f.unique()}"}),
+    Scenario('book delete', 'DELETE', 'library:book-detail', lambda f: {'pk': f.disposable_book.pk}),
+    Scenario('books bulk ingest', 'POST', 'library:book-bulk-ingest', data=ndjson_books,
+             content_type='application/x-ndjson'),
+    Scenario('authors list', 'GET', 'library:author-list'),
+    Scenario('authors with stats and books', 'GET', 'library:author-list', params={'include': 'stats,books'}),
+    Scenario('author retrieve', 'GET', 'library:author-detail', lambda f: {'pk': f.author.pk}),
+    Scenario('author create', 'POST', 'library:author-list', data=lambda f: {'name': f"Автор {f.unique()}"}),
+    Scenario('author update', 'PATCH', 'library:author-detail', lambda f: {'pk': f.author.pk},
+             data=lambda f: {'biography': f"Биография {f.unique()}"}),
+    Scenario('author delete', 'DELETE', 'library:author-detail', lambda f: {'pk': f.disposable_author.pk}),
+    Scenario('issues list', 'GET', 'library:bookissue-list'),
+    Scenario('issue retrieve', 'GET', 'library:bookissue-detail', lambda f: {'pk': f.returned_issue.pk}),
+    Scenario('issue create', 'POST', 'library:bookissue-list',
+             data=lambda f: {'book': f.available_book.pk, 'user': f.user.pk}),
+    Scenario('issue return', 'PATCH', 'library:bookissue-detail', lambda f: {'pk': f.open_issue.pk},
+             data=lambda f: {'return_date': str(datetime.date.today()), 'rating': 5}),
+    Scenario('issue rating', 'PATCH', 'library:bookissue-detail', lambda f: {'pk': f.returned_issue.pk},
+             data=lambda f: {'rating': 4}),
+    Scenario('issues bulk issue', 'POST', 'library:bookissue-bulk-issue',
+             data=lambda f: {'items': [{'book': pk, 'user': f.user.pk} for pk in f.available_books]}),
+    Scenario('issues bulk return', 'POST', 'library:bookissue-bulk-return',
+             data=lambda f: {'items': [{'id': pk, 'rating': 5} for pk in f.open_issues]}),
+    Scenario('issue delete', 'DELETE', 'library:bookissue-detail', lambda f: {'pk': f.returned_issue.pk}),
+    Scenario('issues export week', 'GET', 'library:bookissue-export',
+             params={'file_format': 'ndjson', 'date_from': str(datetime.date.today() - datetime.timedelta(days=7))}),
+    Scenario('stats list', 'GET', 'library:readingstats-list', params={'dimension': 'genre'}),
+    Scenario('stats retrieve', 'GET', 'library:readingstats-detail', lambda f: {'pk': f.stats.pk}),
+    Scenario('async books list', 'GET', 'library:async-book-list', params={'page_size': 20}),
+    Scenario('async book retrieve', 'GET', 'library:async-book-detail', lambda f: {'pk': f.book.pk}),
+    Scenario('async authors list', 'GET', 'library:async-author-list'),
+    Scenario('async author retrieve', 'GET', 'library:async-author-detail', lambda f: {'pk': f.author.pk}),
+    Scenario('async issues list', 'GET', 'library:async-bookissue-list'),
+    Scenario('async issue retrieve', 'GET', 'library:async-bookissue-detail',
+             lambda f: {'pk': f.returned_issue.pk}),
+    Scenario('users list', 'GET', 'users:user_list'),
+    Scenario('user register', 'POST', 'users:register', authenticated=False,
+             data=lambda f: {'email': f"bench{f.unique()}@example.com", 'password': SEED_PASSWORD}),
+    Scenario('user login', 'POST', 'users:login', authenticated=False,
+             data=lambda f: {'email': f.user.email, 'password': SEED_PASSWORD}),
+    Scenario('token refresh', 'POST', 'users:token_refresh', authenticated=False,
+             data=lambda f: {'refresh': f.refresh_token}),
+]
+
+
+def route_names():
+    """Имена всех маршрутов library/urls.py и users/urls.py"""
+    from library.urls import async_router, router, urlpatterns as library_patterns
+    from users.urls import urlpatterns as users_patterns
+
+    names = {f"library:{pattern.name}" for pattern in [*router.urls, *async_router.urls] if pattern.name}
+    names.update(f"library:{pattern.name}" for pattern in library_patterns if getattr(pattern, 'name', None))
+    names.update(f"users:{pattern.name}" for pattern in users_patterns if pattern.name)
+    return names - EXCLUDED_ROUTES
+
+
+def uncovered_routes(scenarios=SCENARIOS):
+    return sorted(route_names() - {scenario.route for scenario in scenarios})
+
+
+class EndpointBenchmark:
+
+    def __init__(self, user, requests=50, warmup=3, memory_requests=5, warm_cache=False):
+        self.requests = requests
+        self.warmup = warmup
+        self.memory_requests = memory_requests
+        self.warm_cache = warm_cache
+        self.fixtures = Fixtures(user)
+        self.token = str(ClaimsTokenObtainPairSerializer.get_token(user).access_token)
+
+    def request(self, client, scenario):
+        path = reverse(scenario.route, kwargs=scenario.kwargs(self.fixtures))
+        if scenario.params:
+            path = f"{path}?{'&'.join(f'{key}={value}' for key, value in scenario.params.items())}"
+        body = scenario.data(self.fixtures) if scenario.data else None
+        if body is not None and scenario.content_type == 'application/json':
+            body = json.dumps(body)
+        client.credentials(**({'HTTP_AUTHORIZATION': f"Bearer {self.token}"} if scenario.authenticated else {}))
+
+        if not self.warm_cache:
+            get_cache().clear()
+        # Изменяющие запросы откатываются, чтобы каждый запрос работал с одними и теми же данными
+        with transaction.atomic() if scenario.writes else nullcontext():
+            started = time.perf_counter()
+            response = client.generic(scenario.method, path, body or '', content_type=scenario.content_type)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            elapsed = time.perf_counter() - started
+            if scenario.writes:
+                transaction.set_rollback(True)
+        return response, elapsed
+
+    def run_scenario(self, scenario):
+        client = APIClient()
+        for _ in range(self.warmup):
+            self.request(client, scenario)
+
+        timings = []
+        with QueryCounter() as counter:
+            for _ in range(self.requests):
+                response, elapsed = self.request(client, scenario)
+                timings.append(elapsed * 1000)
+
+        tracemalloc.start()
+        try:
+            for _ in range(self.memory_requests):
+                self.request(client, scenario)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        percentiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        return {
+            'name': scenario.name,
+            'method': scenario.method,
+            'route': scenario.route,
+            'status': response.status_code,
+            'requests': len(timings),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'p50_ms': round(percentiles[49], 3),
+            'p95_ms': round(percentiles[94], 3),
+            'p99_ms': round(percentiles[98], 3),
+            'queries_per_request': round(len(counter) / len(timings), 2),
+            'peak_memory_kib': round(peak / 1024, 1),
+        }
+
+    def run(self, scenarios=SCENARIOS, log=None):
+        results = []
+        for scenario in scenarios:
+            result = self.run_scenario(scenario)
+            results.append(result)
+            if log:
+                log(result)
+        return {
+            'meta': {
+                'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'requests': self.requests,
+                'warm_cache': self.warm_cache,
+                'rows': {
+                    'books': Book.objects.count(),
+                    'authors': Author.objects.count(),
+                    'book_issues': BookIssue.objects.count(),
+                },
+            },
+            'results': results,
+        }
@@ -0,0 +1,157 @@
+"""
+    Кеш ответов списков и карточек книг и авторов.
+
+    Ответы хранятся в кеше 'api' (настройка API_CACHE_BACKEND: 'locmem' - LRU в памяти процесса,
+    'file' - файлы на диске, 'db' - таблица в базе). Ключ включает схему, хост, путь, параметры запроса и версии данных:
+        - поколение списка пространства имен (books, authors) - меняется при любом изменении его объектов
+        - версия объекта для карточки - меняется только при изменении этого объекта
+    Ответ, который зависит и от других пространств имен (авторы со статистикой книг), включает и их поколения
+    (get_cache_dependencies).
+    Версии меняются сигналами моделей (library/signals.py) сразу и повторно после фиксации транзакции,
+    поэтому устаревший ответ, посчитанный во время транзакции, не будет использован.
+    Карточки отдают ETag, при совпадении If-None-Match возвращается 304 без запроса к базе и сериализации.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from library.db_routing import reads_from_replica
+
+BOOKS = 'books'
+AUTHORS = 'authors'
+
+
+def get_cache():
+    return caches['api']
+
+
+def _token_key(namespace, pk=None):
+    return f"api:gen:{namespace}" if pk is None else f"api:ver:{namespace}:{pk}"
+
+
+def get_tokens(*keys):
+    """Текущие версии, отсутствующие создаются"""
+    cache = get_cache()
+    tokens = cache.get_many(keys)
+    for key in keys:
+        if key not in tokens:
+            cache.add(key, uuid.uuid4().hex, None)
+            tokens[key] = cache.get(key)
+    return [tokens[key] for key in keys]
+
+
+async def aget_tokens(*keys):
+    """get_tokens для async представлений"""
+    cache = get_cache()
+    tokens = await cache.aget_many(keys)
+    for key in keys:
+        if key not in tokens:
+            await cache.aadd(key, uuid.uuid4().hex, None)
+            tokens[key] = await cache.aget(key)
+    return [tokens[key] for key in keys]
+
+
+def _bump(keys):
+    get_cache().set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+
+def invalidate(namespace, *pks):
+    """Сбрасывает списки пространства имен и карточки объектов pks"""
+    keys = [_token_key(namespace)] + [_token_key(namespace, pk) for pk in pks]
+    _bump(keys)
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def _query_hash(request):
+    query = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+    # Ответы с реплики хранятся отдельно: клиент, закрепленный за основной базой после записи,
+    # не должен получить ответ, посчитанный по отстающей реплике
+    source = 'replica' if reads_from_replica() else 'primary'
+    # Ссылки пагинации next/previous абсолютные (build_absolute_uri): ответ для другого хоста или схемы
+    # (внутреннее имя, https за прокси) хранится отдельно
+    origin = f"{request.scheme}://{request.get_host()}"
+    raw = f"{origin}{request.path}?{query}|{request.accepted_renderer.format}|{source}"
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def _plain(data):
+    """ReturnDict/ReturnList хранят ссылку на сериализатор, в кеш кладем обычные dict и list"""
+    if isinstance(data, dict):
+        return {key: _plain(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_plain(value) for value in data]
+    return data
+
+
+class CachedResponseMixin:
+    """
+        Кеширование list и retrieve для ViewSet
+        cache_namespace - пространство имен версий (BOOKS, AUTHORS)
+    """
+
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        generation = ':'.join(get_tokens(self.list_token_key(), *self.dependency_token_keys()))
+        return self._cached_response(self.list_cache_key(request, generation), super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        version = ':'.join(get_tokens(self.detail_token_key(), *self.dependency_token_keys()))
+        etag, key = self.detail_cache_key(request, version)
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = self._cached_response(key, super().retrieve, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
+    def get_cache_dependencies(self):
+        """Другие пространства имен, изменение которых меняет ответ запроса"""
+        return ()
+
+    def dependency_token_keys(self):
+        return [_token_key(namespace) for namespace in self.get_cache_dependencies()]
+
+    def list_token_key(self):
+        return _token_key(self.cache_namespace)
+
+    def list_cache_key(self, request, generation):
+        return f"api:list:{self.cache_namespace}:{generation}:{_query_hash(request)}"
+
+    def detail_token_key(self):
+        return _token_key(self.cache_namespace, self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+
+    def detail_cache_key(self, request, version):
+        """ETag и ключ кеша карточки"""
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        query_hash = _query_hash(request)
+        etag = f'"{self.cache_namespace}-{pk}-{version}-{query_hash[:12]}"'
+        return etag, f"api:detail:{self.cache_namespace}:{pk}:{version}:{query_hash}"
+
+    @staticmethod
+    def _cached_response(key, handler, request, *args, **kwargs):
+        cache = get_cache()
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, _plain(response.data), settings.API_CACHE_TIMEOUT)
+        return response
+
+    @staticmethod
+    async def _acached_response(key, handler, request, *args, **kwargs):
+        """_cached_response для async представлений, handler - корутина"""
+        cache = get_cache()
+        data = await cache.aget(key)
+        if data is not None:
+            return Response(data)
+        response = await handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            await cache.aset(key, _plain(response.data), settings.API_CACHE_TIMEOUT)
+        return response
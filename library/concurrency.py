@@ -0,0 +1,218 @@
+"""
+    Сравнение синхронного (WSGI, пул потоков) и async (ASGI, цикл событий) обслуживания одних и тех же данных
+    при множестве одновременных клиентов (команда bench_concurrency).
+
+    Оба варианта вызываются внутри процесса без сетевого сервера: WSGI приложение - в пуле из workers потоков,
+    как у gunicorn --threads, ASGI приложение - в одном цикле событий, как у uvicorn.
+    Медленный клиент моделируется задержкой client_delay при получении тела ответа: поток WSGI
+    все это время занят, ASGI только ожидает await.
+    Измеряются запросы в секунду, задержки, число потоков и пиковая память (tracemalloc, отдельным проходом).
+"""
+import asyncio
+import statistics
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+
+from users.authentication import ClaimsTokenObtainPairSerializer
+
+# Синхронный и async адрес каждого ресурса
+RESOURCES = {
+    'books': ('/books/', '/async/books/'),
+    'authors': ('/authors/', '/async/authors/'),
+    'book-issues': ('/book-issues/', '/async/book-issues/'),
+}
+
+
+class ThreadCounter:
+    """Максимальное число потоков процесса за время работы контекста"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class ConcurrencyBenchmark:
+
+    def __init__(self, user, resource='book-issues', query='', requests=500, concurrency=50, workers=8,
+                 client_delay=0.02, memory_requests=None):
+        self.sync_path, self.async_path = RESOURCES[resource]
+        self.query = query
+        self.requests = requests
+        self.concurrency = concurrency
+        self.workers = workers
+        self.client_delay = client_delay
+        self.memory_requests = memory_requests or concurrency * 2
+        self.token = str(ClaimsTokenObtainPairSerializer.get_token(user).access_token)
+
+    # WSGI
+
+    def wsgi_environ(self):
+        return {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': self.sync_path,
+            'QUERY_STRING': self.query,
+            'SCRIPT_NAME': '',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'localhost',
+            'HTTP_AUTHORIZATION': f"Bearer {self.token}",
+            'wsgi.input': BytesIO(),
+            'wsgi.errors': BytesIO(),
+            'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+
+    def wsgi_request(self, application):
+        statuses = []
+        body = application(self.wsgi_environ(), lambda status, headers, exc_info=None: statuses.append(status))
+        try:
+            for _ in body:
+                # Поток занят, пока медленный клиент получает ответ
+                if self.client_delay:
+                    time.sleep(self.client_delay)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return int(statuses[0][:3])
+
+    def run_wsgi(self, requests):
+        application = get_wsgi_application()
+        timings, statuses = [], []
+        remaining = iter(range(requests))
+        lock = threading.Lock()
+
+        def client(pool):
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                started = time.perf_counter()
+                statuses.append(pool.submit(self.wsgi_request, application).result())
+                timings.append(time.perf_counter() - started)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            clients = [threading.Thread(target=client, args=(pool,)) for _ in range(self.concurrency)]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+        return timings, statuses
+
+    # ASGI
+
+    def asgi_scope(self):
+        return {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': self.async_path,
+            'raw_path': self.async_path.encode(),
+            'query_string': self.query.encode(),
+            'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'authorization', f"Bearer {self.token}".encode())],
+            'server': ('localhost', 80),
+            'client': ('127.0.0.1', 50000),
+        }
+
+    async def asgi_request(self, application):
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        disconnected = asyncio.Event()
+        statuses = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # Клиент не отключается: Django ждет http.disconnect, пока формирует ответ
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            elif message['type'] == 'http.response.body' and self.client_delay:
+                await asyncio.sleep(self.client_delay)
+
+        try:
+            await application(self.asgi_scope(), receive, send)
+        finally:
+            disconnected.set()
+        return statuses[0]
+
+    def run_asgi(self, requests):
+        application = get_asgi_application()
+        timings, statuses = [], []
+        remaining = iter(range(requests))
+
+        async def client():
+            while next(remaining, None) is not None:
+                started = time.perf_counter()
+                statuses.append(await self.asgi_request(application))
+                timings.append(time.perf_counter() - started)
+
+        async def main():
+            await asyncio.gather(*[client() for _ in range(self.concurrency)])
+
+        asyncio.run(main())
+        return timings, statuses
+
+    def measure(self, mode):
+        runner = self.run_wsgi if mode == 'wsgi' else self.run_asgi
+        with ThreadCounter() as threads:
+            started = time.perf_counter()
+            timings, statuses = runner(self.requests)
+            elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        try:
+            runner(self.memory_requests)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        percentiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        return {
+            'mode': mode,
+            'path': urlsplit(self.sync_path if mode == 'wsgi' else self.async_path).path,
+            'requests': len(timings),
+            'errors': sum(status >= 400 for status in statuses),
+            'requests_per_second': round(len(timings) / elapsed, 1),
+            'p50_ms': round(percentiles[49] * 1000, 2),
+            'p95_ms': round(percentiles[94] * 1000, 2),
+            'peak_threads': threads.peak,
+            'peak_memory_kib': round(peak / 1024, 1),
+        }
+
+    def run(self, modes=('wsgi', 'asgi'), log=None):
+        results = []
+        for mode in modes:
+            result = self.measure(mode)
+            results.append(result)
+            if log:
+                log(result)
+        return results
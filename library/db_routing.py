@@ -0,0 +1,128 @@
+"""
+    Чтение с реплик базы данных с закреплением клиента за основной базой после записи.
+
+    Реплики перечислены в настройке DATABASE_REPLICAS (псевдонимы из DATABASES), маршрутизатор
+    PrimaryReplicaRouter подключен через DATABASE_ROUTERS.
+    ReplicaRoutingMiddleware выбирает базу для чтения на время запроса:
+        - GET/HEAD/OPTIONS - случайная реплика, одна на весь запрос
+        - остальные методы - основная база для чтения и записи, после ответа клиент закрепляется
+          за основной базой на REPLICA_STICKY_SECONDS секунд (read-your-writes): клиент, только что вернувший
+          книгу, не увидит ее выданной из отстающей реплики. Закрепляется любой небезопасный запрос,
+          в том числе с ошибкой: часть изменений могла быть записана
+    Клиент определяется по заголовку Authorization, без него - по адресу. Закрепления хранятся в кеше
+    REPLICA_PIN_CACHE, при нескольких процессах это должен быть общий кеш (Redis, Memcached).
+    Вне запросов (команды управления, фоновые задачи) и для моделей других приложений чтение идет с основной базы.
+"""
+import contextvars
+import hashlib
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+
+PRIMARY = 'default'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Приложения, модели которых читаются с реплик. Пользователи и группы читаются с основной базы:
+# только что зарегистрированный пользователь и новая роль должны работать сразу
+REPLICA_APP_LABELS = {'library'}
+
+# Псевдоним базы для чтения в текущем запросе, None - основная база
+read_database = contextvars.ContextVar('read_database', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def get_pin_cache():
+    return caches[getattr(settings, 'REPLICA_PIN_CACHE', 'default')]
+
+
+def get_sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+
+
+def reads_from_replica():
+    """Читает ли текущий запрос с реплики, используется в ключах кеша ответов"""
+    return read_database.get() is not None
+
+
+def client_pin_key(request):
+    """Ключ закрепления клиента: хеш заголовка Authorization, без него - адрес клиента"""
+    authorization = request.headers.get('Authorization')
+    client = f"auth:{authorization}" if authorization else f"addr:{request.META.get('REMOTE_ADDR')}"
+    return f"db:pin:{hashlib.sha1(client.encode()).hexdigest()}"
+
+
+class PrimaryReplicaRouter:
+    """Чтение моделей REPLICA_APP_LABELS с реплики, выбранной для текущего запроса, запись - в основную базу"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in REPLICA_APP_LABELS:
+            return PRIMARY
+        return read_database.get() or PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        databases = {PRIMARY, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Выбирает базу для чтения на время запроса и закрепляет клиента за основной базой после записи"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        replicas = get_replicas()
+        if not replicas:
+            return self.get_response(request)
+
+        key = client_pin_key(request)
+        database = None
+        if request.method in SAFE_METHODS and not get_pin_cache().get(key):
+            database = random.choice(replicas)
+        token = read_database.set(database)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_database.reset(token)
+        if request.method not in SAFE_METHODS:
+            get_pin_cache().set(key, 1, get_sticky_seconds())
+        return response
+
+    async def __acall__(self, request):
+        replicas = get_replicas()
+        if not replicas:
+            return await self.get_response(request)
+
+        key = client_pin_key(request)
+        database = None
+        if request.method in SAFE_METHODS and not await get_pin_cache().aget(key):
+            database = random.choice(replicas)
+        # Значение контекстной переменной видно и в потоках sync_to_async, где async ORM выполняет запросы
+        token = read_database.set(database)
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_database.reset(token)
+        if request.method not in SAFE_METHODS:
+            await get_pin_cache().aset(key, 1, get_sticky_seconds())
+        return response
@@ -0,0 +1,94 @@
+"""
+    Потоковая выгрузка истории выдач книг в CSV и NDJSON.
+
+    Строки читаются из базы через .iterator(chunk_size=...) и сразу отдаются клиенту, поэтому память
+    не зависит от объема выгрузки. Заголовок CSV уходит до выполнения запроса к базе, первые строки -
+    после чтения первой порции (на PostgreSQL используется серверный курсор).
+"""
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from library.models import BookIssue
+
+# Поля выгрузки совпадают с BookIssueSerializer
+EXPORT_FIELDS = (
+    'id',
+    'book',
+    'book_title',
+    'user',
+    'user_email',
+    'issue_date',
+    'return_date',
+    'is_returned',
+    'rating',
+)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Сколько строк объединять в один фрагмент ответа
+ROWS_PER_CHUNK = 500
+
+
+# Колонки запроса в порядке EXPORT_FIELDS, название книги и почта берутся JOIN в том же запросе
+EXPORT_COLUMNS = (
+    'id',
+    'book_id',
+    'book__title',
+    'user_id',
+    'user__email',
+    'issue_date',
+    'return_date',
+    'is_returned',
+    'rating',
+)
+
+
+def export_queryset():
+    return BookIssue.objects.select_related('book', 'user').order_by('id')
+
+
+def iter_issue_rows(queryset, chunk_size=2000):
+    """
+        Кортежи строк выгрузки. values_list вместо моделей: выгрузка в несколько раз быстрее,
+        а JOIN с книгой и пользователем остается тем же, что дает select_related
+    """
+    return queryset.values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+
+
+class Echo:
+    """Объект с методом write для csv.writer, возвращает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def _batched(lines):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= ROWS_PER_CHUNK:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    yield from _batched(writer.writerow(row) for row in rows)
+
+
+def stream_ndjson(rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    yield from _batched(encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n' for row in rows)
+
+
+STREAMS = {
+    'csv': stream_csv,
+    'ndjson': stream_ndjson,
+}
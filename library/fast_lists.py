@@ -0,0 +1,139 @@
+"""
+    Быстрый путь list для чтения: строки страницы строятся из .values() без экземпляров моделей
+    и без полей сериализатора DRF.
+
+    ValuesRepresentation описывает ответ так же, как сериализатор представления: имя поля, путь в .values()
+    и преобразование значения. Ответ должен совпадать с сериализатором байт в байт, это проверяют тесты
+    (library/tests.py, FastListTestCase). Выборочные поля ?fields= и ?omit= поддерживаются.
+    Путь включается настройкой API_FAST_LISTS, при выключенной настройке работает сериализатор.
+"""
+from django.conf import settings
+from rest_framework.response import Response
+
+from library.fieldsets import FieldSelection
+from library.instrumentation import timed_serialization
+
+
+def iso_date(value):
+    """Как DateField.to_representation при DATE_FORMAT = ISO 8601"""
+    return value.isoformat() if value is not None else None
+
+
+def average_rating(value):
+    """Как BookSerializer.get_average_rating"""
+    return round(value or 0, 2)
+
+
+class ValuesRepresentation:
+    """
+        fields - кортеж (имя, путь в .values(), преобразование или None),
+        для вложенного объекта вместо пути - такой же кортеж полей
+    """
+
+    fields = ()
+
+    def __init__(self, selection):
+        self.selection = selection
+        self.layout = self._layout(self.fields, [])
+
+    def _layout(self, fields, prefix):
+        layout = []
+        for name, source, convert in fields:
+            path = [*prefix, name]
+            if not self.selection.includes(path):
+                continue
+            if isinstance(source, tuple):
+                layout.append((name, self._layout(source, path), None))
+            else:
+                layout.append((name, source, convert))
+        return layout
+
+    def columns(self, layout=None):
+        columns = []
+        for _, source, _ in self.layout if layout is None else layout:
+            columns.extend(self.columns(source) if isinstance(source, list) else [source])
+        return columns
+
+    def to_representation(self, row, layout=None):
+        data = {}
+        for name, source, convert in self.layout if layout is None else layout:
+            if isinstance(source, list):
+                data[name] = self.to_representation(row, source)
+            else:
+                data[name] = convert(row[source]) if convert else row[source]
+        return data
+
+
+class ValuesListMixin:
+    """
+        list для ViewSet через .values(): values_representation_class - описание ответа (ValuesRepresentation)
+        Дополнительно выбираются поля сортировки, по которым KeysetPagination строит курсор
+    """
+
+    values_representation_class = None
+
+    def use_values_list(self):
+        return getattr(settings, 'API_FAST_LISTS', True) and self.values_representation_class is not None
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_values_list():
+            return super().list(request, *args, **kwargs)
+
+        representation, rows = self.get_values_rows(request, self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        return self.values_response(representation, rows if page is None else page, page is not None)
+
+    def get_values_rows(self, request, queryset):
+        """Описание ответа и .values() с колонками ответа, ранга поиска и сортировки"""
+        representation = self.values_representation_class(FieldSelection.from_request(request))
+        columns = set(representation.columns())
+        columns.update(queryset.query.annotations.keys() & {'search_rank'})
+        get_ordering = getattr(self.paginator, 'get_ordering', None)
+        if get_ordering is not None:
+            columns.update(field.lstrip('-') for field in get_ordering(request, queryset, self))
+        return representation, queryset.values(*columns)
+
+    def values_response(self, representation, rows, paginated):
+        with timed_serialization():
+            data = [representation.to_representation(row) for row in rows]
+        return self.get_paginated_response(data) if paginated else Response(data)
+
+
+AUTHOR_FIELDS = (
+    ('id', 'author__id', None),
+    ('name', 'author__name', None),
+    ('birth_date', 'author__birth_date', iso_date),
+    ('biography', 'author__biography', None),
+)
+
+
+class BookValues(ValuesRepresentation):
+    """Ответ BookSerializer"""
+
+    fields = (
+        ('id', 'id', None),
+        ('author', AUTHOR_FIELDS, None),
+        ('user', 'user__email', None),
+        ('average_rating', 'average_rating_value', average_rating),
+        ('title', 'title', None),
+        ('genre', 'genre', None),
+        ('published_date', 'published_date', iso_date),
+        ('description', 'description', None),
+        ('open_issues_count', 'open_issues_count', None),
+    )
+
+
+class BookIssueValues(ValuesRepresentation):
+    """Ответ BookIssueSerializer"""
+
+    fields = (
+        ('id', 'id', None),
+        ('book', 'book_id', None),
+        ('book_title', 'book__title', None),
+        ('user', 'user_id', None),
+        ('user_email', 'user__email', None),
+        ('issue_date', 'issue_date', iso_date),
+        ('return_date', 'return_date', iso_date),
+        ('is_returned', 'is_returned', None),
+        ('rating', 'rating', None),
+    )
@@ -0,0 +1,89 @@
+"""
+    Выборочные поля ответа (sparse fieldsets): ?fields= и ?omit=
+
+    Поля перечисляются через запятую, вложенные - через точку:
+        /books/?fields=id,title,author.name
+        /books/?omit=average_rating,description,author.biography
+    Поля отбираются в сериализаторах с SparseFieldsetsMixin, а представления по той же выборке (FieldSelection)
+    убирают лишнюю работу в базе: аннотацию рейтинга, текстовые колонки, join-ы неиспользуемых связей.
+    Работает только для чтения (GET, HEAD, OPTIONS), при записи сериализатор принимает и отдает все поля.
+
+    Дополнительные части ответа, которые стоят запросов к базе, включаются явно параметром ?include=:
+        /authors/?include=stats,books
+"""
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import ListSerializer
+
+
+def parse_fieldset(value):
+    """'id,author.name' -> {'id': {}, 'author': {'name': {}}}"""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for part in path.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def requested_includes(request, allowed):
+    """Значения ?include= для чтения, allowed - допустимые значения, неизвестные - ошибка 400"""
+    if request is None or request.method not in SAFE_METHODS:
+        return set()
+    includes = {value.strip() for value in request.query_params.get('include', '').split(',') if value.strip()}
+    unknown = includes - set(allowed)
+    if unknown:
+        raise ValidationError({'include': f"Допустимые значения: {', '.join(allowed)}"})
+    return includes
+
+
+class FieldSelection:
+    """Выборка полей запроса: fields - только эти поля (None - все), omit - исключить эти поля"""
+
+    def __init__(self, fields=None, omit=None):
+        self.fields = parse_fieldset(fields) if fields else None
+        self.omit = parse_fieldset(omit) if omit else {}
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None or request.method not in SAFE_METHODS:
+            return cls()
+        return cls(request.query_params.get('fields'), request.query_params.get('omit'))
+
+    def includes(self, path):
+        """Входит ли поле в ответ, path - 'author.name' или список частей пути"""
+        include, omit = self.fields, self.omit
+        for part in path.split('.') if isinstance(path, str) else path:
+            if include is not None:
+                if part not in include:
+                    return False
+                include = include[part] or None
+            if omit is not None:
+                if part in omit and not omit[part]:
+                    return False
+                omit = omit.get(part)
+        return True
+
+
+class SparseFieldsetsMixin:
+    """
+        Оставляет в сериализаторе только поля из ?fields= без полей из ?omit=
+        Вложенные сериализаторы (author в книге) с этим миксином отбирают поля по своему пути (author.name)
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = FieldSelection.from_request(self.context.get('request'))
+        prefix = self.get_field_path()
+        return {name: field for name, field in fields.items() if selection.includes([*prefix, name])}
+
+    def get_field_path(self):
+        path = []
+        node = self
+        while node.parent is not None:
+            # Элемент списка (many=True) привязан к ListSerializer с пустым именем поля
+            if not isinstance(node.parent, ListSerializer):
+                path.insert(0, node.field_name)
+            node = node.parent
+        return path
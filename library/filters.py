@@ -1,6 +1,8 @@
 import django_filters
-from library.models import Book
-from django.db.models import Q
+from rest_framework import filters
+
+from library.models import Book, BookIssue, ReadingStats
+from library.search import get_book_search
 
 
 class BookFilter(django_filters.FilterSet):
@@ -8,20 +10,66 @@ class BookFilter(django_filters.FilterSet):
     author__name = django_filters.CharFilter(lookup_expr='icontains')  # Частичное совпадение
     genre = django_filters.CharFilter(lookup_expr='icontains')  # Частичное совпадение
     is_returned = django_filters.BooleanFilter(method='filter_is_returned', label='Is Returned')
+    search = django_filters.CharFilter(method='filter_search', label='Search')  # Поиск по индексу с учетом опечаток
 
     class Meta:
         model = Book
-        fields = ['title', 'author__name', 'genre', 'is_returned']
+        fields = ['title', 'author__name', 'genre', 'is_returned', 'search']
 
     @staticmethod
     def filter_is_returned(queryset, name, value):
         """
             Фильтрация по книгам, которые не на руках
-            Инвертируем условие ~Q(...), чтобы оставить только свободные
-            distinct() - берем уникальные значения, чтобы исключить дубли
+            Используем индексируемый счетчик Book.open_issues_count вместо join по выдачам
         """
 
         if value:
-            return queryset.filter(~Q(issues__is_returned=False)).distinct()
+            return queryset.available()
         else:
-            return queryset.filter(issues__is_returned=False).distinct()
+            return queryset.issued()
+
+    @staticmethod
+    def filter_search(queryset, name, value):
+        """
+            Ранжированный поиск по названию, автору и жанру, устойчивый к опечаткам
+            Добавляет аннотацию search_rank, по которой SearchOrderingFilter сортирует результат
+        """
+
+        if not value.strip():
+            return queryset
+        return get_book_search().search(queryset, value)
+
+
+class BookIssueExportFilter(django_filters.FilterSet):
+    """Фильтры выгрузки истории выдач: период по дате выдачи и пользователь"""
+
+    date_from = django_filters.DateFilter(field_name='issue_date', lookup_expr='gte')
+    date_to = django_filters.DateFilter(field_name='issue_date', lookup_expr='lte')
+
+    class Meta:
+        model = BookIssue
+        fields = ['date_from', 'date_to', 'user']
+
+
+class ReadingStatsFilter(django_filters.FilterSet):
+    dimension = django_filters.ChoiceFilter(choices=ReadingStats.DIMENSIONS)
+    key = django_filters.CharFilter()
+
+    class Meta:
+        model = ReadingStats
+        fields = ['dimension', 'key']
+
+
+class SearchOrderingFilter(filters.OrderingFilter):
+    """
+        При поиске (?search=) сортировка по умолчанию - по релевантности, при равной релевантности - как обычно,
+        явный параметр ordering по-прежнему имеет приоритет
+    """
+
+    search_param = 'search'
+
+    def get_default_ordering(self, view):
+        request = getattr(view, 'request', None)
+        if request is not None and request.query_params.get(self.search_param, '').strip():
+            return ['-search_rank', *(super().get_default_ordering(view) or [])]
+        return super().get_default_ordering(view)
@@ -0,0 +1,179 @@
+"""
+    Массовая загрузка каталога книг из потока NDJSON или CSV.
+
+    Поток обрабатывается частями по chunk_size строк. Для каждой части авторы загружаются одним запросом
+    по identity_key (library/authors.py), недостающие авторы и все книги создаются через bulk_create в одной транзакции.
+    Найденные авторы запоминаются на всю загрузку: повторяющиеся авторы следующих частей не запрашиваются.
+    Ошибки отдельных строк попадают в отчет и не прерывают загрузку.
+
+    Формат NDJSON - одна книга в строке, как в POST /books/:
+        {"title": "...", "genre": "...", "published_date": "1833-01-01", "author": {"name": "...", ...}}
+    Формат CSV - заголовок с колонками title, genre, published_date, description,
+        author_name, author_birth_date, author_biography
+"""
+import csv
+import json
+import time
+from itertools import islice
+
+from django.db import DatabaseError, transaction
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+
+from library import cache
+from library.authors import identity_key
+from library.models import Author, Book
+from library.autocomplete import autocomplete_index
+from library.search import book_search_index
+from library.serializers import BookSerializer
+
+CSV_AUTHOR_COLUMNS = {
+    'author_name': 'name',
+    'author_birth_date': 'birth_date',
+    'author_biography': 'biography',
+}
+
+BOOK_FIELDS = ('title', 'genre', 'published_date', 'description')
+
+# Сколько ошибок строк хранить в отчете, остальные только считаются
+MAX_REPORTED_ERRORS = 1000
+
+
+def decode_lines(lines):
+    for line in lines:
+        yield line.decode('utf-8-sig') if isinstance(line, bytes) else line
+
+
+def iter_ndjson(lines):
+    """(номер строки, данные книги или None, ошибка)"""
+    for number, line in enumerate(decode_lines(lines), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, None, f"Некорректный JSON: {error}"
+            continue
+        if not isinstance(row, dict):
+            yield number, None, "Ожидается JSON объект"
+            continue
+        yield number, row, None
+
+
+def iter_csv(lines):
+    reader = csv.DictReader(decode_lines(lines))
+    for row in reader:
+        author = {target: row.pop(column) for column, target in CSV_AUTHOR_COLUMNS.items() if row.get(column)}
+        book = {key: value for key, value in row.items() if key in BOOK_FIELDS and value not in (None, '')}
+        yield reader.line_num, {**book, 'author': author}, None
+
+
+READERS = {
+    'ndjson': iter_ndjson,
+    'csv': iter_csv,
+}
+
+
+def author_key(author_data):
+    """Ключ автора в словаре загрузки, совпадает с Author.identity_key"""
+    return identity_key(author_data['name'], author_data.get('birth_date'))
+
+
+class BookIngestor:
+    """Загрузка книг частями, книги создаются от имени user_id"""
+
+    def __init__(self, user_id, chunk_size=1000):
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.books_created = 0
+        self.authors_created = 0
+        self.errors_count = 0
+        self.errors = []
+        # Авторы зафиксированных частей {identity_key: Author}
+        self.authors = {}
+        # Один сериализатор на всю загрузку: построение полей ModelSerializer дороже самой проверки строки
+        self.serializer = BookSerializer()
+
+    def add_error(self, row_number, error):
+        self.errors_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'errors': error})
+
+    def ingest(self, rows):
+        """rows - итератор (номер строки, данные книги, ошибка разбора), возвращает отчет о загрузке"""
+        started = time.perf_counter()
+        rows = iter(rows)
+        while chunk := list(islice(rows, self.chunk_size)):
+            self.ingest_chunk(chunk)
+        if self.books_created:
+            # bulk_create не отправляет сигналы, сбрасываем индексы поиска и подсказок и кеш ответов явно
+            transaction.on_commit(book_search_index.reset)
+            transaction.on_commit(autocomplete_index.reset)
+            cache.invalidate(cache.BOOKS)
+            cache.invalidate(cache.AUTHORS)
+        return self.report(time.perf_counter() - started)
+
+    def ingest_chunk(self, chunk):
+        valid = []
+        for row_number, data, error in chunk:
+            self.rows += 1
+            if error:
+                self.add_error(row_number, error)
+                continue
+            try:
+                validated_data = self.serializer.run_validation(data)
+            except ValidationError as error:
+                self.add_error(row_number, as_serializer_error(error))
+                continue
+            valid.append((row_number, validated_data))
+        if not valid:
+            return
+
+        try:
+            with transaction.atomic():
+                authors, created = self.resolve_authors([data['author'] for _, data in valid])
+                books = Book.objects.bulk_create([
+                    Book(author=authors[author_key(data['author'])], user_id=self.user_id,
+                         **{field: value for field, value in data.items() if field != 'author'})
+                    for _, data in valid
+                ])
+        except DatabaseError as error:
+            for row_number, _ in valid:
+                self.add_error(row_number, f"Ошибка записи в базу: {error}")
+            return
+        # Авторы части запоминаются только после фиксации: при откате созданных авторов нет в базе
+        self.authors.update(authors)
+        self.authors_created += len(created)
+        self.books_created += len(books)
+
+    def resolve_authors(self, authors_data):
+        """
+            Авторы части {identity_key: Author} и список созданных: уже известные берутся из памяти загрузки,
+            остальные загружаются одним запросом по уникальному индексу, новые создаются одним bulk_create
+        """
+        authors, missing, created = {}, {}, []
+        for data in authors_data:
+            key = author_key(data)
+            if key in self.authors:
+                authors[key] = self.authors[key]
+            else:
+                missing.setdefault(key, data)
+        if missing:
+            authors.update((author.identity_key, author) for author in Author.objects.filter(identity_key__in=missing))
+            # bulk_create не вызывает save(), ключ задается явно
+            created = [Author(identity_key=key, **data) for key, data in missing.items() if key not in authors]
+            Author.objects.bulk_create(created)
+            authors.update((author.identity_key, author) for author in created)
+        return authors, created
+
+    def report(self, elapsed):
+        return {
+            'rows': self.rows,
+            'books_created': self.books_created,
+            'authors_created': self.authors_created,
+            'errors_count': self.errors_count,
+            'errors': self.errors,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(self.rows / elapsed, 1) if elapsed else None,
+        }
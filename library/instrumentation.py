@@ -0,0 +1,281 @@
+"""
+    Инструментирование запросов: время SQL, сериализации и обработки, заголовок Server-Timing,
+    журнал медленных запросов и метрики Prometheus.
+
+    InstrumentationMiddleware для каждого запроса пишет общее время в гистограмму маршрута.
+    Для доли запросов INSTRUMENTATION_SAMPLE_RATE дополнительно собираются SQL запросы (число, время, текст)
+    и время сериализаторов (TimedSerializerMixin, ValuesRepresentation), они отдаются заголовком
+        Server-Timing: db;dur=12.1;desc="5 SQL", serializer;dur=3.4, app;dur=6.0, total;dur=21.5
+    Запросы дольше SLOW_REQUEST_THRESHOLD_MS пишутся в журнал 'library.instrumentation'
+    с INSTRUMENTATION_TOP_QUERIES самыми долгими SQL запросами.
+    Метрики накапливаются в памяти процесса и отдаются в текстовом формате Prometheus по адресу /metrics/.
+"""
+import contextvars
+import logging
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# Метрики текущего запроса, None - запрос не попал в выборку
+current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+# Группы регулярных выражений маршрутов роутера DRF: (?P<pk>[^/.]+) -> <pk>
+ROUTE_GROUP_RE = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+class RequestMetrics:
+    """SQL запросы и время сериализации одного запроса, подключается к базам через execute_wrapper"""
+
+    def __init__(self):
+        self.queries = []
+        self.serializer_seconds = 0.0
+        self._stack = ExitStack()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - started, sql))
+
+    def connect(self):
+        """Подключения к базам принадлежат потоку: вызывается в потоке, который выполняет SQL запросы"""
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+
+    def disconnect(self):
+        self._stack.close()
+
+    def __enter__(self):
+        self.connect()
+        self._token = current_metrics.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        current_metrics.reset(self._token)
+        self.disconnect()
+
+    @property
+    def db_seconds(self):
+        return sum(duration for duration, _ in self.queries)
+
+    def top_queries(self, count):
+        return sorted(self.queries, key=lambda query: query[0], reverse=True)[:count]
+
+
+class timed_serialization:
+    """Добавляет время блока к времени сериализации текущего запроса"""
+
+    __slots__ = ('metrics', 'started')
+
+    def __enter__(self):
+        self.metrics = current_metrics.get()
+        if self.metrics is not None:
+            self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            self.metrics.serializer_seconds += time.perf_counter() - self.started
+
+
+class TimedSerializerMixin:
+    """Время to_representation корневого сериализатора (и элементов списка many=True) попадает в метрики запроса"""
+
+    def to_representation(self, instance):
+        if current_metrics.get() is None or not self._is_root():
+            return super().to_representation(instance)
+        with timed_serialization():
+            return super().to_representation(instance)
+
+    def _is_root(self):
+        parent = self.parent
+        return parent is None or (parent.parent is None and getattr(parent, 'child', None) is self)
+
+
+class MetricsRegistry:
+    """Гистограммы длительности и счетчики SQL по маршрутам, общие для потоков процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.durations = defaultdict(lambda: [[0] * len(DURATION_BUCKETS), 0, 0.0])
+            self.sampled = defaultdict(lambda: [0, 0, 0.0, 0.0])  # запросов, SQL, время SQL, время сериализации
+
+    def observe(self, labels, seconds, metrics=None):
+        with self._lock:
+            buckets, _, _ = entry = self.durations[labels]
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+                    break
+            entry[1] += 1
+            entry[2] += seconds
+            if metrics is not None:
+                sampled = self.sampled[labels]
+                sampled[0] += 1
+                sampled[1] += len(metrics.queries)
+                sampled[2] += metrics.db_seconds
+                sampled[3] += metrics.serializer_seconds
+
+    def render(self):
+        """Текстовый формат Prometheus 0.0.4"""
+        with self._lock:
+            durations = {labels: (entry[0][:], entry[1], entry[2]) for labels, entry in self.durations.items()}
+            sampled = {labels: values[:] for labels, values in self.sampled.items()}
+
+        lines = [
+            '# HELP http_request_duration_seconds Время обработки запроса',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for labels, (buckets, count, total) in sorted(durations.items()):
+            label_text = format_labels(labels)
+            cumulative = 0
+            for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f'http_request_duration_seconds_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f'http_request_duration_seconds_sum{{{label_text}}} {total:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{label_text}}} {count}')
+
+        for name, index, help_text in (
+            ('http_sampled_requests_total', 0, 'Запросы с подробным инструментированием'),
+            ('http_sampled_db_queries_total', 1, 'SQL запросы в запросах выборки'),
+            ('http_sampled_db_duration_seconds_total', 2, 'Время SQL в запросах выборки'),
+            ('http_sampled_serializer_duration_seconds_total', 3, 'Время сериализации в запросах выборки'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for labels, values in sorted(sampled.items()):
+                value = values[index]
+                lines.append(f'{name}{{{format_labels(labels)}}} {value if index < 2 else round(value, 6)}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    method, route, status = labels
+    route = route.replace('\\', '\\\\').replace('"', '\\"')
+    return f'method="{method}",route="{route}",status="{status}"'
+
+
+registry = MetricsRegistry()
+
+
+def get_route(request):
+    """Шаблон маршрута вместо пути, чтобы число рядов метрик не зависело от id в адресах"""
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return 'unmatched'
+    if not resolver_match.route:
+        return resolver_match.view_name
+    return '/' + ROUTE_GROUP_RE.sub(r'<\1>', resolver_match.route).lstrip('^').rstrip('$')
+
+
+class InstrumentationMiddleware:
+    """
+        Подключается первым в MIDDLEWARE, чтобы общее время включало остальные middleware.
+        Работает и в async цепочке (ASGI): async ORM выполняет SQL запросы в потоке запроса (sync_to_async),
+        поэтому обертка SQL подключается в этом потоке
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not get_setting('INSTRUMENTATION_ENABLED', True):
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        if self.sampled():
+            with RequestMetrics() as metrics:
+                response = self.get_response(request)
+        else:
+            metrics = None
+            response = self.get_response(request)
+        return self.record(request, response, time.perf_counter() - started, metrics)
+
+    async def __acall__(self, request):
+        if not get_setting('INSTRUMENTATION_ENABLED', True):
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        if self.sampled():
+            metrics = RequestMetrics()
+            token = current_metrics.set(metrics)
+            await sync_to_async(metrics.connect)()
+            try:
+                response = await self.get_response(request)
+            finally:
+                metrics.disconnect()
+                current_metrics.reset(token)
+        else:
+            metrics = None
+            response = await self.get_response(request)
+        return self.record(request, response, time.perf_counter() - started, metrics)
+
+    @staticmethod
+    def sampled():
+        return random.random() < get_setting('INSTRUMENTATION_SAMPLE_RATE', 1.0)
+
+    def record(self, request, response, total, metrics):
+        labels = (request.method, get_route(request), response.status_code)
+        registry.observe(labels, total, metrics)
+        if metrics is not None and get_setting('SERVER_TIMING_ENABLED', True):
+            response['Server-Timing'] = self.server_timing(metrics, total)
+        if total * 1000 >= get_setting('SLOW_REQUEST_THRESHOLD_MS', 500):
+            self.log_slow_request(request, labels, total, metrics)
+        return response
+
+    @staticmethod
+    def server_timing(metrics, total):
+        db, serializer = metrics.db_seconds, metrics.serializer_seconds
+        app = max(total - db - serializer, 0)
+        return (
+            f'db;dur={db * 1000:.1f};desc="{len(metrics.queries)} SQL", serializer;dur={serializer * 1000:.1f}, '
+            f'app;dur={app * 1000:.1f}, total;dur={total * 1000:.1f}'
+        )
+
+    @staticmethod
+    def log_slow_request(request, labels, total, metrics):
+        message = f"Медленный запрос {request.method} {request.get_full_path()}: {total * 1000:.0f} мс"
+        if metrics is None:
+            logger.warning(message, extra={'route': labels[1]})
+            return
+        top = metrics.top_queries(get_setting('INSTRUMENTATION_TOP_QUERIES', 5))
+        message += f", SQL {len(metrics.queries)} запросов {metrics.db_seconds * 1000:.0f} мс, " \
+                   f"сериализация {metrics.serializer_seconds * 1000:.0f} мс"
+        message += ''.join(f"\n  {duration * 1000:.1f} мс: {sql}" for duration, sql in top)
+        logger.warning(message, extra={'route': labels[1], 'queries': top})
+
+
+def metrics_view(request):
+    """Метрики Prometheus. При заданной настройке METRICS_TOKEN требуется заголовок Authorization: Bearer <token>"""
+    token = get_setting('METRICS_TOKEN', '')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
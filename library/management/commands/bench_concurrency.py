@@ -0,0 +1,47 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+
+from library.concurrency import RESOURCES, ConcurrencyBenchmark
+from library.seeding import MODERATOR_EMAIL
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Синхронное (WSGI, пул потоков) и async (ASGI) чтение при множестве клиентов (library/concurrency.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-email', default=MODERATOR_EMAIL)
+        parser.add_argument('--resource', choices=RESOURCES, default='book-issues',
+                            help="Ответы books и authors кешируются, book-issues всегда читаются из базы")
+        parser.add_argument('--query', default='', help="Параметры запроса, например page_size=50")
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50, help="Одновременных клиентов")
+        parser.add_argument('--workers', type=int, default=8, help="Потоков WSGI")
+        parser.add_argument('--client-delay-ms', type=float, default=20, help="Время получения ответа клиентом")
+        parser.add_argument('--output', help="Сохранить результаты в JSON файл")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['user_email']).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['user_email']} не найден, заполните базу командой seed_library")
+
+        benchmark = ConcurrencyBenchmark(
+            user, resource=options['resource'], query=options['query'], requests=options['requests'],
+            concurrency=options['concurrency'], workers=options['workers'],
+            client_delay=options['client_delay_ms'] / 1000,
+        )
+        results = benchmark.run(log=self.write_result)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({'options': {key: options[key] for key in (
+                    'resource', 'query', 'requests', 'concurrency', 'workers', 'client_delay_ms')},
+                    'results': results}, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результаты сохранены в {options['output']}"))
+
+    def write_result(self, result):
+        self.stdout.write(
+            f"{result['mode']:<5} {result['path']:<22} {result['requests_per_second']:>8} запр/с  "
+            f"p50 {result['p50_ms']:>8.2f} мс  p95 {result['p95_ms']:>8.2f} мс  ошибок {result['errors']}  "
+            f"потоков {result['peak_threads']:>3}  память {result['peak_memory_kib']:>9} КиБ"
+        )
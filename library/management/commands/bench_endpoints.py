@@ -0,0 +1,52 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+
+from library.benchmark import SCENARIOS, EndpointBenchmark, uncovered_routes
+from library.seeding import MODERATOR_EMAIL
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Прогон всех маршрутов API внутри процесса: p50/p95/p99, SQL запросы и память (library/benchmark.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-email', default=MODERATOR_EMAIL, help="Пользователь группы Moderators")
+        parser.add_argument('--requests', type=int, default=50, help="Запросов на сценарий")
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--only', help="Сценарии, имя которых содержит эту строку")
+        parser.add_argument('--warm-cache', action='store_true', help="Не сбрасывать кеш ответов между запросами")
+        parser.add_argument('--output', help="Сохранить результаты в JSON файл")
+        parser.add_argument('--compare', help="JSON файл предыдущего прогона для сравнения p50")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['user_email']).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['user_email']} не найден, заполните базу командой seed_library")
+        for route in uncovered_routes():
+            self.stderr.write(f"Маршрут без сценария: {route}")
+
+        previous = {}
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                previous = {result['name']: result for result in json.load(file)['results']}
+
+        scenarios = [scenario for scenario in SCENARIOS if not options['only'] or options['only'] in scenario.name]
+        benchmark = EndpointBenchmark(user, requests=options['requests'], warmup=options['warmup'],
+                                      warm_cache=options['warm_cache'])
+        report = benchmark.run(scenarios, log=lambda result: self.write_result(result, previous.get(result['name'])))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результаты сохранены в {options['output']}"))
+
+    def write_result(self, result, previous):
+        line = (
+            f"{result['name']:<22} {result['method']:<6} {result['status']} "
+            f"p50 {result['p50_ms']:>8.2f} мс  p95 {result['p95_ms']:>8.2f} мс  p99 {result['p99_ms']:>8.2f} мс  "
+            f"SQL {result['queries_per_request']:>5}  память {result['peak_memory_kib']:>8} КиБ"
+        )
+        if previous and previous['p50_ms']:
+            line += f"  p50 {(result['p50_ms'] / previous['p50_ms'] - 1) * 100:+.0f}%"
+        self.stdout.write(line)
@@ -0,0 +1,52 @@
+import statistics
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from library.cache import get_cache
+from users.models import User
+
+ENDPOINTS = ('/books/', '/book-issues/')
+MODES = (
+    ('serializer', 'stdlib', False),
+    ('serializer', 'orjson', False),
+    ('values', 'stdlib', True),
+    ('values', 'orjson', True),
+)
+
+
+class Command(BaseCommand):
+    help = "Время ответа списков книг и выдач: сериализатор или .values(), стандартный JSON или orjson"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-email', required=True, help="Пользователь, от имени которого идут запросы")
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['user_email']).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['user_email']} не найден")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        params = {'page_size': options['page_size']}
+
+        for path in ENDPOINTS:
+            for path_mode, json_backend, fast_lists in MODES:
+                with override_settings(API_JSON_BACKEND=json_backend, API_FAST_LISTS=fast_lists):
+                    timings = []
+                    for _ in range(options['requests']):
+                        # Кеш ответов списков сбрасывается, чтобы измерить построение ответа
+                        get_cache().clear()
+                        started = time.perf_counter()
+                        response = client.get(path, params)
+                        timings.append((time.perf_counter() - started) * 1000)
+                        if response.status_code != 200:
+                            raise CommandError(f"{path}: ответ {response.status_code}")
+                percentiles = statistics.quantiles(timings, n=100)
+                self.stdout.write(
+                    f"{path:<14} {path_mode:<10} {json_backend:<6} p50 {percentiles[49]:.2f} мс, "
+                    f"p95 {percentiles[94]:.2f} мс, {len(response.content)} байт"
+                )
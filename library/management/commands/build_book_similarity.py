@@ -0,0 +1,36 @@
+from django.core.management import BaseCommand, CommandError
+
+from library.similarity import METRICS, SimilarityBuilder
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит рекомендации \"Читатели также брали\" (BookSimilarity, /books/{id}/similar/) по истории выдач. "
+        "Без --full пересчитываются только книги, затронутые выдачами после прошлого построения "
+        "(см. library/similarity.py)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Пересчитать соседей всех книг")
+        parser.add_argument('--metric', choices=METRICS, help="Мера сходства, по умолчанию BOOK_SIMILARITY_METRIC")
+        parser.add_argument('--top-k', type=int, help="Соседей у книги, по умолчанию BOOK_SIMILARITY_TOP_K")
+        parser.add_argument('--max-reader-books', type=int,
+                            help="Не учитывать читателей с большим числом книг, "
+                                 "по умолчанию BOOK_SIMILARITY_MAX_READER_BOOKS")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Книг в одной транзакции записи")
+
+    def handle(self, *args, **options):
+        for name in ('top_k', 'max_reader_books', 'batch_size'):
+            if options[name] is not None and options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} должен быть положительным")
+
+        builder = SimilarityBuilder(
+            metric=options['metric'], top_k=options['top_k'], max_reader_books=options['max_reader_books'],
+            batch_size=options['batch_size'], log=lambda message: self.stdout.write(message),
+        )
+        report = builder.run(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Полное перестроение' if report['full'] else 'Обновление'}: читателей {report['readers']}, "
+            f"книг {report['books']}, строк {report['rows']}, выдачи до id {report['last_issue_id']}, "
+            f"загрузка {report['load_seconds']} с, всего {report['elapsed_seconds']} с"
+        ))
@@ -0,0 +1,37 @@
+from django.core.management import BaseCommand, CommandError
+
+from library.query_plans import PLAN_CHECKS, QueryPlanChecker
+from library.seeding import MODERATOR_EMAIL
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN основных запросов API: использование индексов, полные проходы таблиц (library/query_plans.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-email', default=MODERATOR_EMAIL, help="Пользователь для запросов к API")
+        parser.add_argument('--only', help="Проверки, имя которых содержит эту строку")
+        parser.add_argument('--prefer-indexes', action='store_true',
+                            help="PostgreSQL: запретить полный проход таблиц (для маленькой базы)")
+        parser.add_argument('--show-plans', action='store_true', help="Выводить планы всех проверок")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['user_email']).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['user_email']} не найден, заполните базу командой seed_library")
+
+        checks = [check for check in PLAN_CHECKS if not options['only'] or options['only'] in check.name]
+        self.show_plans = options['show_plans']
+        results = QueryPlanChecker(user, prefer_indexes=options['prefer_indexes']).run(checks, log=self.write_result)
+        failed = [result['name'] for result in results if result['problems']]
+        if failed:
+            raise CommandError(f"Планы без индексов: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS(f"Проверено планов: {len(results)}"))
+
+    def write_result(self, result):
+        if result['problems']:
+            self.stdout.write(self.style.ERROR(f"{result['name']:<26} {'; '.join(result['problems'])}"))
+        else:
+            self.stdout.write(f"{result['name']:<26} {result['index']}")
+        if result['problems'] or self.show_plans:
+            self.stdout.write('\n'.join(f"    {line}" for line in result['plan'].splitlines()))
@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management import BaseCommand, CommandError
+
+from library.exports import STREAMS, export_queryset, iter_issue_rows
+from library.filters import BookIssueExportFilter
+
+
+class Command(BaseCommand):
+    help = "Потоковая выгрузка истории выдач книг в CSV или NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=STREAMS, default='csv')
+        parser.add_argument('--output', default='-', help="Путь к файлу, '-' - стандартный вывод")
+        parser.add_argument('--date-from', help="Дата выдачи с, ГГГГ-ММ-ДД")
+        parser.add_argument('--date-to', help="Дата выдачи по, ГГГГ-ММ-ДД")
+        parser.add_argument('--user', help="id пользователя")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        filterset = BookIssueExportFilter({
+            'date_from': options['date_from'],
+            'date_to': options['date_to'],
+            'user': options['user'],
+        }, queryset=export_queryset())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+
+        rows = iter_issue_rows(filterset.qs, chunk_size=options['chunk_size'])
+        if options['output'] == '-':
+            sys.stdout.writelines(STREAMS[options['format']](rows))
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+            file.writelines(STREAMS[options['format']](rows))
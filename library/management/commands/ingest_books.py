@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management import BaseCommand, CommandError
+
+from library.ingest import READERS, BookIngestor
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Массовая загрузка книг из файла NDJSON или CSV (см. library/ingest.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Путь к файлу, '-' - стандартный ввод")
+        parser.add_argument('--format', choices=READERS, help="Формат файла, по умолчанию по расширению")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--user-email', required=True, help="Пользователь, от имени которого добавляются книги")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['user_email']).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['user_email']} не найден")
+
+        path = options['path']
+        input_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        ingestor = BookIngestor(user_id=user.pk, chunk_size=options['chunk_size'])
+
+        if path == '-':
+            report = ingestor.ingest(READERS[input_format](sys.stdin))
+        else:
+            with open(path, encoding='utf-8-sig', newline='') as file:
+                report = ingestor.ingest(READERS[input_format](file))
+
+        for error in report['errors']:
+            self.stderr.write(f"Строка {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Строк: {report['rows']}, книг создано: {report['books_created']}, "
+            f"авторов создано: {report['authors_created']}, ошибок: {report['errors_count']}, "
+            f"{report['elapsed_seconds']} с, {report['rows_per_second']} строк/с"
+        ))
@@ -0,0 +1,41 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from library import cache
+from library.authors import merge_duplicate_authors
+from library.autocomplete import autocomplete_index
+from library.models import Author, Book, ReadingStats
+from library.search import book_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Объединяет авторов с одинаковым именем (без учета регистра и пробелов) и датой рождения: книги переходят "
+        "к автору с меньшим id вместе со статистикой чтения, дубликаты удаляются. Исправляет identity_key авторов, "
+        "измененных в обход модели (см. library/authors.py)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать дубликаты, ничего не менять")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Авторов в одном UPDATE ключей")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size должен быть положительным")
+
+        with transaction.atomic():
+            report = merge_duplicate_authors(
+                Author, Book, ReadingStats, dry_run=options['dry_run'], batch_size=options['batch_size'],
+                log=lambda message: self.stdout.write(message),
+            )
+        if not options['dry_run'] and (report['merged'] or report['keys_updated']):
+            # Изменения сделаны UPDATE/DELETE без сигналов
+            book_search_index.reset()
+            autocomplete_index.reset()
+            cache.invalidate(cache.BOOKS)
+            cache.invalidate(cache.AUTHORS)
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Проверка' if options['dry_run'] else 'Готово'}: авторов {report['authors']}, "
+            f"групп дубликатов {report['groups']}, объединено {report['merged']}, "
+            f"перенесено книг {report['books_moved']}, исправлено ключей {report['keys_updated']}"
+        ))
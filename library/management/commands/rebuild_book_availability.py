@@ -0,0 +1,13 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from library.models import Book
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает Book.open_issues_count (книги на руках) по таблице BookIssue"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Book.objects.all().rebuild_open_issues_count()
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано книг: {updated}"))
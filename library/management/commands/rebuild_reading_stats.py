@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+
+from library.stats import rebuild_reading_stats
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает статистику чтения ReadingStats по всей истории выдач BookIssue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Выдач, читаемых из базы за один раз")
+
+    def handle(self, *args, **options):
+        rows = rebuild_reading_stats(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано строк статистики: {rows}"))
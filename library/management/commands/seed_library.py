@@ -0,0 +1,31 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from library.seeding import MODERATOR_EMAIL, SEED_PASSWORD, LibrarySeeder
+
+
+class Command(BaseCommand):
+    help = "Заполняет базу синтетическими пользователями, авторами, книгами и историей выдач (library/seeding.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--authors', type=int, default=2000)
+        parser.add_argument('--books', type=int, default=20000)
+        parser.add_argument('--issues', type=int, default=200000)
+        parser.add_argument('--skew', type=float, default=1.1, help="Показатель распределения Ципфа популярности")
+        parser.add_argument('--days', type=int, default=730, help="Глубина истории выдач в днях")
+        parser.add_argument('--open-ratio', type=float, default=0.05, help="Доля выдач, которые сейчас на руках")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, help="Зерно генератора для воспроизводимых данных")
+
+    def handle(self, *args, **options):
+        seeder = LibrarySeeder(
+            users=options['users'], authors=options['authors'], books=options['books'], issues=options['issues'],
+            skew=options['skew'], days=options['days'], open_ratio=options['open_ratio'],
+            batch_size=options['batch_size'], seed=options['seed'], log=self.stdout.write,
+        )
+        with transaction.atomic():
+            elapsed = seeder.seed()
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {elapsed} с. Модератор: {MODERATOR_EMAIL}, пароль всех пользователей: {SEED_PASSWORD}"
+        ))
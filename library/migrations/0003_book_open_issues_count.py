@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_open_issues_count(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    BookIssue = apps.get_model('library', 'BookIssue')
+    open_issues = BookIssue.objects.filter(
+        book=OuterRef('pk'), is_returned=False
+    ).values('book').annotate(total=Count('pk')).values('total')
+    Book.objects.update(open_issues_count=Coalesce(Subquery(open_issues), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0002_bookissue_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='open_issues_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Количество невозвращенных выдач, поддерживается автоматически', verbose_name='Выдано экземпляров'),
+        ),
+        migrations.RunPython(fill_open_issues_count, migrations.RunPython.noop),
+    ]
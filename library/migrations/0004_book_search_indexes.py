@@ -0,0 +1,46 @@
+from django.db import migrations
+
+# Индексы для поиска ?search= (library/search.py, PostgresBookSearch). На других СУБД не создаются,
+# там используется индекс в памяти процесса
+INDEXES = (
+    'book_search_vector_idx',
+    'book_title_trgm_idx',
+    'author_name_trgm_idx',
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    Book = apps.get_model('library', 'Book')
+    Author = apps.get_model('library', 'Author')
+
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # Выражение должно совпадать с вектором в PostgresBookSearch, иначе индекс не будет использован
+    schema_editor.add_index(Book, GinIndex(
+        SearchVector('title', weight='A', config='simple') + SearchVector('genre', weight='C', config='simple'),
+        name='book_search_vector_idx',
+    ))
+    schema_editor.add_index(Book, GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='book_title_trgm_idx'))
+    schema_editor.add_index(Author, GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='author_name_trgm_idx'))
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_book_open_issues_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:21
+
+from collections import Counter, defaultdict
+
+from django.db import migrations, models
+
+# Счетчики и вклад выдачи повторяют library/stats.py на момент миграции, без импорта кода приложения:
+# миграция работает только с историческими моделями и не меняется вместе с library.stats и BookIssue
+COUNTERS = ('issues_count', 'open_issues_count', 'returned_count', 'days_held_total', 'rating_sum', 'rating_count')
+ISSUE_ROW_FIELDS = ('user_id', 'is_returned', 'issue_date', 'return_date', 'rating', 'book__genre', 'book__author_id')
+
+
+def issue_contribution(is_returned, issue_date, return_date, rating):
+    counters = Counter(issues_count=1)
+    if not is_returned:
+        counters['open_issues_count'] = 1
+        return counters
+    counters['returned_count'] = 1
+    # BookIssue.calculate_days_held: минимум 1 день, без дат - 0
+    counters['days_held_total'] = max((return_date - issue_date).days, 1) if return_date and issue_date else 0
+    if rating is not None:
+        counters['rating_sum'] = rating
+        counters['rating_count'] = 1
+    return counters
+
+
+def fill_reading_stats(apps, schema_editor):
+    BookIssue = apps.get_model('library', 'BookIssue')
+    ReadingStats = apps.get_model('library', 'ReadingStats')
+    totals = defaultdict(Counter)
+    rows = BookIssue.objects.values_list(*ISSUE_ROW_FIELDS).iterator(chunk_size=5000)
+    for user_id, is_returned, issue_date, return_date, rating, genre, author_id in rows:
+        counters = issue_contribution(is_returned, issue_date, return_date, rating)
+        for stats_key in (('user', str(user_id)), ('genre', genre), ('author', str(author_id))):
+            totals[stats_key].update(counters)
+    ReadingStats.objects.bulk_create(
+        [ReadingStats(dimension=dimension, key=key, **{name: counters[name] for name in COUNTERS})
+         for (dimension, key), counters in totals.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_book_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadingStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('genre', 'Жанр'), ('author', 'Автор'), ('user', 'Пользователь')], max_length=10, verbose_name='Разрез')),
+                ('key', models.CharField(help_text='Жанр, id автора или id пользователя', max_length=255, verbose_name='Ключ')),
+                ('issues_count', models.PositiveIntegerField(default=0, verbose_name='Выдач')),
+                ('open_issues_count', models.PositiveIntegerField(default=0, verbose_name='Книг на руках')),
+                ('returned_count', models.PositiveIntegerField(default=0, verbose_name='Возвращено')),
+                ('days_held_total', models.PositiveBigIntegerField(default=0, verbose_name='Всего дней на руках')),
+                ('rating_sum', models.PositiveBigIntegerField(default=0, verbose_name='Сумма оценок')),
+                ('rating_count', models.PositiveIntegerField(default=0, verbose_name='Количество оценок')),
+            ],
+            options={
+                'verbose_name': 'Статистика чтения',
+                'verbose_name_plural': 'Статистика чтения',
+                'ordering': ['dimension', 'key'],
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key'), name='unique_reading_stats_dimension_key')],
+            },
+        ),
+        migrations.RunPython(fill_reading_stats, migrations.RunPython.noop),
+    ]
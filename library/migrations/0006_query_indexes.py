@@ -0,0 +1,83 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Фильтры списка книг ?title=, ?genre=, ?author__name= (icontains) на PostgreSQL выполняются как
+# UPPER(поле::text) LIKE UPPER('%...%'). B-tree индекс такое условие не обслуживает, триграммный индекс по тому же
+# выражению - обслуживает. На других СУБД не создаются
+TRIGRAM_INDEXES = (
+    ('book_genre_upper_trgm_idx', 'library_book', 'genre'),
+    ('book_title_upper_trgm_idx', 'library_book', 'title'),
+    ('author_name_upper_trgm_idx', 'library_author', 'name'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ((UPPER({column}::text)) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_reading_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # Сначала создаются составные индексы, потом удаляются одиночные индексы внешних ключей,
+    # чтобы каскадное удаление и выборки по книге и читателю не остались без индекса
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['name', 'id'], name='author_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['published_date', 'id'], name='book_published_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookissue',
+            index=models.Index(fields=['book', 'is_returned', 'rating'], name='bookissue_book_returned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookissue',
+            index=models.Index(fields=['user', 'issue_date'], name='bookissue_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookissue',
+            index=models.Index(condition=models.Q(('is_returned', False)), fields=['book'], name='bookissue_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookissue',
+            index=models.Index(fields=['-issue_date', '-id'], name='bookissue_date_id_idx'),
+        ),
+        migrations.AlterField(
+            model_name='bookissue',
+            name='book',
+            field=models.ForeignKey(db_index=False, help_text='Укажите книгу', on_delete=django.db.models.deletion.CASCADE, related_name='issues', to='library.book', verbose_name='Книга'),
+        ),
+        migrations.AlterField(
+            model_name='bookissue',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='issues', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
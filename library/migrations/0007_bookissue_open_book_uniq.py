@@ -0,0 +1,76 @@
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def return_contribution(issue):
+    """Изменение вклада выдачи в статистику чтения при возврате (library/stats.py на момент миграции)"""
+    counters = Counter(open_issues_count=-1, returned_count=1,
+                       days_held_total=max((issue.return_date - issue.issue_date).days, 1))
+    if issue.rating is not None:
+        counters['rating_sum'] = issue.rating
+        counters['rating_count'] = 1
+    return counters
+
+
+def close_duplicate_open_issues(apps, schema_editor):
+    """
+        До ограничения книгу можно было выдать повторно. У каждой книги остается открытой последняя выдача,
+        более ранние закрываются датой этой выдачи: экземпляр вернули до того, как выдали снова.
+        Счетчики пользователей и статистика чтения (заполнена миграцией 0005) обновляются как при возврате
+    """
+    BookIssue = apps.get_model('library', 'BookIssue')
+    Book = apps.get_model('library', 'Book')
+    ReadingStats = apps.get_model('library', 'ReadingStats')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    deltas = defaultdict(Counter)
+
+    duplicated = BookIssue.objects.filter(is_returned=False).values('book').annotate(
+        total=Count('pk')
+    ).filter(total__gt=1).values_list('book', flat=True)
+    for book_id in list(duplicated):
+        latest, *earlier = BookIssue.objects.filter(book_id=book_id, is_returned=False).order_by('-issue_date', '-pk')
+        genre, author_id = Book.objects.filter(pk=book_id).values_list('genre', 'author_id').get()
+        for issue in earlier:
+            issue.is_returned = True
+            issue.return_date = max(latest.issue_date, issue.issue_date)
+            issue.save(update_fields=['is_returned', 'return_date'])
+            User.objects.filter(pk=issue.user_id).update(
+                total_books_taken=F('total_books_taken') + 1,
+                total_days_held_books=F('total_days_held_books') + max((issue.return_date - issue.issue_date).days, 1),
+            )
+            for stats_key in (('user', str(issue.user_id)), ('genre', genre), ('author', str(author_id))):
+                deltas[stats_key].update(return_contribution(issue))
+        Book.objects.filter(pk=book_id).update(open_issues_count=1)
+
+    # Строки статистики этих выдач созданы миграцией 0005
+    for (dimension, key), delta in deltas.items():
+        ReadingStats.objects.filter(dimension=dimension, key=key).update(
+            **{name: F(name) + value for name, value in delta.items() if value}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # Уникальный частичный индекс создается до удаления обычного, выборки открытых выдач книги не остаются без индекса
+    operations = [
+        migrations.RunPython(close_duplicate_open_issues, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='bookissue',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('is_returned', False)), fields=('book',), name='bookissue_open_book_uniq',
+                violation_error_message='Книга уже выдана и еще не возвращена.',
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name='bookissue',
+            name='bookissue_open_idx',
+        ),
+    ]
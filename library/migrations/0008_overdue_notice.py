@@ -0,0 +1,40 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_bookissue_open_book_uniq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OverdueNotice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_date', models.DateField(verbose_name='Срок возврата')),
+                ('days_overdue', models.PositiveIntegerField(verbose_name='Дней просрочки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Обнаружена')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлена')),
+            ],
+            options={
+                'verbose_name': 'Просроченная выдача',
+                'verbose_name_plural': 'Просроченные выдачи',
+                'ordering': ['-days_overdue', 'issue'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='bookissue',
+            index=models.Index(condition=models.Q(('is_returned', False)), fields=['id', 'issue_date'], name='bookissue_open_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='overduenotice',
+            name='issue',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='overdue_notice', to='library.bookissue', verbose_name='Выдача'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_overdue_notice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSimilarityBuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20, verbose_name='Метрика')),
+                ('top_k', models.PositiveSmallIntegerField(verbose_name='Соседей у книги')),
+                ('max_reader_books', models.PositiveIntegerField(verbose_name='Наибольшее число книг читателя')),
+                ('last_issue_id', models.PositiveBigIntegerField(default=0, verbose_name='Последняя учтенная выдача')),
+                ('is_full', models.BooleanField(default=True, verbose_name='Полное перестроение')),
+                ('books_updated', models.PositiveIntegerField(default=0, verbose_name='Обновлено книг')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Выполнен')),
+            ],
+            options={
+                'verbose_name': 'Построение похожих книг',
+                'verbose_name_plural': 'Построения похожих книг',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BookSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Место')),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('co_readers', models.PositiveIntegerField(verbose_name='Общих читателей')),
+                ('book', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='similarities', to='library.book', verbose_name='Книга')),
+                ('similar_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book', verbose_name='Похожая книга')),
+            ],
+            options={
+                'verbose_name': 'Похожая книга',
+                'verbose_name_plural': 'Похожие книги',
+                'ordering': ['book', 'rank'],
+                'indexes': [models.Index(fields=['book', 'rank'], name='booksimilarity_book_rank_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,74 @@
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+COUNTERS = ('issues_count', 'open_issues_count', 'returned_count', 'days_held_total', 'rating_sum', 'rating_count')
+
+
+def identity_key(name, birth_date):
+    """library.authors.identity_key на момент миграции: миграция не зависит от кода приложения"""
+    name = ' '.join((name or '').casefold().replace('ё', 'е').split())
+    return f"{name}|{'' if birth_date is None else birth_date}"
+
+
+def merge_author_stats(ReadingStats, canonical, extra):
+    """library.authors.merge_author_stats на момент миграции"""
+    rows = ReadingStats.objects.filter(dimension='author', key__in=[str(pk) for pk in extra])
+    totals = rows.aggregate(**{name: Sum(name) for name in COUNTERS})
+    if totals['issues_count'] is None:
+        return
+    rows.delete()
+    updated = ReadingStats.objects.filter(dimension='author', key=str(canonical)).update(
+        **{name: F(name) + totals[name] for name in COUNTERS}
+    )
+    if not updated:
+        ReadingStats.objects.create(dimension='author', key=str(canonical), **totals)
+
+
+def fill_identity_keys(apps, schema_editor):
+    """
+        Ключи существующих авторов; авторы с одинаковым ключом (созданные get_or_create из-за различий в регистре,
+        пробелах или биографии) объединяются до уникального индекса: книги и статистика чтения переходят
+        к автору с меньшим id, пустая биография берется у дубликата
+    """
+    Author = apps.get_model('library', 'Author')
+    Book = apps.get_model('library', 'Book')
+    ReadingStats = apps.get_model('library', 'ReadingStats')
+    groups = defaultdict(list)
+    for pk, name, birth_date in Author.objects.order_by('pk').values_list('pk', 'name', 'birth_date').iterator(
+            chunk_size=5000):
+        groups[identity_key(name, birth_date)].append(pk)
+
+    for canonical, *extra in groups.values():
+        if not extra:
+            continue
+        Book.objects.filter(author_id__in=extra).update(author_id=canonical)
+        merge_author_stats(ReadingStats, canonical, extra)
+        if not Author.objects.filter(pk=canonical).exclude(biography='').exists():
+            biography = Author.objects.filter(pk__in=extra).exclude(biography='').order_by('pk').values_list(
+                'biography', flat=True).first()
+            if biography:
+                Author.objects.filter(pk=canonical).update(biography=biography)
+        Author.objects.filter(pk__in=extra).delete()
+
+    Author.objects.bulk_update([Author(pk=pks[0], identity_key=key) for key, pks in groups.items()],
+                               ['identity_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_book_similarity'),
+    ]
+
+    # Уникальность задается следующей миграцией: в PostgreSQL изменение таблицы в одной транзакции
+    # с отложенными проверками внешних ключей перенесенных книг невозможно
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='identity_key',
+            field=models.CharField(editable=False, max_length=300, null=True, verbose_name='Ключ автора'),
+        ),
+        migrations.RunPython(fill_identity_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_author_identity_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='author',
+            name='identity_key',
+            field=models.CharField(editable=False, max_length=300, unique=True, verbose_name='Ключ автора'),
+        ),
+    ]
@@ -1,23 +1,119 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.conf import settings
-from django.db.models import Avg
+from django.db.models import Avg, Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from library.authors import IDENTITY_KEY_MAX_LENGTH, identity_key
 
 NULLABLE = {"null": True, "blank": True}
 
+DUPLICATE_AUTHOR = "Автор с таким именем и датой рождения уже существует."
+
+
+class AuthorQuerySet(models.QuerySet):
+
+    def with_stats(self):
+        """
+            Число книг, выданных экземпляров (сумма Book.open_issues_count) и средний рейтинг возвращенных книг
+            автора в запросе списка. Коррелированные подзапросы, как в BookQuerySet.with_average_rating:
+            страница авторов читается по индексу сортировки, каждый подзапрос - по книгам одного автора
+        """
+        books = Book.objects.filter(author=OuterRef('pk')).order_by().values('author')
+        ratings = BookIssue.objects.filter(book__author=OuterRef('pk'), is_returned=True).order_by().values(
+            'book__author').annotate(average=Avg('rating')).values('average')
+        return self.annotate(
+            book_count=Coalesce(Subquery(books.annotate(total=Count('pk')).values('total')), 0),
+            open_issue_count=Coalesce(Subquery(books.annotate(total=Sum('open_issues_count')).values('total')), 0),
+            average_rating_value=Subquery(ratings, output_field=models.FloatField()),
+        )
+
+    def get_or_create_identity(self, author_data):
+        """
+            get_or_create по identity_key: одна строка по уникальному индексу вместо сравнения всех полей,
+            включая неиндексированную биографию. У найденного автора биография и написание имени не меняются
+        """
+        key = identity_key(author_data.get('name'), author_data.get('birth_date'))
+        return self.get_or_create(identity_key=key, defaults=author_data)
+
 
 class Author(models.Model):
     name = models.CharField(max_length=255, verbose_name="Имя автора", help_text="Введите имя автора")
     birth_date = models.DateField(**NULLABLE, verbose_name="Дата рождения", help_text="Введите дату рождения")
     biography = models.TextField(blank=True, verbose_name="Биография автора", help_text="Укажите биографию автора")
+    # Имя без учета регистра и пробелов и дата рождения (library/authors.py), заполняется в save()
+    identity_key = models.CharField(max_length=IDENTITY_KEY_MAX_LENGTH, unique=True, editable=False,
+                                    verbose_name="Ключ автора")
+
+    objects = AuthorQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Автор"
         verbose_name_plural = "Авторы"
         ordering = ["-name"]
+        # Сортировка списка с id для курсора пагинации (-name, -id) - обратный проход индекса
+        indexes = [
+            models.Index(fields=['name', 'id'], name='author_name_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def clean(self):
+        # identity_key не редактируется в формах, поэтому уникальность проверяется здесь, а не в validate_unique
+        key = identity_key(self.name, self.birth_date)
+        if Author.objects.filter(identity_key=key).exclude(pk=self.pk).exists():
+            raise ValidationError(DUPLICATE_AUTHOR)
+
+    def save(self, *args, **kwargs):
+        self.identity_key = identity_key(self.name, self.birth_date)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'birth_date'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'identity_key'}
+        super().save(*args, **kwargs)
+
+
+class BookQuerySet(models.QuerySet):
+
+    def with_average_rating(self):
+        """
+            Средний рейтинг по возвращенным выдачам считается в том же запросе, что и список книг,
+            вместо отдельного aggregate-запроса на каждую книгу.
+            Коррелированный подзапрос вместо JOIN + GROUP BY: страница книг читается по индексу сортировки
+            без группировки всей истории выдач, а рейтинг каждой книги берется из покрывающего индекса
+            bookissue_book_returned_idx
+        """
+        ratings = BookIssue.objects.filter(book=OuterRef('pk'), is_returned=True).order_by().values('book').annotate(
+            average=Avg('rating')
+        ).values('average')
+        return self.annotate(average_rating_value=Subquery(ratings, output_field=models.FloatField()))
+
+    def available(self):
+        """Книги, которые сейчас не на руках"""
+        return self.filter(open_issues_count=0)
+
+    def issued(self):
+        """Книги, у которых есть невозвращенные выдачи"""
+        return self.filter(open_issues_count__gt=0)
+
+    def rebuild_open_issues_count(self):
+        """
+            Пересчитывает open_issues_count по таблице BookIssue одним UPDATE
+            Используется для восстановления счетчика после массовых операций в обход модели
+        """
+        open_issues = BookIssue.objects.filter(
+            book=OuterRef('pk'), is_returned=False
+        ).values('book').annotate(total=Count('pk')).values('total')
+        return self.update(open_issues_count=Coalesce(Subquery(open_issues), 0))
+
+    def change_open_issues_count(self, delta):
+        """
+            Атомарно изменяет счетчик невозвращенных выдач через F()
+            Счетчик не уходит ниже нуля, если он разошелся с BookIssue (см. rebuild_book_availability)
+        """
+        queryset = self.filter(open_issues_count__gte=-delta) if delta < 0 else self
+        return queryset.update(open_issues_count=F('open_issues_count') + delta)
+
 
 class Book(models.Model):
     user = models.ForeignKey(
@@ -35,23 +131,41 @@ class Book(models.Model):
     genre = models.CharField(max_length=100, verbose_name="Жанр", help_text="Укажите жанр книги")
     published_date = models.DateField(verbose_name="Дата публикации", help_text="Дата публикации", **NULLABLE)
     description = models.TextField(verbose_name="Описание", help_text="Описание книги", blank=True)
+    open_issues_count = models.PositiveIntegerField(
+        default=0,
+        db_index=True,
+        verbose_name="Выдано экземпляров",
+        help_text="Количество невозвращенных выдач, поддерживается автоматически"
+    )
+
+    objects = BookQuerySet.as_manager()
 
     def calculate_average_rating(self):
+        # Если книга получена через with_average_rating(), повторный запрос не нужен
+        if hasattr(self, 'average_rating_value'):
+            return self.average_rating_value or 0
         return self.issues.filter(is_returned=True).aggregate(avg_rating=Avg('rating'))['avg_rating'] or 0
 
     class Meta:
         verbose_name = "Книга"
         verbose_name_plural = "Книги"
         ordering = ["-title"]
+        # Сортировки списка с id для курсора пагинации (ordering=title, published_date)
+        indexes = [
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            models.Index(fields=['published_date', 'id'], name='book_published_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
 class BookIssue(models.Model):
+    # Отдельные индексы внешних ключей не нужны: book_id и user_id - первые колонки составных индексов из Meta
     book = models.ForeignKey(Book, on_delete=models.CASCADE, verbose_name="Книга", help_text="Укажите книгу",
-                             related_name="issues")
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="issues")
+                             related_name="issues", db_index=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="issues",
+                             db_index=False)
     issue_date = models.DateField(auto_now_add=True, verbose_name="Дата получения", help_text="Дата получения")
     return_date = models.DateField(**NULLABLE, verbose_name="Дата возврата", help_text="Дата возврата")
     is_returned = models.BooleanField(default=False)
@@ -60,10 +174,52 @@ class BookIssue(models.Model):
                                          help_text="От 1 до 5, где 5 высшая оценка"
                                          )
 
+    # Поля, изменения которых обрабатывают сигналы (счетчик книги, статистика чтения)
+    TRACKED_FIELDS = ('book_id', 'user_id', 'is_returned', 'issue_date', 'return_date', 'rating')
+    # Значения TRACKED_FIELDS на момент загрузки из базы или последней записи, None - выдача еще не сохранена
+    _loaded_state = None
+
     class Meta:
         verbose_name = "Выдача книги"
         verbose_name_plural = "Выдачи книг"
         ordering = ["-issue_date"]
+        indexes = [
+            # Выдачи книги и средний рейтинг (Book.objects.with_average_rating) только из индекса
+            models.Index(fields=['book', 'is_returned', 'rating'], name='bookissue_book_returned_idx'),
+            # История читателя за период (выгрузка ?user=&date_from=)
+            models.Index(fields=['user', 'issue_date'], name='bookissue_user_date_idx'),
+            # Сортировка списка с id для курсора пагинации
+            models.Index(fields=['-issue_date', '-id'], name='bookissue_date_id_idx'),
+            # Обход невозвращенных выдач частями по id (scan_overdue_issues) без чтения всей истории
+            models.Index(fields=['id', 'issue_date'], condition=Q(is_returned=False), name='bookissue_open_id_idx'),
+        ]
+        constraints = [
+            # Экземпляр книги может быть на руках только у одного читателя. Невозвращенные выдачи - малая часть
+            # истории, частичный уникальный индекс остается небольшим и обслуживает выборки открытых выдач книги
+            models.UniqueConstraint(fields=['book'], condition=Q(is_returned=False), name='bookissue_open_book_uniq',
+                                    violation_error_message="Книга уже выдана и еще не возвращена."),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(field in instance.__dict__ for field in cls.TRACKED_FIELDS):
+            instance._loaded_state = instance.get_state()
+        return instance
+
+    def get_state(self):
+        """Текущие значения отслеживаемых полей, см. library.signals.issue_state_changed"""
+        return {field: getattr(self, field) for field in self.TRACKED_FIELDS}
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if all(field in self.__dict__ for field in self.TRACKED_FIELDS):
+            self._loaded_state = self.get_state()
+
+    def save(self, *args, **kwargs):
+        # Сохранение и обработка изменений в сигнале post_save выполняются в одной транзакции
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
 
     def calculate_days_held(self):
         """Вычислить количество дней, которые книга была у пользователя."""
@@ -73,3 +229,117 @@ class BookIssue(models.Model):
 
     def __str__(self):
         return f"{self.book.title} issued to {self.user.email}"
+
+
+class ReadingStats(models.Model):
+    """
+        Накопительная статистика чтения по жанру, автору или пользователю.
+        Обновляется инкрементально при создании, возврате, изменении и удалении выдач (library/stats.py),
+        полностью пересчитывается командой rebuild_reading_stats
+    """
+
+    GENRE = 'genre'
+    AUTHOR = 'author'
+    USER = 'user'
+    DIMENSIONS = (
+        (GENRE, 'Жанр'),
+        (AUTHOR, 'Автор'),
+        (USER, 'Пользователь'),
+    )
+
+    dimension = models.CharField(max_length=10, choices=DIMENSIONS, verbose_name="Разрез")
+    key = models.CharField(max_length=255, verbose_name="Ключ", help_text="Жанр, id автора или id пользователя")
+    issues_count = models.PositiveIntegerField(default=0, verbose_name="Выдач")
+    open_issues_count = models.PositiveIntegerField(default=0, verbose_name="Книг на руках")
+    returned_count = models.PositiveIntegerField(default=0, verbose_name="Возвращено")
+    days_held_total = models.PositiveBigIntegerField(default=0, verbose_name="Всего дней на руках")
+    rating_sum = models.PositiveBigIntegerField(default=0, verbose_name="Сумма оценок")
+    rating_count = models.PositiveIntegerField(default=0, verbose_name="Количество оценок")
+
+    class Meta:
+        verbose_name = "Статистика чтения"
+        verbose_name_plural = "Статистика чтения"
+        ordering = ["dimension", "key"]
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'key'], name='unique_reading_stats_dimension_key'),
+        ]
+
+    @property
+    def average_days_held(self):
+        return round(self.days_held_total / self.returned_count, 2) if self.returned_count else 0
+
+    @property
+    def average_rating(self):
+        return round(self.rating_sum / self.rating_count, 2) if self.rating_count else 0
+
+    def __str__(self):
+        return f"{self.dimension}: {self.key}"
+
+
+class OverdueNotice(models.Model):
+    """
+        Просроченная выдача: книга на руках дольше BOOK_ISSUE_LOAN_DAYS дней.
+        Заполняется командой scan_overdue_issues (library/overdue.py), удаляется при возврате книги
+    """
+
+    issue = models.OneToOneField(BookIssue, on_delete=models.CASCADE, related_name="overdue_notice",
+                                 verbose_name="Выдача")
+    due_date = models.DateField(verbose_name="Срок возврата")
+    days_overdue = models.PositiveIntegerField(verbose_name="Дней просрочки")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Обнаружена")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлена")
+
+    class Meta:
+        verbose_name = "Просроченная выдача"
+        verbose_name_plural = "Просроченные выдачи"
+        ordering = ["-days_overdue", "issue"]
+
+    def __str__(self):
+        return f"{self.issue_id}: {self.days_overdue}"
+
+
+class BookSimilarity(models.Model):
+    """
+        Сосед книги в рекомендациях "Читатели также брали" (/books/{id}/similar/): место в списке,
+        оценка сходства и число общих читателей. Заполняется командой build_book_similarity (library/similarity.py)
+    """
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="similarities", verbose_name="Книга",
+                             db_index=False)
+    similar_book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="+",
+                                     verbose_name="Похожая книга")
+    rank = models.PositiveSmallIntegerField(verbose_name="Место")
+    score = models.FloatField(verbose_name="Сходство")
+    co_readers = models.PositiveIntegerField(verbose_name="Общих читателей")
+
+    class Meta:
+        verbose_name = "Похожая книга"
+        verbose_name_plural = "Похожие книги"
+        ordering = ["book", "rank"]
+        # Список соседей книги читается по индексу (book, rank) без сортировки: k строк на запрос
+        indexes = [
+            models.Index(fields=['book', 'rank'], name='booksimilarity_book_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} -> {self.similar_book_id}: {self.score}"
+
+
+class BookSimilarityBuild(models.Model):
+    """Прогон build_book_similarity: параметры и последняя учтенная выдача для инкрементального обновления"""
+
+    metric = models.CharField(max_length=20, verbose_name="Метрика")
+    top_k = models.PositiveSmallIntegerField(verbose_name="Соседей у книги")
+    max_reader_books = models.PositiveIntegerField(verbose_name="Наибольшее число книг читателя")
+    last_issue_id = models.PositiveBigIntegerField(default=0, verbose_name="Последняя учтенная выдача")
+    is_full = models.BooleanField(default=True, verbose_name="Полное перестроение")
+    books_updated = models.PositiveIntegerField(default=0, verbose_name="Обновлено книг")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Выполнен")
+
+    class Meta:
+        verbose_name = "Построение похожих книг"
+        verbose_name_plural = "Построения похожих книг"
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.created_at}: {self.metric}, {self.books_updated}"
@@ -0,0 +1,205 @@
+"""
+    Поиск просроченных выдач (команда scan_overdue_issues).
+
+    Невозвращенные выдачи обходятся частями по id. Границы частей выбираются по частичному индексу
+    bookissue_open_id_idx (id, issue_date) WHERE is_returned = false, части покрывают весь диапазон id без пропусков:
+    (0, b1], (b1, b2], ..., (bn, ∞), поэтому выдачи, открытые во время прогона, тоже попадают в какую-то часть.
+    Для каждой части выдачи, которые на руках дольше BOOK_ISSUE_LOAN_DAYS дней, записываются в OverdueNotice:
+    новые - bulk_create, с изменившейся просрочкой - UPDATE на каждую пару (срок, дни просрочки),
+    уведомления вернувшихся выдач части удаляются.
+
+    Части обрабатываются в текущем процессе или в пуле процессов (workers > 1).
+    После каждой части пишется контрольная точка (JSON файл OVERDUE_SCAN_CHECKPOINT): прерванный прогон
+    продолжается с необработанных частей, если дата прогона и срок выдачи не изменились.
+"""
+import datetime
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from library.models import BookIssue, OverdueNotice
+
+REPORT_COUNTERS = ('rows', 'overdue', 'created', 'updated', 'deleted')
+
+
+def get_loan_days():
+    return getattr(settings, 'BOOK_ISSUE_LOAN_DAYS', 14)
+
+
+def get_checkpoint_path():
+    return getattr(settings, 'OVERDUE_SCAN_CHECKPOINT', None)
+
+
+def open_issues():
+    return BookIssue.objects.filter(is_returned=False)
+
+
+def chunk_bounds(chunk_size):
+    """Границы частей (нижняя, верхняя] по id невозвращенных выдач, у последней части верхней границы нет"""
+    bounds, low = [], 0
+    while True:
+        ids = open_issues().filter(pk__gt=low).order_by('pk').values_list('pk', flat=True)
+        high = next(iter(ids[chunk_size - 1:chunk_size]), None)
+        if high is None:
+            bounds.append((low, None))
+            return bounds
+        bounds.append((low, high))
+        low = high
+
+
+def id_range(field, low, high):
+    lookups = {f'{field}__gt': low}
+    if high is not None:
+        lookups[f'{field}__lte'] = high
+    return lookups
+
+
+def scan_chunk(low, high, today, loan_days):
+    """Обновляет уведомления части (low, high], возвращает счетчики REPORT_COUNTERS"""
+    rows = list(open_issues().filter(**id_range('pk', low, high)).values_list('pk', 'issue_date'))
+    due_dates = {
+        pk: issue_date + datetime.timedelta(days=loan_days)
+        for pk, issue_date in rows if (today - issue_date).days > loan_days
+    }
+
+    created, updated = [], defaultdict(list)
+    with transaction.atomic():
+        notices = {notice.issue_id: notice for notice in
+                   OverdueNotice.objects.select_for_update().filter(**id_range('issue_id', low, high))}
+        stale = [notice.pk for issue_id, notice in notices.items() if issue_id not in due_dates]
+        if stale:
+            OverdueNotice.objects.filter(pk__in=stale).delete()
+
+        for issue_id, due_date in due_dates.items():
+            days_overdue = (today - due_date).days
+            notice = notices.get(issue_id)
+            if notice is None:
+                created.append(OverdueNotice(issue_id=issue_id, due_date=due_date, days_overdue=days_overdue))
+            elif (notice.due_date, notice.days_overdue) != (due_date, days_overdue):
+                updated[due_date, days_overdue].append(notice.pk)
+        OverdueNotice.objects.bulk_create(created)
+        # У выдач одного дня одинаковые значения: UPDATE на день вместо bulk_update с CASE по каждой строке
+        now = timezone.now()
+        for (due_date, days_overdue), pks in updated.items():
+            OverdueNotice.objects.filter(pk__in=pks).update(
+                due_date=due_date, days_overdue=days_overdue, updated_at=now
+            )
+
+    return Counter(rows=len(rows), overdue=len(due_dates), created=len(created),
+                   updated=sum(map(len, updated.values())), deleted=len(stale))
+
+
+def scan_chunk_in_worker(low, high, today, loan_days):
+    """scan_chunk в процессе пула: счетчики передаются в родительский процесс обычным словарем"""
+    return dict(scan_chunk(low, high, today, loan_days))
+
+
+class Checkpoint:
+    """Состояние прогона в JSON файле: дата, срок выдачи, границы частей и номера обработанных частей"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                return json.load(file)
+        except ValueError:
+            return None
+
+    def save(self, state):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Запись во временный файл и переименование: прерывание во время записи не портит контрольную точку
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(state, file)
+        os.replace(temporary, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class OverdueScanner:
+    """
+        Прогон поиска просроченных выдач
+        today - дата, на которую считается просрочка (по умолчанию текущая)
+        workers - число процессов, 1 - части обрабатываются в текущем процессе
+        checkpoint_path - файл контрольной точки, None - без контрольной точки
+    """
+
+    def __init__(self, chunk_size=5000, workers=1, today=None, loan_days=None, checkpoint_path=None, log=None):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.today = today or timezone.localdate()
+        self.loan_days = get_loan_days() if loan_days is None else loan_days
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.log = log or (lambda message: None)
+
+    def load_state(self, restart):
+        """Состояние прерванного прогона с теми же датой и сроком выдачи или новое"""
+        state = None if restart else self.checkpoint.load()
+        if state and state['today'] == self.today.isoformat() and state['loan_days'] == self.loan_days:
+            self.log(f"Продолжение прогона: обработано частей {len(state['done'])} из {len(state['bounds'])}")
+            return state
+        return {
+            'today': self.today.isoformat(),
+            'loan_days': self.loan_days,
+            'bounds': chunk_bounds(self.chunk_size),
+            'done': [],
+        }
+
+    def run(self, restart=False):
+        started = time.perf_counter()
+        state = self.load_state(restart)
+        done = set(state['done'])
+        pending = [(number, tuple(bounds)) for number, bounds in enumerate(state['bounds']) if number not in done]
+        skipped = len(state['bounds']) - len(pending)
+        counters = Counter()
+
+        for number, chunk_counters in self.process(pending):
+            counters.update(chunk_counters)
+            state['done'].append(number)
+            self.checkpoint.save(state)
+            self.log(f"Часть {number + 1}/{len(state['bounds'])}: выдач {chunk_counters['rows']}, "
+                     f"просрочено {chunk_counters['overdue']}")
+        self.checkpoint.clear()
+
+        elapsed = time.perf_counter() - started
+        return {
+            'chunks': len(pending),
+            'chunks_skipped': skipped,
+            **{name: counters[name] for name in REPORT_COUNTERS},
+            'total_overdue': OverdueNotice.objects.count(),
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(counters['rows'] / elapsed, 1) if elapsed else None,
+        }
+
+    def process(self, pending):
+        """Итератор (номер части, счетчики) в порядке завершения частей"""
+        if self.workers <= 1 or len(pending) <= 1:
+            for number, (low, high) in pending:
+                yield number, scan_chunk(low, high, self.today, self.loan_days)
+            return
+
+        # Дочерние процессы открывают свои подключения: унаследованные подключения родителя закрываются до fork
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            futures = {
+                pool.submit(scan_chunk_in_worker, low, high, self.today, self.loan_days): number
+                for number, (low, high) in pending
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
@@ -0,0 +1,227 @@
+import base64
+import binascii
+import json
+import operator
+from functools import reduce
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+        Курсорная (keyset) пагинация.
+        Курсор хранит значения полей сортировки последней записи страницы, следующая страница выбирается условием
+        WHERE (поле1, поле2, ..., id) > (значения курсора), поэтому время ответа не зависит от номера страницы.
+        Сортировка берется из OrderingFilter представления (ordering=published_date, author__name и т.д.),
+        либо из атрибута ordering пагинатора, либо из Meta.ordering модели. Для однозначности к ней всегда
+        добавляется id. NULL значения всегда идут последними, одинаково для PostgreSQL и SQLite.
+        Пример: "http://127.0.0.1:8000/books/?page_size=50&cursor=eyJ2Ij..."
+    """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = None
+    tiebreaker = 'id'
+    invalid_cursor_message = 'Некорректный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        return self.set_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset для async представлений (library/async_views.py)"""
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        return self.set_page([row async for row in page_queryset])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """Запрос страницы: условие курсора, сортировка и на одну запись больше размера страницы"""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering_fields = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        # Ссылка previous обходит записи в обратном порядке от первой записи страницы
+        reverse = bool(self.cursor and self.cursor['reverse'])
+        ordering = [self._reverse(field) for field in self.ordering_fields] if reverse else self.ordering_fields
+
+        if self.cursor is not None:
+            queryset = queryset.filter(self._after(queryset.model, ordering, self.cursor['values'], reverse))
+        queryset = queryset.order_by(*[self._order_expression(queryset.model, field, reverse) for field in ordering])
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        """Отбрасывает лишнюю запись и запоминает курсоры соседних страниц"""
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.cursor and self.cursor['reverse']:
+            results.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, self.cursor is not None
+
+        self.next_cursor = self._row_values(results[-1]) if has_next and results else None
+        self.previous_cursor = self._row_values(results[0]) if has_previous and results else None
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор страницы из полей next/previous',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Размер страницы, не более {self.max_page_size}',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        """Сортировка страницы с обязательным id в конце"""
+        ordering = None
+        for filter_cls in getattr(view, 'filter_backends', []):
+            if issubclass(filter_cls, OrderingFilter):
+                ordering = filter_cls().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            ordering = self.ordering or queryset.model._meta.ordering or []
+        ordering = [field[:-2] + self.tiebreaker if field.lstrip('-') == 'pk' else field for field in ordering]
+
+        if not any(field.lstrip('-') == self.tiebreaker for field in ordering):
+            descending = bool(ordering) and ordering[0].startswith('-')
+            ordering = [*ordering, f"-{self.tiebreaker}" if descending else self.tiebreaker]
+        return list(ordering)
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.next_cursor, False))
+
+    def get_previous_link(self):
+        if self.previous_cursor is None:
+            return None
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, self.encode_cursor(self.previous_cursor, True)
+        )
+
+    def encode_cursor(self, values, reverse):
+        payload = json.dumps(
+            {'o': self.ordering_fields, 'v': values, 'r': int(reverse)}, cls=DjangoJSONEncoder, separators=(',', ':')
+        )
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            values, reverse, ordering = payload['v'], bool(payload['r']), payload['o']
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        # Курсор действителен только для той сортировки, с которой он был выдан
+        if ordering != self.ordering_fields or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': reverse}
+
+    def _row_values(self, row):
+        values = []
+        for field in self.ordering_fields:
+            path = field.lstrip('-')
+            if isinstance(row, dict):
+                value = row.get(path)
+            else:
+                value = row
+                for attr in path.split('__'):
+                    value = getattr(value, attr, None)
+                    if value is None:
+                        break
+            values.append(value)
+        return values
+
+    @staticmethod
+    def _reverse(field):
+        return field[1:] if field.startswith('-') else f"-{field}"
+
+    def _order_expression(self, model, field, nulls_first):
+        """
+            В прямом порядке NULL в конце, в обратном (для ссылки previous) - в начале.
+            Для NOT NULL полей NULLS FIRST/LAST не указываем, чтобы не мешать использованию индекса
+        """
+        expression = F(field.lstrip('-'))
+        nulls = {}
+        if self._is_nullable(model, field.lstrip('-')):
+            nulls = {'nulls_first': True} if nulls_first else {'nulls_last': True}
+        return expression.desc(**nulls) if field.startswith('-') else expression.asc(**nulls)
+
+    def _after(self, model, ordering, values, nulls_first):
+        """Условие "строка идет после курсора" для лексикографического порядка (поле1, поле2, ..., id)"""
+        conditions = []
+        equal = Q()
+        for field, value in zip(ordering, values):
+            path = field.lstrip('-')
+            if value is None:
+                # После NULL идут только не NULL значения, и только если NULL сортируются первыми
+                if nulls_first:
+                    conditions.append(equal & Q(**{f"{path}__isnull": False}))
+                equal &= Q(**{f"{path}__isnull": True})
+                continue
+            after = Q(**{f"{path}__{'lt' if field.startswith('-') else 'gt'}": value})
+            if not nulls_first and self._is_nullable(model, path):
+                after |= Q(**{f"{path}__isnull": True})
+            conditions.append(equal & after)
+            equal &= Q(**{path: value})
+        return reduce(operator.or_, conditions) if conditions else Q(pk__in=[])
+
+    @staticmethod
+    def _is_nullable(model, path):
+        """Может ли поле (в т.ч. через связи author__name) быть NULL. Аннотации считаем не NULL"""
+        nullable = False
+        for name in path.split('__'):
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return nullable
+            nullable = nullable or field.null
+            model = field.related_model or model
+        return nullable
@@ -0,0 +1,136 @@
+"""
+    Бюджет SQL запросов для представлений.
+
+    Представление объявляет максимальное число запросов на действие:
+        query_budget = {'list': 2, 'retrieve': 2}
+    Для ViewSet ключ - действие (list, retrieve, ...), для generic представлений - HTTP метод в нижнем регистре.
+    В бюджет входят все запросы обработки, включая аутентификацию и проверку прав.
+
+    Проверка бюджета:
+        - в тестах: QueryBudgetTestMixin.assertQueryBudget
+        - в разработке: QueryBudgetMiddleware, режим задается настройкой QUERY_BUDGET_MODE ('off', 'log', 'raise')
+"""
+import logging
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.urls import resolve
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def get_view_action(resolver_match, method):
+    """Класс представления и ключ бюджета для запроса"""
+    func = resolver_match.func
+    view_cls = getattr(func, 'cls', None)
+    actions = getattr(func, 'actions', None)
+    if actions:
+        return view_cls, actions.get(method.lower())
+    return view_cls, method.lower()
+
+
+def get_query_budget(view_cls, action):
+    budget = getattr(view_cls, 'query_budget', None) or {}
+    return budget.get(action)
+
+
+class QueryCounter:
+    """Считает запросы во всех подключениях к базам за время работы контекста"""
+
+    def __init__(self):
+        self.queries = []
+        self._stack = ExitStack()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __len__(self):
+        return len(self.queries)
+
+
+class QueryBudgetMiddleware:
+    """Сообщает о превышении бюджета запросов: пишет предупреждение в лог или выбрасывает QueryBudgetExceeded"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+        if mode == 'off':
+            return self.get_response(request)
+
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+        return self.check_budget(request, response, counter, mode)
+
+    async def __acall__(self, request):
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+        if mode == 'off':
+            return await self.get_response(request)
+
+        # Счетчик подключается в потоке, в котором async ORM выполняет SQL запросы
+        counter = QueryCounter()
+        await sync_to_async(counter.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            counter.__exit__(None, None, None)
+        return self.check_budget(request, response, counter, mode)
+
+    @staticmethod
+    def check_budget(request, response, counter, mode):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None:
+            return response
+        view_cls, action = get_view_action(resolver_match, request.method)
+        budget = get_query_budget(view_cls, action)
+        if budget is not None and len(counter) > budget:
+            message = (
+                f"{request.method} {request.path}: {len(counter)} SQL запросов при бюджете {budget} "
+                f"({view_cls.__name__}.{action})"
+            )
+            if mode == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={'queries': counter.queries})
+        return response
+
+
+class QueryBudgetTestMixin:
+    """Проверка бюджета запросов в тестах APITestCase"""
+
+    def assertQueryBudget(self, method, path, *args, **kwargs):
+        view_cls, action = get_view_action(resolve(path), method)
+        budget = get_query_budget(view_cls, action)
+        self.assertIsNotNone(budget, f"{view_cls.__name__}.{action}: бюджет запросов не объявлен")
+
+        with QueryCounter() as counter:
+            response = getattr(self.client, method.lower())(path, *args, **kwargs)
+        self.assertLessEqual(
+            len(counter), budget,
+            f"{view_cls.__name__}.{action}: {len(counter)} SQL запросов при бюджете {budget}:\n"
+            + "\n".join(counter.queries)
+        )
+        return response
@@ -0,0 +1,164 @@
+"""
+    Проверка планов выполнения основных запросов API (команда check_query_plans и тесты).
+
+    Для каждой проверки выполняется запрос к API (или queryset), перехватываются SQL запросы к проверяемой таблице
+    и для них строится EXPLAIN. Проверка не проходит, если:
+        - в плане нет ожидаемого индекса из 0006_query_indexes
+        - таблица читается полным проходом (SQLite: SCAN таблица без USING, PostgreSQL: Seq Scan)
+        - для сортируемых списков сортировка выполняется отдельным шагом вместо прохода по индексу
+    Так изменение схемы или запросов, после которого API снова читает таблицы целиком, обнаруживается тестом.
+"""
+import re
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from django.db import connection, transaction
+from django.db.models import Count
+from rest_framework.test import APIClient
+
+from library.cache import get_cache
+from library.models import BookIssue, BookSimilarity
+
+FULL_SCAN_PATTERNS = {
+    'sqlite': r'^SCAN (TABLE )?{table}$',
+    'postgresql': r'Seq Scan on {table}\b',
+}
+SORT_PATTERNS = {
+    'sqlite': r'USE TEMP B-TREE FOR (LAST TERM OF )?ORDER BY',
+    'postgresql': r'^\s*(->\s*)?Sort\s',
+}
+
+
+@dataclass
+class PlanCheck:
+    name: str
+    table: str
+    index: str
+    path: Optional[str] = None
+    params: Callable = lambda: {}
+    queryset: Optional[Callable] = None
+    # Страница списка должна читаться в порядке индекса, без отдельной сортировки
+    sorted_by_index: bool = True
+
+
+def reader_export_params():
+    return {'user': BookIssue.objects.values_list('user_id', flat=True).order_by('pk').first(),
+            'date_from': '2000-01-01'}
+
+
+PLAN_CHECKS = (
+    PlanCheck('books by title', 'library_book', 'book_title_id_idx', '/books/'),
+    PlanCheck('books by title desc', 'library_book', 'book_title_id_idx', '/books/',
+              params=lambda: {'ordering': '-title'}),
+    PlanCheck('books by published date', 'library_book', 'book_published_id_idx', '/books/',
+              params=lambda: {'ordering': 'published_date'}),
+    PlanCheck('books average rating', 'library_book', 'bookissue_book_returned_idx', '/books/',
+              params=lambda: {'fields': 'id,average_rating'}),
+    PlanCheck('authors by name', 'library_author', 'author_name_id_idx', '/authors/'),
+    PlanCheck('issues by date', 'library_bookissue', 'bookissue_date_id_idx', '/book-issues/'),
+    PlanCheck('issues export by reader', 'library_bookissue', 'bookissue_user_date_idx', '/book-issues/export/',
+              params=reader_export_params, sorted_by_index=False),
+    PlanCheck('open issues by book', 'library_bookissue', 'bookissue_open_book_uniq',
+              queryset=lambda: BookIssue.objects.filter(is_returned=False).values('book').annotate(total=Count('pk')),
+              sorted_by_index=False),
+    PlanCheck('overdue scan chunk', 'library_bookissue', 'bookissue_open_id_idx',
+              queryset=lambda: BookIssue.objects.filter(is_returned=False, pk__gt=0, pk__lte=5000).values_list(
+                  'pk', 'issue_date'),
+              sorted_by_index=False),
+    PlanCheck('similar books', 'library_booksimilarity', 'booksimilarity_book_rank_idx',
+              queryset=lambda: BookSimilarity.objects.filter(book_id=1).order_by('rank')[:20]),
+)
+
+
+class StatementCollector:
+    """SQL запросы с параметрами во всех подключениях за время работы контекста"""
+
+    def __init__(self):
+        self.statements = []
+        self._stack = ExitStack()
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many:
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+        rows = cursor.fetchall()
+    if connection.vendor == 'sqlite':
+        # EXPLAIN QUERY PLAN: (id, parent, notused, detail)
+        return '\n'.join(row[-1] for row in rows)
+    return '\n'.join(row[0] for row in rows)
+
+
+class QueryPlanChecker:
+    """
+        Проверяет планы запросов PLAN_CHECKS от имени user
+        prefer_indexes - на PostgreSQL запретить планировщику полный проход таблиц (enable_seqscan = off):
+        на маленькой тестовой базе полный проход дешевле индекса, и проверяется только то,
+        что подходящий индекс существует и применим к запросу
+    """
+
+    def __init__(self, user, prefer_indexes=False):
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+        self.prefer_indexes = prefer_indexes
+
+    def statements(self, check):
+        params = check.params()
+        with StatementCollector() as collector:
+            if check.queryset is not None:
+                list(check.queryset())
+            else:
+                # Ответ из кеша не обращается к базе
+                get_cache().clear()
+                response = self.client.get(check.path, params)
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+        table = re.compile(rf'\bFROM "{check.table}"')
+        return [(sql, params) for sql, params in collector.statements
+                if sql.lstrip().upper().startswith('SELECT') and table.search(sql)]
+
+    def problems(self, check, plan):
+        problems = []
+        if check.index not in plan:
+            problems.append(f"не используется индекс {check.index}")
+        full_scan = FULL_SCAN_PATTERNS.get(connection.vendor)
+        if full_scan and re.search(full_scan.format(table=check.table), plan, re.MULTILINE):
+            problems.append(f"полный проход таблицы {check.table}")
+        sort = SORT_PATTERNS.get(connection.vendor)
+        if check.sorted_by_index and sort and re.search(sort, plan, re.MULTILINE):
+            problems.append("сортировка без индекса")
+        return problems
+
+    def check(self, check):
+        statements = self.statements(check)
+        if not statements:
+            return {'name': check.name, 'index': check.index, 'plan': '', 'problems': ["нет запросов к таблице"]}
+        sql, params = statements[0]
+        with transaction.atomic():
+            if self.prefer_indexes and connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = explain(sql, params)
+        return {'name': check.name, 'index': check.index, 'plan': plan, 'problems': self.problems(check, plan)}
+
+    def run(self, checks=PLAN_CHECKS, log=None):
+        results = []
+        for check in checks:
+            result = self.check(check)
+            results.append(result)
+            if log:
+                log(result)
+        return results
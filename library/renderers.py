@@ -0,0 +1,62 @@
+"""
+    Быстрые JSON рендерер и парсер API на orjson.
+
+    Библиотека выбирается настройкой API_JSON_BACKEND: 'stdlib' (по умолчанию) или 'orjson'.
+    orjson не входит в зависимости проекта (pip install orjson), без него используются стандартные
+    JSONRenderer и JSONParser DRF.
+    Ответ совпадает с JSONRenderer: компактный JSON без экранирования не-ASCII символов,
+    с экранированными \\u2028 и \\u2029, даты и время форматируются кодировщиком DRF.
+    Ответы с отступами (Accept: application/json; indent=4, Browsable API) формирует стандартный рендерер.
+"""
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+ORJSON_OPTIONS = 0
+if orjson is not None:
+    # Ключи-числа как у json.dumps, datetime через кодировщик DRF (миллисекунды и 'Z' вместо +00:00)
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def use_orjson():
+    return orjson is not None and getattr(settings, 'API_JSON_BACKEND', 'stdlib') == 'orjson'
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer с кодированием через orjson"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not use_orjson() or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # Например, целые числа длиннее 64 бит
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser с разбором через orjson"""
+
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if not use_orjson() or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,200 @@
+"""
+    Полнотекстовый и нечеткий поиск книг для параметра ?search=
+
+    PostgresBookSearch - tsvector + pg_trgm, обслуживается GIN индексами из миграции 0004_book_search_indexes
+    InMemoryBookSearch - инвертированный индекс по триграммам в памяти процесса (SQLite, тесты)
+    Бэкенд выбирается настройкой BOOK_SEARCH_BACKEND: 'auto' (по умолчанию), 'postgres' или 'memory'
+"""
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+
+from library.models import Author, Book
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Вес совпадения в зависимости от поля книги
+FIELD_WEIGHTS = {
+    'title': 1.0,
+    'author': 0.6,
+    'genre': 0.3,
+}
+
+
+def normalize_text(value):
+    """Приводит текст к виду для поиска: регистр, ё -> е. Работает одинаково для кириллицы и латиницы"""
+    return (value or '').casefold().replace('ё', 'е')
+
+
+def tokenize(value):
+    return TOKEN_RE.findall(normalize_text(value))
+
+
+def trigrams(token):
+    """Триграммы слова с дополнением пробелами, как в pg_trgm"""
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def get_search_setting(name, default):
+    return getattr(settings, name, default)
+
+
+class PostgresBookSearch:
+    """
+        Поиск средствами PostgreSQL:
+            - полнотекстовый поиск по title/genre (конфигурация 'simple' одинаково работает для русского и английского)
+            - нечеткий поиск опечаток через pg_trgm по названию книги и имени автора
+    """
+
+    def search(self, queryset, query):
+        # Импорт внутри метода: модуль требует драйвер PostgreSQL
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+
+        vector = (
+            SearchVector('title', weight='A', config='simple')
+            + SearchVector('genre', weight='C', config='simple')
+        )
+        search_query = SearchQuery(query, config='simple', search_type='websearch')
+        authors = Author.objects.filter(name__trigram_word_similar=query).values('pk')
+
+        return queryset.alias(document=vector).annotate(
+            search_rank=(
+                SearchRank(vector, search_query)
+                + TrigramWordSimilarity(query, 'title')
+                + TrigramWordSimilarity(query, 'author__name') * FIELD_WEIGHTS['author']
+            ),
+        ).filter(
+            Q(document=search_query) | Q(title__trigram_word_similar=query) | Q(author__in=authors)
+        )
+
+
+class InMemoryBookSearchIndex:
+    """
+        Инвертированный индекс книг в памяти процесса
+        слово -> {id книги: вес поля}, триграмма -> слова (для поиска с опечатками и по префиксу)
+        Индекс строится лениво при первом поиске и целиком перестраивается не реже BOOK_SEARCH_INDEX_TTL секунд,
+        между перестроениями изменения книг применяются сигналами
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._postings = {}
+        self._trigram_tokens = defaultdict(set)
+        self._book_tokens = {}
+
+    def reset(self):
+        with self._lock:
+            self._built_at = None
+
+    def _ensure_built(self):
+        ttl = get_search_setting('BOOK_SEARCH_INDEX_TTL', 300)
+        if self._built_at is not None and time.monotonic() - self._built_at < ttl:
+            return
+        postings = {}
+        trigram_tokens = defaultdict(set)
+        book_tokens = {}
+        for book_id, title, genre, author_name in Book.objects.values_list(
+                'id', 'title', 'genre', 'author__name').iterator(chunk_size=5000):
+            self._index_book(postings, trigram_tokens, book_tokens, book_id, title, genre, author_name)
+        self._postings, self._trigram_tokens, self._book_tokens = postings, trigram_tokens, book_tokens
+        self._built_at = time.monotonic()
+
+    @staticmethod
+    def _index_book(postings, trigram_tokens, book_tokens, book_id, title, genre, author_name):
+        weights = {}
+        for field, value in (('title', title), ('author', author_name), ('genre', genre)):
+            for token in tokenize(value):
+                weights[token] = max(weights.get(token, 0), FIELD_WEIGHTS[field])
+        for token, weight in weights.items():
+            if token not in postings:
+                postings[token] = {}
+                for trigram in trigrams(token):
+                    trigram_tokens[trigram].add(token)
+            postings[token][book_id] = weight
+        book_tokens[book_id] = tuple(weights)
+
+    def _remove_book(self, book_id):
+        for token in self._book_tokens.pop(book_id, ()):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(book_id, None)
+
+    def update_book(self, book_id):
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._remove_book(book_id)
+            row = Book.objects.filter(pk=book_id).values_list('id', 'title', 'genre', 'author__name').first()
+            if row is not None:
+                self._index_book(self._postings, self._trigram_tokens, self._book_tokens, *row)
+
+    def remove_book(self, book_id):
+        with self._lock:
+            if self._built_at is not None:
+                self._remove_book(book_id)
+
+    def _similar_tokens(self, query_token):
+        """Слова индекса, похожие на слово запроса: совпадение по префиксу или по триграммам (коэффициент Дайса)"""
+        query_trigrams = trigrams(query_token)
+        overlaps = defaultdict(int)
+        for trigram in query_trigrams:
+            for token in self._trigram_tokens.get(trigram, ()):
+                overlaps[token] += 1
+
+        threshold = get_search_setting('BOOK_SEARCH_SIMILARITY', 0.4)
+        similar = {}
+        for token, overlap in overlaps.items():
+            similarity = 2 * overlap / (len(query_trigrams) + len(trigrams(token)))
+            if len(query_token) > 1 and token.startswith(query_token):
+                similarity = max(similarity, 0.9)
+            if similarity >= threshold:
+                similar[token] = similarity
+        return similar
+
+    def search(self, query, limit):
+        """Возвращает список (id книги, ранг), отсортированный по убыванию ранга"""
+        with self._lock:
+            self._ensure_built()
+            scores = defaultdict(float)
+            for query_token in set(tokenize(query)):
+                best = {}
+                for token, similarity in self._similar_tokens(query_token).items():
+                    for book_id, weight in self._postings[token].items():
+                        best[book_id] = max(best.get(book_id, 0), similarity * weight)
+                for book_id, score in best.items():
+                    scores[book_id] += score
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+book_search_index = InMemoryBookSearchIndex()
+
+
+class InMemoryBookSearch:
+    """Поиск через индекс в памяти процесса, результат ограничен BOOK_SEARCH_MAX_RESULTS лучшими книгами"""
+
+    def search(self, queryset, query):
+        ranked = book_search_index.search(query, get_search_setting('BOOK_SEARCH_MAX_RESULTS', 200))
+        if not ranked:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        return queryset.filter(pk__in=[book_id for book_id, _ in ranked]).annotate(
+            search_rank=Case(
+                *[When(pk=book_id, then=Value(rank)) for book_id, rank in ranked],
+                output_field=FloatField(),
+            )
+        )
+
+
+def get_book_search():
+    backend = get_search_setting('BOOK_SEARCH_BACKEND', 'auto')
+    if backend == 'auto':
+        backend = 'postgres' if connection.vendor == 'postgresql' else 'memory'
+    if backend == 'postgres':
+        return PostgresBookSearch()
+    return InMemoryBookSearch()
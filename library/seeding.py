@@ -0,0 +1,203 @@
+"""
+    Генератор синтетических данных библиотеки для нагрузочных тестов (команда seed_library).
+
+    Объемы задаются явно, популярность распределена по закону Ципфа с показателем skew:
+    немногие авторы пишут большую часть книг, немногие книги и читатели дают большую часть выдач.
+    Все записи создаются через bulk_create частями по batch_size, без сигналов, после чего
+    пересчитываются производные данные: Book.open_issues_count, счетчики пользователей и ReadingStats.
+"""
+import datetime
+import itertools
+import random
+import time
+from django.apps.registry import Apps
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.db import models
+from django.db.models import F
+
+from library import cache
+from library.authors import identity_key
+from library.models import Author, Book, BookIssue
+from library.autocomplete import autocomplete_index
+from library.search import book_search_index
+from library.stats import rebuild_reading_stats
+from users.models import User
+
+GENRES = ('Роман', 'Поэзия', 'Детектив', 'Фантастика', 'Повесть', 'Драма', 'Сказки', 'Биография', 'История')
+SYLLABLES = ('ка', 'ло', 'ми', 'ра', 'то', 'не', 'ви', 'до', 'су', 'ше', 'ба', 'ре', 'го', 'лу', 'зи')
+TITLE_WORDS = ('война', 'мир', 'ночь', 'сад', 'море', 'дорога', 'память', 'город', 'зима', 'письма', 'тень',
+               'остров', 'время', 'дом', 'песня', 'герой', 'сон', 'река', 'огонь', 'звезда')
+
+SEED_PASSWORD = 'password'
+MODERATOR_EMAIL = 'moderator@example.com'
+
+
+def zipf_weights(count, skew):
+    """Накопленные веса для random.choices: элемент с рангом r выбирается с вероятностью ~ 1 / r**skew"""
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def seed_issue_model():
+    """
+        Копия BookIssue в отдельном реестре моделей (Meta.apps) с issue_date без auto_now_add: bulk_create
+        записывает сгенерированные даты, поле общей модели BookIssue не меняется и другие выдачи процесса
+        сохраняются как обычно. Внешние ключи - числовые колонки, связанные модели не нужны
+    """
+    attrs = {'__module__': __name__}
+    for field in BookIssue._meta.concrete_fields:
+        if field.is_relation:
+            attrs[field.attname] = models.BigIntegerField(db_column=field.column)
+        else:
+            attrs[field.name] = field.clone()
+    attrs['issue_date'].auto_now_add = False
+    attrs['Meta'] = type('Meta', (), {'apps': Apps(), 'app_label': BookIssue._meta.app_label,
+                                      'db_table': BookIssue._meta.db_table})
+    return type('SeedBookIssue', (models.Model,), attrs)
+
+
+class LibrarySeeder:
+
+    def __init__(self, users, authors, books, issues, skew=1.1, days=730, open_ratio=0.05, batch_size=2000,
+                 seed=None, log=None):
+        self.counts = {'users': users, 'authors': authors, 'books': books, 'issues': issues}
+        self.skew = skew
+        self.days = days
+        self.open_ratio = open_ratio
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.today = datetime.date.today()
+
+    def name(self, words=2):
+        return ' '.join(
+            ''.join(self.random.choices(SYLLABLES, k=self.random.randint(2, 4))).capitalize() for _ in range(words)
+        )
+
+    def seed(self):
+        started = time.perf_counter()
+        user_ids = self.create_users()
+        author_ids = self.create_authors()
+        book_ids = self.create_books(user_ids, author_ids)
+        self.create_issues(user_ids, book_ids)
+        self.log("Пересчет счетчиков книг и статистики чтения")
+        Book.objects.all().rebuild_open_issues_count()
+        rebuild_reading_stats()
+        book_search_index.reset()
+        autocomplete_index.reset()
+        cache.invalidate(cache.BOOKS)
+        cache.invalidate(cache.AUTHORS)
+        return round(time.perf_counter() - started, 1)
+
+    def bulk_create(self, model, objects):
+        created = []
+        for batch in batched(objects, self.batch_size):
+            created.extend(model.objects.bulk_create(batch))
+        return created
+
+    def create_users(self):
+        moderator, _ = User.objects.get_or_create(email=MODERATOR_EMAIL, defaults={
+            'password': make_password(SEED_PASSWORD), 'is_active': True,
+        })
+        moderator.groups.add(Group.objects.get_or_create(name="Moderators")[0])
+
+        start = User.objects.count()
+        password = make_password(SEED_PASSWORD)  # Хеширование пароля дорогое, один хеш на всех
+        users = self.bulk_create(User, (
+            User(email=f"reader{start + i}@example.com", password=password, is_active=True)
+            for i in range(self.counts['users'])
+        ))
+        self.log(f"Пользователей: {len(users)}")
+        return [moderator.pk] + [user.pk for user in users]
+
+    def generate_authors(self):
+        """Авторы с неповторяющимися identity_key: bulk_create не вызывает save(), ключ задается явно"""
+        keys = set(Author.objects.values_list('identity_key', flat=True))
+        created = 0
+        while created < self.counts['authors']:
+            name, birth_date = self.name(), self.random_date(365 * 200, 365 * 30)
+            key = identity_key(name, birth_date)
+            if key in keys:
+                continue
+            keys.add(key)
+            created += 1
+            yield Author(name=name, birth_date=birth_date, identity_key=key,
+                         biography=f"Автор {self.random.randint(1, 10 ** 6)}. " * self.random.randint(1, 20))
+
+    def create_authors(self):
+        authors = self.bulk_create(Author, self.generate_authors())
+        self.log(f"Авторов: {len(authors)}")
+        return [author.pk for author in authors]
+
+    def create_books(self, user_ids, author_ids):
+        author_weights = zipf_weights(len(author_ids), self.skew)
+        genre_weights = zipf_weights(len(GENRES), self.skew)
+        books = self.bulk_create(Book, (
+            Book(
+                title=' '.join(self.random.choices(TITLE_WORDS, k=self.random.randint(1, 4))).capitalize(),
+                author_id=self.random.choices(author_ids, cum_weights=author_weights)[0],
+                user_id=self.random.choice(user_ids),
+                genre=self.random.choices(GENRES, cum_weights=genre_weights)[0],
+                published_date=self.random_date(365 * 150) if self.random.random() < 0.9 else None,
+                description="Описание книги. " * self.random.randint(0, 30),
+            )
+            for _ in range(self.counts['books'])
+        ))
+        self.log(f"Книг: {len(books)}")
+        return [book.pk for book in books]
+
+    def create_issues(self, user_ids, book_ids):
+        """История выдач, у каждой книги не больше одной невозвращенной выдачи"""
+        book_weights = zipf_weights(len(book_ids), self.skew)
+        user_weights = zipf_weights(len(user_ids), self.skew)
+        # Популярность не должна совпадать с порядком создания
+        book_ids, user_ids = book_ids[:], user_ids[:]
+        self.random.shuffle(book_ids)
+        self.random.shuffle(user_ids)
+        open_books = set()
+        user_totals = {}
+        SeedBookIssue = seed_issue_model()
+
+        def issues():
+            for _ in range(self.counts['issues']):
+                book_id = self.random.choices(book_ids, cum_weights=book_weights)[0]
+                user_id = self.random.choices(user_ids, cum_weights=user_weights)[0]
+                issue_date = self.random_date(self.days)
+                if self.random.random() < self.open_ratio and book_id not in open_books:
+                    open_books.add(book_id)
+                    yield SeedBookIssue(book_id=book_id, user_id=user_id, issue_date=issue_date)
+                    continue
+                return_date = min(issue_date + datetime.timedelta(days=int(self.random.expovariate(1 / 14))),
+                                  self.today)
+                taken, days = user_totals.get(user_id, (0, 0))
+                days_held = BookIssue(issue_date=issue_date, return_date=return_date).calculate_days_held()
+                user_totals[user_id] = (taken + 1, days + days_held)
+                yield SeedBookIssue(book_id=book_id, user_id=user_id, issue_date=issue_date, return_date=return_date,
+                                    is_returned=True,
+                                    rating=self.random.choices((1, 2, 3, 4, 5), (1, 2, 5, 10, 12))[0]
+                                    if self.random.random() < 0.6 else None)
+
+        created = 0
+        for batch in batched(issues(), self.batch_size):
+            created += len(SeedBookIssue.objects.bulk_create(batch))
+            if created % (self.batch_size * 50) == 0:
+                self.log(f"Выдач: {created}")
+        self.log(f"Выдач: {created}, из них на руках: {len(open_books)}")
+
+        # Прибавляются к текущим значениям: модератор и пользователи прошлых запусков сохраняют свои счетчики
+        for batch in batched(user_totals.items(), self.batch_size):
+            User.objects.bulk_update(
+                [User(pk=user_id, total_books_taken=F('total_books_taken') + taken,
+                      total_days_held_books=F('total_days_held_books') + days)
+                 for user_id, (taken, days) in batch],
+                ['total_books_taken', 'total_days_held_books'],
+            )
+
+    def random_date(self, max_days_ago, min_days_ago=0):
+        return self.today - datetime.timedelta(days=self.random.randint(min_days_ago, max_days_ago))
@@ -1,23 +1,85 @@
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
-from library.models import Author, Book, BookIssue
+from library.fieldsets import SparseFieldsetsMixin, requested_includes
+from library.instrumentation import TimedSerializerMixin
+from library.authors import identity_key
+from library.models import DUPLICATE_AUTHOR, Author, Book, BookIssue, BookSimilarity, ReadingStats
+from library.services import BOOK_ISSUED, RETURN_BEFORE_ISSUE, return_book_issue
+
 
+class AuthorBookSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
+    """Книга в ответе автора (?include=books), без автора и рейтинга"""
 
-class AuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ['id', 'title', 'genre', 'published_date', 'open_issues_count']
+
+
+class AuthorSerializer(TimedSerializerMixin, SparseFieldsetsMixin, serializers.ModelSerializer):
     """
         Отображает авторов и позволяет создавать новых авторов
+        Поддерживает выборочные поля ?fields=id,name и ?omit=biography (library/fieldsets.py)
+        В ответе /authors/ по ?include= добавляются (AuthorViewSet готовит их в запросе списка):
+            stats - book_count, open_issue_count и average_rating (аннотации Author.objects.with_stats())
+            books - книги автора (prefetch_related)
+        Автор внутри книги дополнительных полей не получает
+        Отдельный автор не может повторять существующего по имени (без учета регистра и пробелов) и дате рождения,
+        автор внутри книги находится по ним же (BookSerializer.get_author)
     """
 
+    INCLUDES = ('stats', 'books')
+    INCLUDE_FIELDS = {
+        'stats': ('book_count', 'open_issue_count', 'average_rating'),
+        'books': ('books',),
+    }
+
+    book_count = serializers.IntegerField(read_only=True)
+    open_issue_count = serializers.IntegerField(read_only=True)
+    average_rating = serializers.SerializerMethodField()
+    books = AuthorBookSerializer(many=True, read_only=True)
+
     class Meta:
         model = Author
-        fields = '__all__'
+        exclude = ['identity_key']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        includes = set() if self.get_field_path() else requested_includes(self.context.get('request'), self.INCLUDES)
+        for include, names in self.INCLUDE_FIELDS.items():
+            if include not in includes:
+                for name in names:
+                    fields.pop(name, None)
+        return fields
+
+    def validate(self, attrs):
+        if not self.get_field_path():
+            name = attrs.get('name', getattr(self.instance, 'name', None))
+            birth_date = attrs.get('birth_date', getattr(self.instance, 'birth_date', None))
+            duplicates = Author.objects.filter(identity_key=identity_key(name, birth_date))
+            if self.instance is not None:
+                duplicates = duplicates.exclude(pk=self.instance.pk)
+            if duplicates.exists():
+                raise serializers.ValidationError(DUPLICATE_AUTHOR)
+        return attrs
+
+    def get_average_rating(self, obj):
+        # Как BookSerializer.get_average_rating: 0 без оценок, 2 знака
+        return round(obj.average_rating_value or 0, 2)
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(TimedSerializerMixin, SparseFieldsetsMixin, serializers.ModelSerializer):
     """ Отображает книги, рейтинг, автора (словарь) и пользователя, который добавил книгу в библиотеку
         Позволяет обновлять книгу
-        Позволяет добавлять книгу сразу с автором, если ранее он не добавлен
+        Позволяет добавлять книгу сразу с автором, если ранее он не добавлен:
+            автор ищется по identity_key (имя без учета регистра и пробелов и дата рождения),
+            повторные авторы одного запроса берутся из памяти в контексте сериализатора
         get_average_rating - выводит средний рейтинг по книгам, которые возвращены
-            рейтинг рассчитывается в модели Book
+            рейтинг берется из аннотации BookViewSet (Book.objects.with_average_rating()),
+            либо рассчитывается в модели Book, если аннотации нет
+        Поддерживает выборочные поля ?fields=id,title,author.name и ?omit=average_rating (library/fieldsets.py)
     """
 
     author = AuthorSerializer()  # Позволяет отправлять данные автора
@@ -27,25 +89,33 @@ class BookSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = '__all__'
+        read_only_fields = ['open_issues_count']
         ordering = '-title'
 
+    def get_author(self, author_data):
+        """Автор по ключу, создается, если его нет; найденные авторы запоминаются на время запроса"""
+        authors = self.context.setdefault('authors', {})
+        key = identity_key(author_data.get('name'), author_data.get('birth_date'))
+        if key not in authors:
+            authors[key], _ = Author.objects.get_or_create_identity(author_data)
+        return authors[key]
+
     def create(self, validated_data):
         author_data = validated_data.pop('author')  # Извлекаем данные автора
-        author, _ = Author.objects.get_or_create(**author_data)  # Создаем автора, если его нет
+        author = self.get_author(author_data)  # Создаем автора, если его нет
 
-        # Получаем пользователя из контекста
-        user = self.context['request'].user
+        # Получаем пользователя из контекста, по id: в режиме JWT_AUTH_MODE = 'claims' это не модель User
+        user_id = self.context['request'].user.pk
 
         # Создаем книгу с привязкой к пользователю
-        book = Book.objects.create(author=author, user=user, **validated_data)  # Создаем книгу
+        book = Book.objects.create(author=author, user_id=user_id, **validated_data)  # Создаем книгу
         return book
 
     def update(self, instance, validated_data):
         # Извлекаем данные автора, если они есть
         author_data = validated_data.pop('author', None)
         if author_data:
-            author, _ = Author.objects.get_or_create(**author_data)
-            instance.author = author  # Обновляем автора
+            instance.author = self.get_author(author_data)  # Обновляем автора
 
         # Обновляем остальные поля книги
         for attr, value in validated_data.items():
@@ -57,12 +127,13 @@ class BookSerializer(serializers.ModelSerializer):
         return round(obj.calculate_average_rating(), 2)  # Округляем до 2 знаков
 
 
-class BookIssueSerializer(serializers.ModelSerializer):
+class BookIssueSerializer(TimedSerializerMixin, SparseFieldsetsMixin, serializers.ModelSerializer):
     """
         Отображает историю выдачи книги, а также пользователя, который выдал книгу
         Дата выдачи книги присваивается автоматически моделью
         is_returned меняется также автоматически, если отмечена дата возврата книги и она позже даты выдачи
         Позволяет изменять рейтинг книги, если он указан (опционально)
+        Поддерживает выборочные поля ?fields= и ?omit= (library/fieldsets.py)
     """
     book_title = serializers.CharField(source='book.title', read_only=True)  # Название книги
     user_email = serializers.EmailField(source='user.email', read_only=True)  # Email пользователя
@@ -86,29 +157,111 @@ class BookIssueSerializer(serializers.ModelSerializer):
     def validate(self, data):
         if 'return_date' in data:
             if self.instance and data['return_date'] < self.instance.issue_date:
-                raise serializers.ValidationError("Дата возврата не может быть раньше даты выдачи.")
+                raise serializers.ValidationError(RETURN_BEFORE_ISSUE)
+        if self.instance is None and BookIssue.objects.filter(book=data['book'], is_returned=False).exists():
+            raise serializers.ValidationError({'book': [BOOK_ISSUED]})
         return data
 
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            # Книгу выдали параллельным запросом между проверкой и записью (ограничение bookissue_open_book_uniq)
+            raise serializers.ValidationError({'book': [BOOK_ISSUED]})
+
     def update(self, instance, validated_data):
         if 'return_date' in validated_data and not instance.is_returned:
-            # Если return_date указано, обновляем is_returned и пользователя
-            instance.return_date = validated_data['return_date']
-            instance.is_returned = True
-
-            # Обновляем статистику пользователя
-            user = instance.user
-            days_held = instance.calculate_days_held()
-            # Проверка в тестах
-            # print(f"Updating user stats: total_books_taken={user.total_books_taken + 1}, "
-            #       f"total_days_held_books={user.total_days_held_books + days_held}"
-            #       )
-            user.total_books_taken += 1
-            user.total_days_held_books += days_held
-            user.save()
-
-        # Обновляем рейтинг, если он указан
+            # Закрываем выдачу и обновляем статистику пользователя атомарно, см. return_book_issue
+            if not return_book_issue(instance, validated_data['return_date']):
+                # Выдачу уже вернули параллельным запросом
+                instance.refresh_from_db()
+
+        # Обновляем рейтинг, если он указан, записываем только эту колонку
         if 'rating' in validated_data:
             instance.rating = validated_data['rating']
-
-        instance.save()
+            instance.save(update_fields=['rating'])
         return instance
+
+
+class ReadingStatsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+        Статистика чтения по жанру, автору или пользователю из накопительной таблицы ReadingStats
+        average_days_held - среднее число дней на руках по возвращенным выдачам (BookIssue.calculate_days_held)
+        average_rating - средняя оценка возвращенных книг
+    """
+
+    average_days_held = serializers.FloatField(read_only=True)
+    average_rating = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ReadingStats
+        fields = [
+            'dimension',
+            'key',
+            'issues_count',
+            'open_issues_count',
+            'returned_count',
+            'average_days_held',
+            'average_rating',
+        ]
+
+
+class SimilarBookSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+        Похожая книга из рекомендаций "Читатели также брали" (BookSimilarity)
+        score - сходство по метрике построения, co_readers - число читателей, бравших обе книги
+    """
+
+    id = serializers.IntegerField(source='similar_book_id', read_only=True)
+    title = serializers.CharField(source='similar_book.title', read_only=True)
+    author = serializers.CharField(source='similar_book.author.name', read_only=True)
+    genre = serializers.CharField(source='similar_book.genre', read_only=True)
+
+    class Meta:
+        model = BookSimilarity
+        fields = [
+            'id',
+            'title',
+            'author',
+            'genre',
+            'score',
+            'co_readers',
+        ]
+
+
+class BulkItemsSerializer(serializers.Serializer):
+    """Пакет позиций items, не более BOOK_ISSUE_BULK_MAX_ITEMS"""
+
+    def validate_items(self, items):
+        max_items = getattr(settings, 'BOOK_ISSUE_BULK_MAX_ITEMS', 500)
+        if len(items) > max_items:
+            raise serializers.ValidationError(f"Не более {max_items} позиций в одном запросе.")
+        return items
+
+
+class BulkIssueItemSerializer(serializers.Serializer):
+    """Выдача в пакете: существование книги и пользователя проверяется одним запросом на весь пакет"""
+
+    book = serializers.IntegerField()
+    user = serializers.IntegerField()
+
+
+class BulkIssueSerializer(BulkItemsSerializer):
+    """Пакетная выдача книг POST /book-issues/bulk-issue/"""
+
+    items = BulkIssueItemSerializer(many=True, allow_empty=False)
+
+
+class BulkReturnItemSerializer(serializers.Serializer):
+    """Возврат в пакете, по умолчанию текущей датой, с необязательной оценкой"""
+
+    id = serializers.IntegerField()
+    return_date = serializers.DateField(default=datetime.date.today)
+    rating = serializers.IntegerField(min_value=0, allow_null=True, default=None)
+
+
+class BulkReturnSerializer(BulkItemsSerializer):
+    """Пакетный возврат книг POST /book-issues/bulk-return/"""
+
+    items = BulkReturnItemSerializer(many=True, allow_empty=False)
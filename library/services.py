@@ -0,0 +1,172 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from library.models import Book, BookIssue
+from library.signals import issue_state_changed, issues_state_changed
+from users.models import User
+
+BOOK_NOT_FOUND = "Книга не найдена."
+USER_NOT_FOUND = "Пользователь не найден."
+BOOK_ISSUED = "Книга уже выдана и еще не возвращена."
+ISSUE_NOT_FOUND = "Выдача не найдена."
+ISSUE_RETURNED = "Книга по этой выдаче уже возвращена."
+RETURN_BEFORE_ISSUE = "Дата возврата не может быть раньше даты выдачи."
+
+
+def return_book_issue(issue, return_date):
+    """
+        Возврат книги в одной транзакции без гонок:
+            - выдача закрывается условным UPDATE ... WHERE is_returned = false, поэтому повторный
+              или параллельный возврат той же выдачи ничего не меняет
+            - счетчики пользователя увеличиваются через F() в базе, без чтения в Python и без записи остальных колонок
+        Возвращает True, если выдача была закрыта этим вызовом
+    """
+    with transaction.atomic():
+        closed = BookIssue.objects.filter(pk=issue.pk, is_returned=False).update(
+            is_returned=True, return_date=return_date
+        )
+        if not closed:
+            return False
+
+        issue.return_date = return_date
+        issue.is_returned = True
+        User.objects.filter(pk=issue.user_id).update(
+            total_books_taken=F('total_books_taken') + 1,
+            total_days_held_books=F('total_days_held_books') + issue.calculate_days_held(),
+        )
+        issue_state_changed(issue)
+    return True
+
+
+def issue_books(items):
+    """
+        Пакетная выдача книг в одной транзакции, items - список пар (id книги, id пользователя).
+        Блокируются только строки выдаваемых книг (в порядке id, чтобы параллельные пакеты не взаимоблокировались),
+        занятые книги определяются одним запросом по частичному уникальному индексу открытых выдач,
+        выдачи создаются одним bulk_create. Ограничение bookissue_open_book_uniq гарантирует, что книгу
+        не выдадут дважды и без блокировок (SQLite, параллельная одиночная выдача): при нарушении пакет
+        повторяется по одной выдаче в точках сохранения.
+        Возвращает список результатов в порядке items: (выдача, None) или (None, текст ошибки)
+    """
+    book_ids = {book_id for book_id, _ in items}
+    user_ids = set(User.objects.filter(pk__in={user_id for _, user_id in items}).values_list('pk', flat=True))
+    results = [None] * len(items)
+    with transaction.atomic():
+        books = Book.objects.select_for_update().filter(pk__in=book_ids).order_by('pk')
+        books = set(books.values_list('pk', flat=True))
+        issued = set(BookIssue.objects.filter(book__in=books, is_returned=False).values_list('book_id', flat=True))
+        new_issues = []
+        for index, (book_id, user_id) in enumerate(items):
+            if book_id not in books:
+                results[index] = (None, BOOK_NOT_FOUND)
+            elif user_id not in user_ids:
+                results[index] = (None, USER_NOT_FOUND)
+            elif book_id in issued:
+                results[index] = (None, BOOK_ISSUED)
+            else:
+                issued.add(book_id)
+                new_issues.append((index, BookIssue(book_id=book_id, user_id=user_id)))
+
+        try:
+            with transaction.atomic():
+                created = BookIssue.objects.bulk_create([issue for _, issue in new_issues])
+            for index, issue in new_issues:
+                results[index] = (issue, None)
+        except IntegrityError:
+            created = []
+            for index, issue in new_issues:
+                try:
+                    with transaction.atomic():
+                        created += BookIssue.objects.bulk_create([issue])
+                    results[index] = (issue, None)
+                except IntegrityError:
+                    results[index] = (None, BOOK_ISSUED)
+        # bulk_create не отправляет post_save: счетчики книг, статистика и кеш обновляются для всего пакета
+        issues_state_changed(created)
+    return results
+
+
+def close_issues(pks, return_date, rating):
+    """
+        Закрывает все выдачи pks одним условным UPDATE в точке сохранения. Если часть выдач уже закрыта
+        параллельным возвратом, UPDATE отменяется и возвращается False
+    """
+    with transaction.atomic():
+        closed = BookIssue.objects.filter(pk__in=pks, is_returned=False).update(
+            is_returned=True, return_date=return_date, rating=rating
+        )
+        if closed != len(pks):
+            transaction.set_rollback(True)
+            return False
+    return True
+
+
+def return_book_issues(items):
+    """
+        Пакетный возврат в одной транзакции, items - список (id выдачи, дата возврата, оценка или None).
+        Блокируются только строки возвращаемых выдач, выдачи закрываются UPDATE по группам (дата возврата, оценка),
+        счетчики пользователей обновляются одним UPDATE только по выдачам, закрытым этим вызовом.
+        Возвращает список результатов в порядке items: (выдача, None) или (None, текст ошибки)
+    """
+    results = [None] * len(items)
+    with transaction.atomic():
+        issues = BookIssue.objects.select_for_update().filter(pk__in={pk for pk, _, _ in items}).order_by('pk')
+        issues = {issue.pk: issue for issue in issues}
+        returned = []
+        for index, (pk, return_date, rating) in enumerate(items):
+            issue = issues.get(pk)
+            if issue is None:
+                results[index] = (None, ISSUE_NOT_FOUND)
+            elif issue.is_returned:
+                results[index] = (None, ISSUE_RETURNED)
+            elif return_date < issue.issue_date:
+                results[index] = (None, RETURN_BEFORE_ISSUE)
+            else:
+                issue.is_returned = True
+                issue.return_date = return_date
+                if rating is not None:
+                    issue.rating = rating
+                returned.append((index, issue))
+                results[index] = (issue, None)
+        if not returned:
+            return results
+
+        # Позиции пакета обычно возвращаются одной датой и с одинаковой оценкой (или без нее):
+        # выдачи закрываются условными UPDATE по группам, как в return_book_issue
+        groups = defaultdict(list)
+        for index, issue in returned:
+            groups[issue.return_date, issue.rating].append((index, issue))
+        closed = []
+        for (return_date, rating), group in groups.items():
+            if close_issues([issue.pk for _, issue in group], return_date, rating):
+                closed += [issue for _, issue in group]
+                continue
+            # Без блокировки строк (SQLite) выдачу группы мог закрыть параллельный возврат:
+            # выдачи группы закрываются по одной, счетчики и статистика - только по закрытым этим вызовом
+            for index, issue in group:
+                if close_issues([issue.pk], return_date, rating):
+                    closed.append(issue)
+                else:
+                    results[index] = (None, ISSUE_RETURNED)
+        update_user_counters(closed)
+        issues_state_changed(closed)
+    return results
+
+
+def update_user_counters(returned):
+    """Счетчики пользователей по возвращенным выдачам одним UPDATE ... CASE, как в return_book_issue через F()"""
+    taken, days = {}, {}
+    for issue in returned:
+        taken[issue.user_id] = taken.get(issue.user_id, 0) + 1
+        days[issue.user_id] = days.get(issue.user_id, 0) + issue.calculate_days_held()
+
+    def increments(values):
+        return Case(*[When(pk=user_id, then=Value(value)) for user_id, value in values.items()],
+                    default=Value(0), output_field=IntegerField())
+
+    User.objects.filter(pk__in=taken).update(
+        total_books_taken=F('total_books_taken') + increments(taken),
+        total_days_held_books=F('total_days_held_books') + increments(days),
+    )
@@ -0,0 +1,244 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from library import cache
+from library.autocomplete import autocomplete_index
+from library.models import Author, Book, BookIssue, OverdueNotice
+from library.search import book_search_index
+from library.stats import update_reading_stats_many
+
+# Книга возвращена (выдача закрыта). Аргументы: instance - выдача с заполненными return_date и is_returned
+issue_returned = Signal()
+# Изменились отслеживаемые поля выдачи (BookIssue.TRACKED_FIELDS).
+# Аргументы: instance, old_state и new_state - результаты BookIssue.get_state(), None - выдачи нет (создание/удаление)
+issue_changed = Signal()
+# Изменились выдачи одной операцией (сохранение, возврат, пакетная выдача или возврат), отправляется после issue_changed
+# каждой выдачи. Аргументы: changes - список (instance, old_state, new_state).
+# Получатели обрабатывают все выдачи операции одним набором запросов
+issues_changed = Signal()
+
+# Поля save(update_fields=...), при записи которых меняются счетчики и статистика
+TRACKED_UPDATE_FIELDS = {'book', 'book_id', 'user', 'user_id', 'is_returned', 'issue_date', 'return_date', 'rating'}
+
+
+def _move_open_issues(moves):
+    """
+        Переносит невозвращенные выдачи между книгами, moves - пары (старая книга, новая книга),
+        None - выдача закрыта/отсутствует. Книги с одинаковым изменением счетчика обновляются одним запросом
+    """
+    deltas = Counter()
+    for old_book_id, new_book_id in moves:
+        if old_book_id == new_book_id:
+            continue
+        if old_book_id is not None:
+            deltas[old_book_id] -= 1
+        if new_book_id is not None:
+            deltas[new_book_id] += 1
+    books_by_delta = defaultdict(list)
+    for book_id, delta in deltas.items():
+        if delta:
+            books_by_delta[delta].append(book_id)
+    for delta, book_ids in books_by_delta.items():
+        Book.objects.filter(pk__in=book_ids).change_open_issues_count(delta)
+
+
+def _open_book_id(state):
+    return state['book_id'] if state is not None and not state['is_returned'] else None
+
+
+def issue_state_changed(instance):
+    """
+        Вызывается после записи выдачи в базу (post_save или return_book_issue):
+        переносит счетчик Book.open_issues_count, сообщает об изменении сигналами issue_changed и issues_changed
+        и о возврате книги сигналом issue_returned
+    """
+    issues_state_changed([instance])
+
+
+def issues_state_changed(instances):
+    """issue_state_changed для нескольких выдач, записанных одной операцией (bulk_create, bulk_update)"""
+    changes = []
+    for instance in instances:
+        new_state = instance.get_state()
+        changes.append((instance, instance._loaded_state, new_state))
+        instance._loaded_state = new_state
+    _move_open_issues((_open_book_id(old_state), _open_book_id(new_state)) for _, old_state, new_state in changes)
+
+    changes = [change for change in changes if change[1] != change[2]]
+    for instance, old_state, new_state in changes:
+        issue_changed.send(sender=BookIssue, instance=instance, old_state=old_state, new_state=new_state)
+        if _open_book_id(old_state) is not None and instance.is_returned:
+            issue_returned.send(sender=BookIssue, instance=instance)
+    if changes:
+        issues_changed.send(sender=BookIssue, changes=changes)
+
+
+@receiver(post_save, sender=BookIssue)
+def update_book_open_issues_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+        Поддерживает Book.open_issues_count и статистику чтения при создании выдачи, возврате книги,
+        смене книги и оценки у выдачи
+    """
+    if update_fields is not None and not TRACKED_UPDATE_FIELDS & set(update_fields):
+        return
+    issue_state_changed(instance)
+
+
+def _origin_model(origin):
+    """Модель, с удаления которой начался каскад: origin сигналов удаления - объект или QuerySet"""
+    return origin.model if isinstance(origin, QuerySet) else type(origin)
+
+
+def issues_deleted(issues):
+    """
+        Выдачи, удаляемые каскадно вместе с книгой или автором: состояния читаются одним запросом,
+        счетчики, статистика и подсказки обновляются одним сигналом issues_changed на всю операцию
+        вместо post_delete каждой выдачи
+    """
+    issues = list(issues.only(*(field.removesuffix('_id') for field in BookIssue.TRACKED_FIELDS)))
+    changes = [(issue, issue._loaded_state, None) for issue in issues]
+    if not changes:
+        return
+    _move_open_issues((_open_book_id(old_state), None) for _, old_state, _ in changes)
+    for instance, old_state, _ in changes:
+        issue_changed.send(sender=BookIssue, instance=instance, old_state=old_state, new_state=None)
+    issues_changed.send(sender=BookIssue, changes=changes)
+
+
+@receiver(pre_delete, sender=Book)
+def update_issues_on_book_delete(sender, instance, origin=None, **kwargs):
+    # pre_delete всех объектов каскада отправляется до удаления строк, выдачи книги еще в базе.
+    # При удалении автора выдачи всех его книг учитывает update_issues_on_author_delete
+    if _origin_model(origin) is Book:
+        issues_deleted(BookIssue.objects.filter(book=instance))
+
+
+@receiver(pre_delete, sender=Author)
+def update_issues_on_author_delete(sender, instance, origin=None, **kwargs):
+    if _origin_model(origin) is Author:
+        issues_deleted(BookIssue.objects.filter(book__author=instance))
+
+
+@receiver(post_delete, sender=BookIssue)
+def update_book_open_issues_on_delete(sender, instance, origin=None, **kwargs):
+    """Удаление невозвращенной выдачи освобождает книгу, вклад выдачи вычитается из статистики"""
+    if _origin_model(origin) in (Book, Author):
+        # Учтена в pre_delete книги или автора
+        return
+    old_state = instance._loaded_state
+    _move_open_issues([(_open_book_id(old_state), None)])
+    instance._loaded_state = None
+    if old_state is not None:
+        issue_changed.send(sender=BookIssue, instance=instance, old_state=old_state, new_state=None)
+        issues_changed.send(sender=BookIssue, changes=[(instance, old_state, None)])
+
+
+@receiver(issues_changed, sender=BookIssue)
+def update_reading_stats_on_issue_change(sender, changes, **kwargs):
+    update_reading_stats_many([(old_state, new_state) for _, old_state, new_state in changes])
+
+
+@receiver(post_save, sender=Book)
+def update_search_index_on_book_save(sender, instance, **kwargs):
+    """Индекс поиска в памяти обновляется только после фиксации транзакции"""
+    transaction.on_commit(lambda: book_search_index.update_book(instance.pk))
+
+
+@receiver(post_delete, sender=Book)
+def update_search_index_on_book_delete(sender, instance, **kwargs):
+    book_id = instance.pk
+    transaction.on_commit(lambda: book_search_index.remove_book(book_id))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def reset_search_index_on_author_change(sender, instance, **kwargs):
+    """Имя автора входит в индекс всех его книг, поэтому индекс перестраивается целиком при следующем поиске"""
+    transaction.on_commit(book_search_index.reset)
+
+
+@receiver(post_save, sender=Book)
+def update_autocomplete_on_book_save(sender, instance, **kwargs):
+    transaction.on_commit(lambda: autocomplete_index.update_book(instance.pk))
+
+
+@receiver(post_delete, sender=Book)
+def update_autocomplete_on_book_delete(sender, instance, **kwargs):
+    book_id = instance.pk
+    transaction.on_commit(lambda: autocomplete_index.remove_book(book_id))
+
+
+@receiver(post_save, sender=Author)
+def update_autocomplete_on_author_save(sender, instance, **kwargs):
+    transaction.on_commit(lambda: autocomplete_index.update_author(instance.pk))
+
+
+@receiver(post_delete, sender=Author)
+def update_autocomplete_on_author_delete(sender, instance, **kwargs):
+    author_id = instance.pk
+    transaction.on_commit(lambda: autocomplete_index.remove_author(author_id))
+
+
+@receiver(issues_changed, sender=BookIssue)
+def update_autocomplete_on_issues_change(sender, changes, **kwargs):
+    """Популярность в подсказках - число выдач книги, возвраты и оценки ее не меняют"""
+    deltas = Counter()
+    for _, old_state, new_state in changes:
+        old_book_id = old_state and old_state['book_id']
+        new_book_id = new_state and new_state['book_id']
+        if old_book_id != new_book_id:
+            deltas[old_book_id] -= 1
+            deltas[new_book_id] += 1
+    deltas.pop(None, None)
+    deltas = {book_id: delta for book_id, delta in deltas.items() if delta}
+    if deltas:
+        transaction.on_commit(lambda: autocomplete_index.add_issues(deltas))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_cache(sender, instance, **kwargs):
+    cache.invalidate(cache.BOOKS, instance.pk)
+
+
+@receiver(post_save, sender=Author)
+def invalidate_author_cache(sender, instance, created, **kwargs):
+    """Автор вложен в ответ книги, поэтому при изменении сбрасываются и карточки его книг"""
+    cache.invalidate(cache.AUTHORS, instance.pk)
+    if not created:
+        cache.invalidate(cache.BOOKS, *instance.books.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def invalidate_author_cache_on_delete(sender, instance, **kwargs):
+    # Книги автора удаляются каскадно и сбрасывают свой кеш сами
+    cache.invalidate(cache.AUTHORS, instance.pk)
+
+
+@receiver(post_save, sender=BookIssue)
+@receiver(post_delete, sender=BookIssue)
+def invalidate_book_cache_on_issue_change(sender, instance, origin=None, **kwargs):
+    """Выдачи влияют на рейтинг и количество выданных экземпляров книги"""
+    # Выдачи, удаленные вместе с книгой или автором, сбрасываются сигналом issues_changed из pre_delete
+    if _origin_model(origin) not in (Book, Author):
+        cache.invalidate(cache.BOOKS, instance.book_id)
+
+
+@receiver(issues_changed, sender=BookIssue)
+def invalidate_book_cache_on_issues_change(sender, changes, **kwargs):
+    """Возвраты и пакетные операции проходят без post_save, карточки всех книг операции сбрасываются вместе"""
+    book_ids = {state['book_id'] for _, *states in changes for state in states if state is not None}
+    cache.invalidate(cache.BOOKS, *sorted(book_ids))
+
+
+@receiver(issues_changed, sender=BookIssue)
+def delete_overdue_notices_on_return(sender, changes, **kwargs):
+    """Возвращенная книга больше не просрочена, уведомления удаляются сразу, не дожидаясь scan_overdue_issues"""
+    returned = [instance.pk for instance, old_state, new_state in changes
+                if _open_book_id(old_state) is not None and new_state is not None and new_state['is_returned']]
+    if returned:
+        OverdueNotice.objects.filter(issue_id__in=returned).delete()
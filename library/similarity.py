@@ -0,0 +1,169 @@
+"""
+    Рекомендации "Читатели также брали" (/books/{id}/similar/) по совместным выдачам книг.
+
+    История выдач загружается как разреженная матрица читатель × книга в двух представлениях:
+    книги каждого читателя (строки) и читатели каждой книги (столбцы), повторные выдачи книги читателю не учитываются.
+    Для книги a число общих читателей с каждой книгой b - сумма строк матрицы по читателям a
+    (Counter.update по спискам книг), это столбец a матрицы совместной встречаемости без ее построения целиком.
+    Метрики (настройка BOOK_SIMILARITY_METRIC):
+        - 'cosine' - общие читатели / sqrt(читателей a * читателей b), популярные книги не попадают в каждый список
+        - 'cooccurrence' - число общих читателей
+    Первые BOOK_SIMILARITY_TOP_K соседей книги записываются в BookSimilarity с местом в списке, запрос API читает
+    k строк по индексу (book, rank).
+
+    Читатели с числом книг больше BOOK_SIMILARITY_MAX_READER_BOOKS не учитываются: число пар растет квадратично,
+    а сходства такие читатели почти не дают.
+
+    Инкрементальное обновление учитывает выдачи, созданные после прошлого построения (BookSimilarityBuild).
+    Новая выдача (читатель, книга) меняет число общих читателей книги с книгами этого читателя, поэтому
+    пересчитываются списки всех книг читателей новых выдач. У остальных книг в косинусе остается старое число
+    читателей соседей, удаление выдач и смена параметров учитываются полным перестроением (--full).
+"""
+import heapq
+import math
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from library.models import Book, BookIssue, BookSimilarity, BookSimilarityBuild
+
+COSINE = 'cosine'
+COOCCURRENCE = 'cooccurrence'
+METRICS = (COSINE, COOCCURRENCE)
+
+
+def get_top_k():
+    return getattr(settings, 'BOOK_SIMILARITY_TOP_K', 20)
+
+
+def get_metric():
+    return getattr(settings, 'BOOK_SIMILARITY_METRIC', COSINE)
+
+
+def get_max_reader_books():
+    return getattr(settings, 'BOOK_SIMILARITY_MAX_READER_BOOKS', 500)
+
+
+class Incidence:
+    """Разреженная матрица читатель × книга: книги читателя и читатели книги"""
+
+    def __init__(self, pairs, max_reader_books):
+        books_of = defaultdict(set)
+        for user_id, book_id in pairs:
+            books_of[user_id].add(book_id)
+        self.books_of = {user_id: tuple(books) for user_id, books in books_of.items()
+                         if len(books) <= max_reader_books}
+        readers = defaultdict(list)
+        for user_id, books in self.books_of.items():
+            for book_id in books:
+                readers[book_id].append(user_id)
+        self.readers = dict(readers)
+        # 1 / sqrt(число читателей) для косинуса, считается один раз на книгу
+        self.inverse_norms = {book_id: 1 / math.sqrt(len(users)) for book_id, users in self.readers.items()}
+
+    @classmethod
+    def load(cls, last_issue_id, max_reader_books, chunk_size=20000):
+        pairs = BookIssue.objects.filter(pk__lte=last_issue_id).order_by().values_list('user_id', 'book_id')
+        return cls(pairs.iterator(chunk_size=chunk_size), max_reader_books)
+
+    def neighbours(self, book_id, metric, top_k):
+        """Первые top_k соседей книги: список (сходство, общих читателей, id книги)"""
+        co_readers = Counter()
+        for user_id in self.readers.get(book_id, ()):
+            co_readers.update(self.books_of[user_id])
+        co_readers.pop(book_id, None)
+        # Кортежи сравниваются без функции key; при равном сходстве выше книга с меньшим id (-id),
+        # чтобы списки не менялись от прогона к прогону
+        if metric == COSINE:
+            norms = self.inverse_norms
+            scored = [(count * norms[other], count, -other) for other, count in co_readers.items()]
+            scale = norms.get(book_id, 0)
+        else:
+            scored = [(count, count, -other) for other, count in co_readers.items()]
+            scale = 1
+        return [(score * scale, count, -other) for score, count, other in heapq.nlargest(top_k, scored)]
+
+
+def write_neighbours(lists):
+    """Заменяет списки соседей книг {id книги: [(сходство, общих читателей, id соседа)]} одной транзакцией"""
+    with transaction.atomic():
+        BookSimilarity.objects.filter(book_id__in=lists).delete()
+        BookSimilarity.objects.bulk_create([
+            BookSimilarity(book_id=book_id, similar_book_id=other, rank=rank, score=round(score, 6), co_readers=count)
+            for book_id, neighbours in lists.items()
+            for rank, (score, count, other) in enumerate(neighbours, start=1)
+        ], batch_size=1000)
+
+
+class SimilarityBuilder:
+    """
+        Построение BookSimilarity
+        full - пересчитать все книги, иначе только затронутые выдачами после прошлого построения
+        (без прошлого построения или при других параметрах выполняется полное)
+    """
+
+    def __init__(self, metric=None, top_k=None, max_reader_books=None, batch_size=1000, log=None):
+        self.metric = metric or get_metric()
+        if self.metric not in METRICS:
+            raise ValueError(f"Неизвестная метрика {self.metric}, допустимы: {', '.join(METRICS)}")
+        self.top_k = top_k or get_top_k()
+        self.max_reader_books = max_reader_books or get_max_reader_books()
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+
+    def previous_build(self):
+        """Прошлое построение с теми же параметрами, от которого можно обновлять инкрементально"""
+        build = BookSimilarityBuild.objects.order_by('-pk').first()
+        if build is None or (build.metric, build.top_k, build.max_reader_books) != (
+                self.metric, self.top_k, self.max_reader_books):
+            return None
+        return build
+
+    def run(self, full=False):
+        started = time.perf_counter()
+        previous = None if full else self.previous_build()
+        # Выдачи, созданные во время построения, войдут в следующее обновление
+        last_issue_id = BookIssue.objects.aggregate(last=Max('pk'))['last'] or 0
+        incidence = Incidence.load(last_issue_id, self.max_reader_books)
+        loaded = time.perf_counter()
+
+        if previous is None:
+            book_ids = list(Book.objects.order_by('pk').values_list('pk', flat=True))
+        else:
+            readers = BookIssue.objects.filter(pk__gt=previous.last_issue_id, pk__lte=last_issue_id).values_list(
+                'user_id', flat=True).distinct()
+            book_ids = sorted({book_id for user_id in readers for book_id in incidence.books_of.get(user_id, ())})
+        self.log(f"Матрица: читателей {len(incidence.books_of)}, книг {len(incidence.readers)}, "
+                 f"{'полное перестроение' if previous is None else f'затронуто книг {len(book_ids)}'}")
+
+        books, rows, batch = 0, 0, {}
+        for book_id in book_ids:
+            batch[book_id] = incidence.neighbours(book_id, self.metric, self.top_k)
+            if len(batch) >= self.batch_size:
+                books, rows = books + len(batch), rows + self.flush(batch)
+                batch = {}
+        if batch:
+            books, rows = books + len(batch), rows + self.flush(batch)
+
+        BookSimilarityBuild.objects.create(
+            metric=self.metric, top_k=self.top_k, max_reader_books=self.max_reader_books,
+            last_issue_id=last_issue_id, is_full=previous is None, books_updated=books,
+        )
+        elapsed = time.perf_counter() - started
+        return {
+            'full': previous is None,
+            'readers': len(incidence.books_of),
+            'books': books,
+            'rows': rows,
+            'last_issue_id': last_issue_id,
+            'load_seconds': round(loaded - started, 3),
+            'elapsed_seconds': round(elapsed, 3),
+        }
+
+    def flush(self, batch):
+        write_neighbours(batch)
+        self.log(f"Записаны соседи книг до id {max(batch)}")
+        return sum(map(len, batch.values()))
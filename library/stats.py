@@ -0,0 +1,152 @@
+"""
+    Инкрементальное обновление статистики чтения ReadingStats.
+
+    Вклад выдачи в статистику определяется ее состоянием (BookIssue.get_state()):
+    выдача, книга на руках, возврат с днями на руках (BookIssue.calculate_days_held) и оценкой.
+    При изменении выдачи к строкам ее жанра, автора и пользователя прибавляется разница вкладов
+    нового и старого состояния через F(), без чтения счетчиков в Python.
+    Смена жанра или автора у книги задним числом не учитывается, для этого есть rebuild_reading_stats.
+"""
+import logging
+import operator
+from collections import Counter, defaultdict
+from functools import reduce
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from library.models import Book, BookIssue, ReadingStats
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('issues_count', 'open_issues_count', 'returned_count', 'days_held_total', 'rating_sum', 'rating_count')
+
+
+def contribution(state):
+    """Вклад выдачи в счетчики статистики"""
+    if state is None:
+        return Counter()
+    counters = Counter(issues_count=1)
+    if not state['is_returned']:
+        counters['open_issues_count'] = 1
+        return counters
+    counters['returned_count'] = 1
+    counters['days_held_total'] = BookIssue(
+        issue_date=state['issue_date'], return_date=state['return_date']
+    ).calculate_days_held()
+    if state['rating'] is not None:
+        counters['rating_sum'] = state['rating']
+        counters['rating_count'] = 1
+    return counters
+
+
+def stats_keys(state, books):
+    genre, author_id = books.get(state['book_id'], (None, None))
+    keys = [(ReadingStats.USER, str(state['user_id']))]
+    if author_id is not None:
+        keys += [(ReadingStats.GENRE, genre), (ReadingStats.AUTHOR, str(author_id))]
+    return keys
+
+
+def stats_rows(keys):
+    condition = reduce(operator.or_, (Q(dimension=dimension, key=key) for dimension, key in keys))
+    return ReadingStats.objects.filter(condition)
+
+
+def add_to_rows(deltas):
+    """Прибавляет разницы {id строки: Counter} одним UPDATE ... CASE по всем строкам и счетчикам"""
+    changes = {}
+    for name in COUNTERS:
+        cases = [When(pk=pk, then=Value(delta[name])) for pk, delta in deltas.items() if delta[name]]
+        if cases:
+            changes[name] = F(name) + Case(*cases, default=Value(0), output_field=IntegerField())
+    ReadingStats.objects.filter(pk__in=deltas).update(**changes)
+
+
+def apply_deltas(deltas):
+    """
+        deltas - {(разрез, ключ): Counter}, строки статистики создаются при первом обращении.
+        Набор запросов не зависит от числа строк: существующие строки блокируются и обновляются одним UPDATE
+    """
+    deltas = {stats_key: delta for stats_key, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+    with transaction.atomic():
+        # Строки блокируются до UPDATE: строка, созданная параллельно после UPDATE, не будет принята за обновленную
+        existing = {(dimension, key): pk for pk, dimension, key in
+                    stats_rows(deltas).select_for_update().values_list('pk', 'dimension', 'key')}
+        if existing:
+            add_to_rows({pk: deltas[stats_key] for stats_key, pk in existing.items()})
+        for (dimension, key), delta in deltas.items():
+            if (dimension, key) in existing:
+                continue
+            delta = {name: value for name, value in delta.items() if value}
+            try:
+                with transaction.atomic():
+                    ReadingStats.objects.create(dimension=dimension, key=key, **delta)
+            except IntegrityError:
+                # Строку создал параллельный запрос - разница прибавляется к ней. Если строки по-прежнему нет,
+                # ошибка не из-за гонки: отрицательная разница без строки нарушает CHECK счетчиков,
+                # статистика разошлась с выдачами
+                updated = ReadingStats.objects.filter(dimension=dimension, key=key).update(
+                    **{name: F(name) + value for name, value in delta.items()}
+                )
+                if not updated:
+                    logger.error(
+                        "Нет строки статистики %s=%s для изменения %s, выполните rebuild_reading_stats",
+                        dimension, key, delta, extra={'dimension': dimension, 'key': key},
+                    )
+
+
+def update_reading_stats(old_state, new_state):
+    """Переносит вклад выдачи из old_state в new_state (None - выдачи нет)"""
+    update_reading_stats_many([(old_state, new_state)])
+
+
+def update_reading_stats_many(changes):
+    """
+        update_reading_stats для нескольких выдач, changes - пары (old_state, new_state).
+        Книги загружаются одним запросом, разницы вкладов суммируются по строкам статистики
+    """
+    book_ids = {state['book_id'] for change in changes for state in change if state is not None}
+    books = {pk: (genre, author_id) for pk, genre, author_id in
+             Book.objects.filter(pk__in=book_ids).values_list('pk', 'genre', 'author_id')}
+
+    deltas = defaultdict(Counter)
+    for old_state, new_state in changes:
+        for state, sign in ((old_state, -1), (new_state, 1)):
+            if state is None:
+                continue
+            for stats_key in stats_keys(state, books):
+                for name, value in contribution(state).items():
+                    deltas[stats_key][name] += sign * value
+    apply_deltas(deltas)
+
+
+ISSUE_ROW_FIELDS = ('book_id', 'user_id', 'is_returned', 'issue_date', 'return_date', 'rating',
+                    'book__genre', 'book__author_id')
+
+
+def collect_reading_stats(issue_rows):
+    """Итоговые счетчики {(разрез, ключ): Counter} по строкам выдач в порядке ISSUE_ROW_FIELDS"""
+    totals = defaultdict(Counter)
+    for book_id, user_id, is_returned, issue_date, return_date, rating, genre, author_id in issue_rows:
+        state = {'book_id': book_id, 'user_id': user_id, 'is_returned': is_returned,
+                 'issue_date': issue_date, 'return_date': return_date, 'rating': rating}
+        counters = contribution(state)
+        for stats_key in stats_keys(state, {book_id: (genre, author_id)}):
+            totals[stats_key].update(counters)
+    return totals
+
+
+def rebuild_reading_stats(chunk_size=5000):
+    """Полный пересчет статистики по всем выдачам, возвращает количество строк статистики"""
+    totals = collect_reading_stats(BookIssue.objects.values_list(*ISSUE_ROW_FIELDS).iterator(chunk_size=chunk_size))
+    with transaction.atomic():
+        ReadingStats.objects.all().delete()
+        ReadingStats.objects.bulk_create(
+            [ReadingStats(dimension=dimension, key=key, **{name: counters[name] for name in COUNTERS})
+             for (dimension, key), counters in totals.items()],
+            batch_size=1000,
+        )
+    return len(totals)
@@ -0,0 +1,1739 @@
+import csv
+import datetime
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
+
+from django.core.cache import caches
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Avg
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from library.authors import identity_key
+from library.autocomplete import PrefixIndex, autocomplete_index
+from library.benchmark import EndpointBenchmark, uncovered_routes
+from library.exports import EXPORT_FIELDS
+from library.instrumentation import registry
+from library.renderers import FastJSONParser, FastJSONRenderer
+from library.models import Author, Book, BookIssue, BookSimilarity, BookSimilarityBuild, OverdueNotice, ReadingStats
+from library.overdue import OverdueScanner, scan_chunk
+from library.paginators import KeysetPagination
+from library.query_plans import PlanCheck, QueryPlanChecker
+from library.query_budget import QueryBudgetTestMixin
+from library.search import book_search_index
+from library.seeding import MODERATOR_EMAIL, LibrarySeeder
+from library.services import return_book_issue
+from library.similarity import SimilarityBuilder
+from library.stats import rebuild_reading_stats
+from users.models import User
+from users.roles import role_cache
+
+
+class BookListRatingTestCase(APITestCase):
+    """
+        Средний рейтинг в списке книг считается одним запросом, без запроса на каждую книгу
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email="user@example.com",
+            password="password"
+        )
+        self.client.force_authenticate(user=self.user)
+
+        self.author = Author.objects.create(name="Пушкин А.С.", birth_date="1799-06-06", biography="Русский поэт.")
+
+        self.books = [
+            Book.objects.create(title=f"Книга {i}", genre="Роман", author=self.author, user=self.user)
+            for i in range(5)
+        ]
+        for book in self.books:
+            BookIssue.objects.create(book=book, user=self.user, rating=4, is_returned=True)
+            BookIssue.objects.create(book=book, user=self.user, rating=5, is_returned=True)
+            # Невозвращенная выдача не учитывается в рейтинге
+            BookIssue.objects.create(book=book, user=self.user, rating=1, is_returned=False)
+
+    def test_list_average_rating(self):
+        response = self.client.get("/api/books/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([book['average_rating'] for book in response.data['results']], [4.5] * 5)
+
+    def test_list_single_rating_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/books/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rating_queries = [query for query in queries.captured_queries if 'AVG(' in query['sql'].upper()]
+        self.assertEqual(len(rating_queries), 1)
+
+    def test_model_method_without_annotation(self):
+        self.assertEqual(self.books[0].calculate_average_rating(), 4.5)
+        book = Book.objects.create(title="Без выдач", genre="Роман", author=self.author, user=self.user)
+        self.assertEqual(book.calculate_average_rating(), 0)
+
+
+class BookAvailabilityTestCase(APITestCase):
+    """
+        Счетчик невозвращенных выдач Book.open_issues_count и фильтр is_returned
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email="user@example.com",
+            password="password"
+        )
+        self.client.force_authenticate(user=self.user)
+
+        self.author = Author.objects.create(name="Пушкин А.С.", birth_date="1799-06-06", biography="Русский поэт.")
+        self.book = Book.objects.create(title="Евгений Онегин", genre="Роман", author=self.author, user=self.user)
+        self.free_book = Book.objects.create(title="Дубровский", genre="Роман", author=self.author, user=self.user)
+
+    def assertOpenIssues(self, book, count):
+        book.refresh_from_db()
+        self.assertEqual(book.open_issues_count, count)
+
+    def test_counter_follows_issue_lifecycle(self):
+        issue = BookIssue.objects.create(book=self.book, user=self.user)
+        self.assertOpenIssues(self.book, 1)
+
+        response = self.client.patch(f"/api/book-issues/{issue.id}/", {"return_date": "2999-01-01"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertOpenIssues(self.book, 0)
+
+        open_issue = BookIssue.objects.create(book=self.book, user=self.user)
+        self.assertOpenIssues(self.book, 1)
+        open_issue.delete()
+        self.assertOpenIssues(self.book, 0)
+
+    def test_is_returned_filter(self):
+        BookIssue.objects.create(book=self.book, user=self.user, is_returned=True)
+        BookIssue.objects.create(book=self.book, user=self.user)
+        BookIssue.objects.create(book=self.free_book, user=self.user, is_returned=True)
+
+        response = self.client.get("/api/books/?is_returned=true")
+        self.assertEqual([book['title'] for book in response.data['results']], ["Дубровский"])
+
+        response = self.client.get("/api/books/?is_returned=false")
+        self.assertEqual([book['title'] for book in response.data['results']], ["Евгений Онегин"])
+
+    def test_rebuild_command(self):
+        BookIssue.objects.create(book=self.book, user=self.user)
+        Book.objects.update(open_issues_count=5)
+
+        call_command('rebuild_book_availability', stdout=StringIO())
+        self.assertOpenIssues(self.book, 1)
+        self.assertOpenIssues(self.free_book, 0)
+
+
+class BookSearchTestCase(APITestCase):
+    """
+        Поиск ?search= через индекс в памяти: ранжирование, опечатки, кириллица и латиница
+    """
+
+    def setUp(self):
+        book_search_index.reset()
+        self.user = User.objects.create(
+            email="user@example.com",
+            password="password"
+        )
+        self.client.force_authenticate(user=self.user)
+
+        pushkin = Author.objects.create(name="Пушкин А.С.", birth_date="1799-06-06")
+        tolstoy = Author.objects.create(name="Leo Tolstoy", birth_date="1828-09-09")
+        Book.objects.create(title="Евгений Онегин", genre="Роман", author=pushkin, user=self.user)
+        Book.objects.create(title="Капитанская дочка", genre="Роман", author=pushkin, user=self.user)
+        Book.objects.create(title="War and Peace", genre="Novel", author=tolstoy, user=self.user)
+        Book.objects.create(title="Anna Karenina", genre="Novel", author=tolstoy, user=self.user)
+
+    def search(self, query):
+        response = self.client.get("/api/books/", {"search": query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [book['title'] for book in response.data['results']]
+
+    @override_settings(QUERY_BUDGET_MODE='raise', BOOK_SEARCH_INDEX_TTL=0)
+    def test_cold_index_within_budget(self):
+        """Построение индекса в запросе (первый поиск и истекший BOOK_SEARCH_INDEX_TTL) укладывается в бюджет"""
+        self.client.force_authenticate(user=None)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        for _ in range(2):
+            self.assertEqual(self.search("онегин"), ["Евгений Онегин"])
+
+    def test_typo_tolerance(self):
+        self.assertEqual(self.search("онегн"), ["Евгений Онегин"])
+        self.assertEqual(self.search("karenna"), ["Anna Karenina"])
+
+    def test_prefix(self):
+        self.assertEqual(self.search("капит"), ["Капитанская дочка"])
+
+    def test_title_ranked_above_author(self):
+        titles = self.search("Пушкин дочка")
+        self.assertEqual(titles[0], "Капитанская дочка")
+        self.assertEqual(set(titles), {"Капитанская дочка", "Евгений Онегин"})
+
+    def test_explicit_ordering_and_filters(self):
+        self.assertEqual(self.search("tolstoy"), ["Anna Karenina", "War and Peace"])
+        response = self.client.get("/api/books/", {"search": "tolstoy", "ordering": "-title"})
+        self.assertEqual([book['title'] for book in response.data['results']], ["War and Peace", "Anna Karenina"])
+
+    def test_no_match(self):
+        self.assertEqual(self.search("zzzz"), [])
+
+
+class KeysetPaginationTestCase(APITestCase):
+    """
+        Курсорная пагинация: обход всех страниц вперед и назад при разных сортировках,
+        в т.ч. с одинаковыми значениями и NULL в поле сортировки
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email="user@example.com",
+            password="password"
+        )
+        self.client.force_authenticate(user=self.user)
+
+        authors = [Author.objects.create(name=name) for name in ("Чехов А.П.", "Пушкин А.С.", "Гоголь Н.В.")]
+        dates = ["1833-01-01", None, "1836-01-01", "1833-01-01", None, "1842-01-01", "1833-01-01"]
+        for i, published_date in enumerate(dates):
+            Book.objects.create(title=f"Книга {i % 4}", genre="Роман", author=authors[i % 3],
+                                published_date=published_date, user=self.user)
+
+    def walk(self, url, params):
+        pages = []
+        response = self.client.get(url, {**params, "page_size": 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([item['id'] for item in response.data['results']])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        # Обратный обход по ссылкам previous возвращает те же страницы
+        back = [pages[-1]]
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            back.append([item['id'] for item in response.data['results']])
+        self.assertEqual([row for page in reversed(back) for row in page], [row for page in pages for row in page])
+        return [row for page in pages for row in page]
+
+    def expected(self, *ordering):
+        # id добавляется в конец сортировки в направлении первого поля
+        books = sorted(Book.objects.select_related('author'), key=lambda book: book.id,
+                       reverse=ordering[0].startswith('-'))
+        for field in reversed(ordering):
+            descending = field.startswith('-')
+            path = field.lstrip('-')
+
+            def key(book, path=path):
+                value = book
+                for attr in path.split('__'):
+                    value = getattr(value, attr)
+                # NULL всегда в конце
+                return (value is None) != descending, value or ''
+
+            books.sort(key=key, reverse=descending)
+        return [book.id for book in books]
+
+    def test_orderings(self):
+        for ordering in ("title", "-title", "published_date", "-published_date", "author__name"):
+            with self.subTest(ordering=ordering):
+                self.assertEqual(self.walk("/api/books/", {"ordering": ordering}), self.expected(ordering))
+
+    def test_default_ordering(self):
+        self.assertEqual(self.walk("/api/books/", {}), self.expected("title"))
+        self.assertEqual(self.walk("/api/authors/", {}), list(
+            Author.objects.order_by('-name', '-id').values_list('id', flat=True)
+        ))
+
+    def test_search_rank_ordering(self):
+        book_search_index.reset()
+        self.assertEqual(sorted(self.walk("/api/books/", {"search": "роман книга"})), self.expected("id"))
+
+    def test_page_size_cap(self):
+        response = self.client.get("/api/books/", {"page_size": 10000})
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertEqual(KeysetPagination.max_page_size, 100)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/books/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Курсор, выданный для другой сортировки, не принимается
+        cursor = self.client.get("/api/books/", {"page_size": 2}).data['next'].split("cursor=")[1]
+        response = self.client.get("/api/books/", {"cursor": cursor, "ordering": "published_date"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class QueryBudgetTestCase(QueryBudgetTestMixin, APITestCase):
+    """
+        Число SQL запросов списков и карточек не зависит от количества записей (нет N+1)
+        Аутентификация по JWT, чтобы учитывать и запрос пользователя
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email="user@example.com",
+            password="password"
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+        for i in range(10):
+            author = Author.objects.create(name=f"Автор {i}")
+            reader = User.objects.create(email=f"reader{i}@example.com")
+            book = Book.objects.create(title=f"Книга {i}", genre="Роман", author=author, user=reader)
+            BookIssue.objects.create(book=book, user=reader, rating=5, is_returned=True)
+            BookIssue.objects.create(book=book, user=self.user)
+        self.book = book
+        self.issue = BookIssue.objects.filter(book=book).first()
+
+    def test_books(self):
+        response = self.assertQueryBudget("GET", "/api/books/")
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertQueryBudget("GET", "/api/books/", {"ordering": "author__name", "is_returned": "false"})
+        self.assertQueryBudget("GET", f"/api/books/{self.book.id}/")
+
+    def test_book_issues(self):
+        response = self.assertQueryBudget("GET", "/api/book-issues/")
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertQueryBudget("GET", f"/api/book-issues/{self.issue.id}/")
+
+    def test_authors(self):
+        self.assertQueryBudget("GET", "/api/authors/")
+        self.assertQueryBudget("GET", f"/api/authors/{self.book.author_id}/")
+
+
+class BookBulkIngestTestCase(APITestCase):
+    """
+        Массовая загрузка книг: дедупликация авторов, ошибки по строкам, NDJSON и CSV
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email="user@example.com",
+            password="password"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.pushkin = {"name": "Пушкин А.С.", "birth_date": "1799-06-06", "biography": "Русский поэт."}
+        Author.objects.create(**self.pushkin)
+
+    def test_ndjson(self):
+        rows = [
+            {"title": "Евгений Онегин", "genre": "Роман", "author": self.pushkin},
+            {"title": "Капитанская дочка", "genre": "Роман", "author": self.pushkin},
+            {"title": "Мертвые души", "genre": "Поэма", "published_date": "1842-01-01",
+             "author": {"name": "Гоголь Н.В."}},
+            {"title": "Нос", "genre": "Повесть", "author": {"name": "Гоголь Н.В."}},
+            {"title": "Без жанра", "author": {"name": "Гоголь Н.В."}},
+        ]
+        body = "\n".join(json.dumps(row, ensure_ascii=False) for row in rows) + "\nне json\n"
+
+        response = self.client.post("/api/books/bulk-ingest/?chunk_size=2", body.encode(),
+                                    content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rows'], 6)
+        self.assertEqual(response.data['books_created'], 4)
+        self.assertEqual(response.data['authors_created'], 1)
+        self.assertEqual([error['row'] for error in response.data['errors']], [5, 6])
+        self.assertIn('genre', response.data['errors'][0]['errors'])
+
+        self.assertEqual(Author.objects.count(), 2)
+        self.assertEqual(Book.objects.filter(author__name="Гоголь Н.В.", user=self.user).count(), 2)
+
+    def test_csv_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", encoding="utf-8", delete=False) as file:
+            file.write("title,genre,published_date,author_name,author_birth_date,author_biography\n")
+            file.write("Евгений Онегин,Роман,1833-01-01,Пушкин А.С.,1799-06-06,Русский поэт.\n")
+            file.write("Дубровский,Роман,не дата,Пушкин А.С.,1799-06-06,Русский поэт.\n")
+        self.addCleanup(os.remove, file.name)
+
+        stdout, stderr = StringIO(), StringIO()
+        call_command('ingest_books', file.name, user_email=self.user.email, stdout=stdout, stderr=stderr)
+        self.assertIn("книг создано: 1", stdout.getvalue())
+        self.assertIn("Строка 3", stderr.getvalue())
+        self.assertEqual(Author.objects.count(), 1)
+        self.assertEqual(Book.objects.get().published_date.year, 1833)
+
+
+class BookIssueExportTestCase(APITestCase):
+    """
+        Потоковая выгрузка истории выдач с фильтрами
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email="user@example.com",
+            password="password"
+        )
+        self.reader = User.objects.create(email="reader@example.com")
+        self.client.force_authenticate(user=self.user)
+
+        author = Author.objects.create(name="Пушкин А.С.")
+        self.book = Book.objects.create(title="Евгений Онегин", genre="Роман", author=author, user=self.user)
+        self.issues = [
+            BookIssue.objects.create(book=self.book, user=user, is_returned=True, rating=5)
+            for user in (self.user, self.reader, self.reader)
+        ]
+        # issue_date заполняется автоматически, задаем период выдач напрямую
+        for issue, issue_date in zip(self.issues, ("2024-01-10", "2024-02-10", "2024-03-10")):
+            BookIssue.objects.filter(pk=issue.pk).update(issue_date=issue_date)
+
+    def export(self, **params):
+        response = self.client.get("/api/book-issues/export/", params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        rows = list(csv.reader(StringIO(self.export())))
+        self.assertEqual(rows[0], list(EXPORT_FIELDS))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][2:5], ["Евгений Онегин", str(self.user.id), "user@example.com"])
+
+    def test_ndjson_with_filters(self):
+        lines = self.export(file_format="ndjson", date_from="2024-02-01", user=self.reader.id).splitlines()
+        self.assertEqual([json.loads(line)['issue_date'] for line in lines], ["2024-02-10", "2024-03-10"])
+        self.assertEqual(json.loads(lines[0])['user_email'], "reader@example.com")
+
+        lines = self.export(file_format="ndjson", date_to="2024-01-31").splitlines()
+        self.assertEqual(len(lines), 1)
+
+    def test_invalid_params(self):
+        response = self.client.get("/api/book-issues/export/", {"date_from": "вчера"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/api/book-issues/export/", {"file_format": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_command(self):
+        stdout = StringIO()
+        with mock.patch('sys.stdout', stdout):
+            call_command('export_book_issues', format='ndjson', user=str(self.reader.id))
+        self.assertEqual(len(stdout.getvalue().splitlines()), 2)
+
+
+class ConcurrentReturnTestCase(TransactionTestCase):
+    """
+        Параллельные возвраты книг одним пользователем, в т.ч. повторный возврат одной и той же выдачи:
+        счетчики пользователя и книг должны совпасть с последовательной обработкой
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com", password="password")
+        author = Author.objects.create(name="Пушкин А.С.")
+        self.books = [
+            Book.objects.create(title=f"Книга {i}", genre="Роман", author=author, user=self.user) for i in range(8)
+        ]
+        self.issues = [BookIssue.objects.create(book=book, user=self.user) for book in self.books]
+        BookIssue.objects.update(issue_date=datetime.date(2024, 12, 1))
+
+    def return_issue(self, issue_id, barrier):
+        try:
+            issue = BookIssue.objects.get(pk=issue_id)
+            barrier.wait()
+            return return_book_issue(issue, datetime.date(2024, 12, 4))
+        finally:
+            connection.close()
+
+    def test_parallel_returns(self):
+        # Каждая выдача возвращается дважды из разных потоков
+        issue_ids = [issue.id for issue in self.issues] * 2
+        barrier = threading.Barrier(len(issue_ids))
+        with ThreadPoolExecutor(max_workers=len(issue_ids)) as executor:
+            results = list(executor.map(lambda issue_id: self.return_issue(issue_id, barrier), issue_ids))
+
+        self.assertEqual(results.count(True), len(self.issues))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_books_taken, 8)
+        self.assertEqual(self.user.total_days_held_books, 8 * 3)
+        self.assertEqual(sum(Book.objects.values_list('open_issues_count', flat=True)), 0)
+
+
+class ResponseCacheTestCase(APITestCase):
+    """
+        Кеш ответов книг и авторов: повторный запрос без обращения к базе, сброс сигналами, ETag
+    """
+
+    def setUp(self):
+        caches['api'].clear()
+        self.user = User.objects.create(
+            email="user@example.com",
+            password="password"
+        )
+        self.client.force_authenticate(user=self.user)
+
+        self.author = Author.objects.create(name="Пушкин А.С.")
+        self.book = Book.objects.create(title="Евгений Онегин", genre="Роман", author=self.author, user=self.user)
+        self.other_book = Book.objects.create(title="Мертвые души", genre="Поэма",
+                                              author=Author.objects.create(name="Гоголь Н.В."), user=self.user)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'internal.example.com'])
+    def test_pagination_links_follow_host(self):
+        """Абсолютные ссылки пагинации из кеша указывают на хост и схему текущего запроса"""
+        self.assertTrue(self.client.get("/api/books/", {"page_size": 1}).data['next'].startswith(
+            "http://testserver/"))
+        response = self.client.get("/api/books/", {"page_size": 1}, HTTP_HOST="internal.example.com", secure=True)
+        self.assertTrue(response.data['next'].startswith("https://internal.example.com/"))
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/books/", {"page_size": 1})
+        self.assertTrue(response.data['next'].startswith("http://testserver/"))
+
+    def test_list_cached_and_invalidated(self):
+        self.client.get("/api/books/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/books/")
+        self.assertEqual(len(response.data['results']), 2)
+
+        # Другие параметры запроса - другой ключ кеша
+        response = self.client.get("/api/books/", {"ordering": "-title"})
+        self.assertEqual(response.data['results'][0]['title'], "Мертвые души")
+
+        self.author.name = "Пушкин Александр Сергеевич"
+        self.author.save()
+        response = self.client.get("/api/books/", {"ordering": "title"})
+        self.assertEqual(response.data['results'][0]['author']['name'], "Пушкин Александр Сергеевич")
+
+    def test_detail_invalidated_by_issue(self):
+        self.client.get(f"/api/books/{self.book.id}/")
+        BookIssue.objects.create(book=self.book, user=self.user, rating=4, is_returned=True)
+        response = self.client.get(f"/api/books/{self.book.id}/")
+        self.assertEqual(response.data['average_rating'], 4)
+
+    def test_etag(self):
+        response = self.client.get(f"/api/books/{self.book.id}/")
+        etag = response['ETag']
+        other_etag = self.client.get(f"/api/books/{self.other_book.id}/")['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/api/books/{self.book.id}/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Изменение книги меняет ее ETag, но не ETag других книг
+        self.client.patch(f"/api/books/{self.book.id}/", {"genre": "Роман в стихах"}, format='json')
+        response = self.client.get(f"/api/books/{self.book.id}/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['genre'], "Роман в стихах")
+        response = self.client.get(f"/api/books/{self.other_book.id}/", HTTP_IF_NONE_MATCH=other_etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_authors(self):
+        self.client.get("/api/authors/")
+        self.client.post("/api/authors/", {"name": "Чехов А.П."})
+        response = self.client.get("/api/authors/")
+        self.assertEqual(len(response.data['results']), 3)
+
+
+class ReadingStatsTestCase(QueryBudgetTestMixin, APITestCase):
+    """
+        Статистика чтения обновляется инкрементально при выдаче, возврате, оценке и удалении выдач
+        и совпадает с полным пересчетом
+    """
+
+    def setUp(self):
+        role_cache.clear()
+        self.user = User.objects.create(email="reader@example.com", password="password")
+        self.moderator = User.objects.create(email="moderator@example.com", password="password")
+        self.moderator.groups.add(Group.objects.create(name="Moderators"))
+        self.pushkin = Author.objects.create(name="Пушкин А.С.")
+        self.tolstoy = Author.objects.create(name="Толстой Л.Н.")
+        self.onegin = Book.objects.create(title="Евгений Онегин", genre="Роман", author=self.pushkin, user=self.user)
+        self.war = Book.objects.create(title="Война и мир", genre="Роман", author=self.tolstoy, user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def snapshot(self):
+        return {
+            (row.dimension, row.key): (row.issues_count, row.open_issues_count, row.returned_count,
+                                       row.days_held_total, row.rating_sum, row.rating_count)
+            for row in ReadingStats.objects.all()
+        }
+
+    def return_issue(self, issue, days, rating=None):
+        data = {'return_date': str(issue.issue_date + datetime.timedelta(days=days))}
+        if rating is not None:
+            data['rating'] = rating
+        response = self.client.patch(f'/book-issues/{issue.pk}/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_incremental_updates_match_rebuild(self):
+        first = BookIssue.objects.create(book=self.onegin, user=self.user)
+        second = BookIssue.objects.create(book=self.war, user=self.user)
+        tales = Book.objects.create(title="Сказки", genre="Роман", author=self.pushkin, user=self.user)
+        third = BookIssue.objects.create(book=tales, user=self.moderator)
+
+        genre = ReadingStats.objects.get(dimension=ReadingStats.GENRE, key="Роман")
+        self.assertEqual((genre.issues_count, genre.open_issues_count), (3, 3))
+
+        self.return_issue(first, days=4, rating=5)
+        self.return_issue(second, days=10)
+        response = self.client.patch(f'/book-issues/{second.pk}/', {'rating': 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        third.delete()
+
+        pushkin = ReadingStats.objects.get(dimension=ReadingStats.AUTHOR, key=str(self.pushkin.pk))
+        self.assertEqual((pushkin.issues_count, pushkin.open_issues_count, pushkin.returned_count), (1, 0, 1))
+        reader = ReadingStats.objects.get(dimension=ReadingStats.USER, key=str(self.user.pk))
+        self.assertEqual(reader.average_days_held, 7)
+        self.assertEqual(reader.average_rating, 4)
+
+        incremental = self.snapshot()
+        rebuild_reading_stats()
+        self.assertEqual(self.snapshot(), {key: value for key, value in incremental.items() if any(value)})
+
+    def test_missing_stats_row_is_logged(self):
+        """Вычитание из отсутствующей строки не принимается за параллельную вставку: ошибка в журнале"""
+        issue = BookIssue.objects.create(book=self.war, user=self.user)
+        ReadingStats.objects.filter(dimension=ReadingStats.USER).delete()
+        with self.assertLogs('library.stats', 'ERROR') as logs:
+            issue.delete()
+        self.assertIn(f"user={self.user.pk}", logs.output[0])
+        self.assertFalse(ReadingStats.objects.filter(dimension=ReadingStats.USER).exists())
+        author = ReadingStats.objects.get(dimension=ReadingStats.AUTHOR, key=str(self.tolstoy.pk))
+        self.assertEqual((author.issues_count, author.open_issues_count), (0, 0))
+
+    def test_cascade_delete_is_batched(self):
+        """Выдачи, удаляемые вместе с книгой или автором, учитываются одним набором запросов"""
+        tales = Book.objects.create(title="Сказки", genre="Роман", author=self.pushkin, user=self.user)
+        queries = {}
+        for book, total in ((self.onegin, 3), (tales, 30)):
+            for _ in range(total):
+                BookIssue.objects.create(book=book, user=self.moderator, is_returned=True,
+                                         return_date=datetime.date.today(), rating=4)
+            BookIssue.objects.create(book=book, user=self.user)
+        self.assertEqual(ReadingStats.objects.get(dimension=ReadingStats.USER, key=str(self.user.pk)).issues_count, 2)
+
+        for book in (self.onegin, tales):
+            with CaptureQueriesContext(connection) as captured:
+                book.delete()
+            queries[book.title] = len(captured)
+        self.assertEqual(queries["Евгений Онегин"], queries["Сказки"])
+        incremental = self.snapshot()
+        rebuild_reading_stats()
+        self.assertEqual(self.snapshot(), {key: value for key, value in incremental.items() if any(value)})
+
+        # Удаление автора: выдачи всех его книг одним сигналом issues_changed
+        for _ in range(10):
+            BookIssue.objects.create(book=self.war, user=self.moderator, is_returned=True,
+                                     return_date=datetime.date.today())
+        with mock.patch('library.signals.update_reading_stats_many') as update:
+            self.tolstoy.delete()
+        update.assert_called_once()
+        self.assertEqual(len(update.call_args.args[0]), 10)
+
+    def test_stats_endpoint(self):
+        issue = BookIssue.objects.create(book=self.war, user=self.user)
+        self.return_issue(issue, days=3, rating=4)
+
+        response = self.client.get('/stats/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.moderator)
+        # Группы модератора еще не в кеше ролей
+        response = self.assertQueryBudget('GET', '/stats/', {'dimension': 'author', 'key': self.tolstoy.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [{
+            'dimension': 'author',
+            'key': str(self.tolstoy.pk),
+            'issues_count': 1,
+            'open_issues_count': 0,
+            'returned_count': 1,
+            'average_days_held': 3,
+            'average_rating': 4,
+        }])
+
+
+class SparseFieldsetsTestCase(APITestCase):
+    """
+        Выборочные поля ?fields= и ?omit=: в ответе только запрошенные поля,
+        в SQL нет рейтинга, текстовых колонок и join-ов для полей вне ответа
+    """
+
+    def setUp(self):
+        caches['api'].clear()
+        self.user = User.objects.create(email="reader@example.com", password="password")
+        author = Author.objects.create(name="Пушкин А.С.", biography="Русский поэт.")
+        self.book = Book.objects.create(title="Евгений Онегин", genre="Роман", author=author, user=self.user,
+                                        description="Роман в стихах")
+        BookIssue.objects.create(book=self.book, user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def get_with_queries(self, path, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, " ".join(query['sql'] for query in queries.captured_queries)
+
+    def test_book_fields(self):
+        response, sql = self.get_with_queries('/books/', {'fields': 'id,title,author.name'})
+        self.assertEqual(response.data['results'], [
+            {'id': self.book.pk, 'title': "Евгений Онегин", 'author': {'name': "Пушкин А.С."}},
+        ])
+        for column in ('AVG', '"description"', '"biography"', '"users_user"'):
+            self.assertNotIn(column, sql)
+
+    def test_book_omit(self):
+        response, sql = self.get_with_queries('/books/', {'omit': 'average_rating,description,author'})
+        self.assertNotIn('average_rating', response.data['results'][0])
+        self.assertNotIn('author', response.data['results'][0])
+        self.assertEqual(response.data['results'][0]['user'], "reader@example.com")
+        self.assertNotIn('"library_author"', sql)
+
+        # Сортировка по автору без автора в ответе: автор загружается тем же запросом для курсора
+        response, sql = self.get_with_queries('/books/', {'fields': 'id', 'ordering': 'author__name'})
+        self.assertEqual(response.data['results'], [{'id': self.book.pk}])
+
+    def test_author_and_issue_fields(self):
+        response, sql = self.get_with_queries('/authors/', {'omit': 'biography'})
+        self.assertNotIn('biography', response.data['results'][0])
+        self.assertNotIn('"biography"', sql)
+
+        response, sql = self.get_with_queries('/book-issues/', {'fields': 'id,book_title'})
+        self.assertEqual(response.data['results'], [{'id': self.book.issues.get().pk, 'book_title': "Евгений Онегин"}])
+        self.assertNotIn('"users_user"."email"', sql)
+
+    def test_write_ignores_fieldsets(self):
+        response = self.client.patch(f'/books/{self.book.pk}/?fields=id', {'title': "Онегин"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], "Онегин")
+
+
+class FastListTestCase(APITestCase):
+    """
+        Списки книг и выдач из .values() (API_FAST_LISTS) совпадают с ответом сериализаторов байт в байт,
+        рендерер и парсер на orjson совпадают со стандартными
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email="reader@example.com", password="password")
+        pushkin = Author.objects.create(name="Пушкин А.С.", birth_date="1799-06-06", biography="Русский поэт.")
+        tolstoy = Author.objects.create(name="Толстой Л.Н.")
+        for i in range(5):
+            book = Book.objects.create(title=f"Евгений Онегин {i}", genre="Роман", author=pushkin, user=self.user,
+                                       published_date=datetime.date(1833, 1, i + 1) if i % 2 else None)
+            Book.objects.create(title=f"Война и мир {i}", genre="Роман-эпопея", author=tolstoy, user=self.user,
+                                description="Описание\u2028с разделителем")
+            issue = BookIssue.objects.create(book=book, user=self.user)
+            if i % 2:
+                return_book_issue(issue, datetime.date.today())
+                BookIssue.objects.filter(pk=issue.pk).update(rating=i)
+        self.client.force_authenticate(user=self.user)
+
+    def get_content(self, path, params, fast):
+        caches['api'].clear()
+        with override_settings(API_FAST_LISTS=fast):
+            response = self.client.get(path, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content
+
+    def test_same_output(self):
+        cases = [
+            ('/books/', {}),
+            ('/books/', {'page_size': 3, 'ordering': '-published_date'}),
+            ('/books/', {'ordering': 'author__name', 'fields': 'id,title'}),
+            ('/books/', {'search': 'онегн', 'omit': 'description,author.biography'}),
+            ('/books/', {'is_returned': 'false'}),
+            ('/book-issues/', {}),
+            ('/book-issues/', {'fields': 'id,book_title,user_email'}),
+        ]
+        for path, params in cases:
+            with self.subTest(path=path, params=params):
+                fast, serializer = self.get_content(path, params, fast=True), self.get_content(path, params, fast=False)
+                self.assertEqual(fast, serializer)
+
+        # Следующая страница по курсору быстрого пути
+        first = json.loads(self.get_content('/books/', {'page_size': 4}, fast=True))
+        params = dict(parse_qsl(urlsplit(first['next']).query))
+        self.assertEqual(self.get_content('/books/', params, True), self.get_content('/books/', params, False))
+
+    def test_renderer_and_parser(self):
+        data = {
+            'text': "Пушкин \u2028 \"цитата\"",
+            'date': datetime.date(1833, 1, 1),
+            'datetime': datetime.datetime(2024, 12, 1, 10, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'numbers': [1, 2.5, None, True],
+            1: 'числовой ключ',
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        body = JSONRenderer().render({'title': "Онегин", 'rating': 5})
+        with override_settings(API_JSON_BACKEND='orjson'):
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+            self.assertEqual(FastJSONParser().parse(BytesIO(body)), {'title': "Онегин", 'rating': 5})
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SeedAndBenchmarkTestCase(APITestCase):
+    """
+        Генератор данных создает согласованную историю выдач,
+        нагрузочный прогон покрывает все маршруты API и не меняет данные
+    """
+
+    def setUp(self):
+        role_cache.clear()
+        LibrarySeeder(users=10, authors=5, books=30, issues=300, open_ratio=0.2, batch_size=50, seed=1).seed()
+
+    def test_seeded_data(self):
+        self.assertEqual(Book.objects.count(), 30)
+        self.assertEqual(BookIssue.objects.count(), 300)
+        open_issues = BookIssue.objects.filter(is_returned=False)
+        self.assertEqual(open_issues.count(), len(set(open_issues.values_list('book_id', flat=True))))
+        self.assertEqual(sum(Book.objects.values_list('open_issues_count', flat=True)), open_issues.count())
+        self.assertGreater(len(set(BookIssue.objects.values_list('issue_date', flat=True))), 1)
+        reader = User.objects.exclude(total_books_taken=0).first()
+        self.assertEqual(reader.total_books_taken, reader.issues.filter(is_returned=True).count())
+
+    def test_reseed_keeps_counters(self):
+        """Повторный запуск прибавляет к счетчикам модератора, модель BookIssue не меняется"""
+        LibrarySeeder(users=2, authors=2, books=5, issues=100, batch_size=50, seed=2).seed()
+        moderator = User.objects.get(email=MODERATOR_EMAIL)
+        self.assertEqual(moderator.total_books_taken, moderator.issues.filter(is_returned=True).count())
+        self.assertTrue(BookIssue._meta.get_field('issue_date').auto_now_add)
+        issue = BookIssue.objects.create(book=Book.objects.available().first(), user=moderator,
+                                         issue_date=datetime.date(2000, 1, 1))
+        self.assertEqual(issue.issue_date, datetime.date.today())
+
+    def test_benchmark_covers_all_routes(self):
+        self.assertEqual(uncovered_routes(), [])
+        issues_count = BookIssue.objects.count()
+        report = EndpointBenchmark(User.objects.get(email=MODERATOR_EMAIL), requests=2, warmup=0,
+                                   memory_requests=1).run()
+        for result in report['results']:
+            with self.subTest(result['name']):
+                self.assertLess(result['status'], 400)
+                self.assertGreater(result['queries_per_request'], 0)
+        self.assertEqual(BookIssue.objects.count(), issues_count)
+
+
+@override_settings(INSTRUMENTATION_ENABLED=True, INSTRUMENTATION_SAMPLE_RATE=1.0, METRICS_TOKEN='')
+class InstrumentationTestCase(APITestCase):
+    """
+        Заголовок Server-Timing, журнал медленных запросов и метрики Prometheus по маршрутам
+    """
+
+    def setUp(self):
+        role_cache.clear()
+        registry.reset()
+        self.user = User.objects.create(email='reader@example.com', password='password')
+        author = Author.objects.create(name="Пушкин")
+        for number in range(3):
+            Book.objects.create(title=f"Книга {number}", author=author, user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    @staticmethod
+    def parse_server_timing(header):
+        metrics = {}
+        for entry in header.split(','):
+            name, *params = [part.strip() for part in entry.split(';')]
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/authors/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        timing = self.parse_server_timing(response['Server-Timing'])
+        self.assertEqual(set(timing), {'db', 'serializer', 'app', 'total'})
+        self.assertEqual(timing['db']['desc'], f'"{len(queries)} SQL"')
+        self.assertGreater(float(timing['serializer']['dur']), 0)
+        self.assertGreaterEqual(
+            float(timing['total']['dur']) + 0.2,
+            sum(float(timing[name]['dur']) for name in ('db', 'serializer', 'app')),
+        )
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0.0)
+    def test_unsampled_request(self):
+        """Запрос вне выборки попадает в гистограмму, но без Server-Timing и счетчиков SQL"""
+        response = self.client.get('/books/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/books/",status="200"} 1',
+                      registry.render())
+        self.assertNotIn('http_sampled_requests_total{', registry.render())
+
+    def test_slow_request_log(self):
+        with override_settings(SLOW_REQUEST_THRESHOLD_MS=0, INSTRUMENTATION_TOP_QUERIES=1), \
+                self.assertLogs('library.instrumentation', 'WARNING') as logs:
+            response = self.client.post('/authors/', {'name': "Гоголь"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("POST /authors/", logs.output[0])
+        self.assertEqual(len(logs.records[0].queries), 1)
+        self.assertRegex(logs.output[0], r'\n  [\d.]+ мс: (SELECT|INSERT|SAVEPOINT|RELEASE)')
+
+        with override_settings(SLOW_REQUEST_THRESHOLD_MS=60000), self.assertNoLogs('library.instrumentation'):
+            self.client.get('/books/')
+
+    def test_metrics_endpoint(self):
+        self.client.get('/books/')
+        self.client.get('/books/')
+        self.client.get(f'/books/{Book.objects.first().pk}/')
+
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        labels = 'method="GET",route="/books/",status="200"'
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2', body)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertIn('route="/books/<pk>/"', body)
+        self.assertIn(f'http_sampled_requests_total{{{labels}}} 2', body)
+        self.assertRegex(body, rf'http_sampled_db_queries_total\{{{labels}\}} [1-9]')
+
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics/').status_code, status.HTTP_403_FORBIDDEN)
+            response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class QueryPlanTestCase(APITestCase):
+    """
+        Основные запросы API на заполненной базе читают таблицы по индексам из 0006_query_indexes,
+        без полного прохода и отдельной сортировки
+    """
+
+    def setUp(self):
+        role_cache.clear()
+        LibrarySeeder(users=20, authors=10, books=200, issues=2000, open_ratio=0.1, batch_size=500, seed=1).seed()
+        self.checker = QueryPlanChecker(User.objects.get(email=MODERATOR_EMAIL), prefer_indexes=True)
+
+    def test_plans_use_indexes(self):
+        for result in self.checker.run():
+            with self.subTest(result['name']):
+                self.assertEqual(result['problems'], [], result['plan'])
+
+    def test_full_scan_detected(self):
+        """Запрос без подходящего индекса не проходит проверку"""
+        result = self.checker.check(PlanCheck(
+            'books by genre', 'library_book', 'book_title_id_idx',
+            queryset=lambda: Book.objects.filter(description__icontains="роман").order_by('genre'),
+        ))
+        self.assertIn("не используется индекс book_title_id_idx", result['problems'])
+        self.assertIn("сортировка без индекса", result['problems'])
+
+    def test_average_rating(self):
+        """Средний рейтинг из подзапроса совпадает с расчетом по выдачам книги"""
+        for book in Book.objects.with_average_rating()[:20]:
+            expected = book.issues.filter(is_returned=True).aggregate(average=Avg('rating'))['average']
+            self.assertEqual(book.average_rating_value, expected)
+
+
+class AsyncReadTestCase(QueryBudgetTestMixin, APITestCase):
+    """
+        Async чтение /async/... отдает те же ответы, что и синхронные представления,
+        с теми же правами, фильтрами и бюджетом запросов
+    """
+
+    def setUp(self):
+        role_cache.clear()
+        caches['api'].clear()
+        self.user = User.objects.create(email="reader@example.com", password="password")
+        self.author = Author.objects.create(name="Пушкин", biography="Поэт")
+        self.books = [
+            Book.objects.create(title=f"Книга {number}", genre="Роман", author=self.author, user=self.user)
+            for number in range(5)
+        ]
+        issue = BookIssue.objects.create(book=self.books[0], user=self.user)
+        return_book_issue(issue, datetime.date.today())
+        issue.rating = 4
+        issue.save()
+        BookIssue.objects.create(book=self.books[1], user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def assertSameResponse(self, path):
+        caches['api'].clear()
+        expected = self.client.get(path)
+        caches['api'].clear()
+        response = self.client.get(f"/async{path}")
+        self.assertEqual(response.status_code, expected.status_code, path)
+        self.assertEqual(response.content.replace(b'/async/', b'/'), expected.content, path)
+        return response
+
+    def test_same_responses(self):
+        book = self.books[0]
+        issue = BookIssue.objects.first()
+        paths = [
+            '/books/', '/books/?page_size=2', '/books/?ordering=-published_date&genre=роман',
+            '/books/?is_returned=false', '/books/?search=книга', '/books/?fields=id,title,average_rating',
+            f'/books/{book.pk}/', f'/books/{book.pk}/?omit=description', '/books/100500/',
+            '/authors/', f'/authors/{self.author.pk}/', '/authors/?fields=id,name',
+            '/book-issues/', f'/book-issues/{issue.pk}/', '/book-issues/?omit=user_email',
+        ]
+        for path in paths:
+            with self.subTest(path):
+                self.assertSameResponse(path)
+        with override_settings(API_FAST_LISTS=False):
+            for path in ('/books/', '/book-issues/'):
+                with self.subTest(path, fast_lists=False):
+                    self.assertSameResponse(path)
+
+    def test_cursor_pages(self):
+        response = self.assertSameResponse('/books/?page_size=2')
+        next_link = response.data['next']
+        path = next_link.split('testserver/async', 1)[1]
+        response = self.assertSameResponse(path)
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_cache_and_etag(self):
+        path = f'/async/books/{self.books[0].pk}/'
+        response = self.client.get(path)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/async/books/').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/async/books/').status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+
+    def test_permissions_and_methods(self):
+        self.assertEqual(self.client.post('/async/books/', {'title': "Книга"}).status_code,
+                         status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(self.client.delete(f'/async/books/{self.books[0].pk}/').status_code,
+                         status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.client.force_authenticate(user=None)
+        for path in ('/async/books/', '/async/authors/', '/async/book-issues/', f'/async/books/{self.books[0].pk}/'):
+            with self.subTest(path):
+                self.assertEqual(self.client.get(path).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_query_budget(self):
+        for path in ('/async/books/', f'/async/books/{self.books[0].pk}/', '/async/authors/', '/async/book-issues/'):
+            with self.subTest(path):
+                self.assertEqual(self.assertQueryBudget('GET', path).status_code, status.HTTP_200_OK)
+
+    @override_settings(INSTRUMENTATION_ENABLED=True, INSTRUMENTATION_SAMPLE_RATE=1.0)
+    async def test_asgi(self):
+        """Через ASGI обработчик: JWT аутентификация, ответ и Server-Timing с SQL запросами async ORM"""
+        token = AccessToken.for_user(self.user)
+        response = await self.async_client.get('/async/books/', headers={'Authorization': f"Bearer {token}"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)['results']), 5)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* SQL"')
+
+        response = await self.async_client.get('/async/books/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=10)
+class ReplicaRoutingTestCase(APITestCase):
+    """
+        Чтение с реплики для GET запросов и с основной базы для клиента, который недавно писал.
+        Реплика - отдельная база SQLite, данные копируются в нее явно, имитируя репликацию с отставанием
+    """
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        role_cache.clear()
+        caches['api'].clear()
+        caches['default'].clear()
+        self.reader = User.objects.create(email="reader@example.com", password="password")
+        self.other = User.objects.create(email="other@example.com", password="password")
+        self.author = Author.objects.create(name="Пушкин", biography="Поэт")
+        self.book = Book.objects.create(title="Евгений Онегин", genre="Роман", author=self.author, user=self.reader)
+        self.issue = BookIssue.objects.create(book=self.book, user=self.reader)
+        self.replicate()
+        # Клиент закрепляется по заголовку Authorization, поэтому токен каждого пользователя выпускается один раз
+        self.tokens = {user.pk: str(AccessToken.for_user(user)) for user in (self.reader, self.other)}
+
+    @staticmethod
+    def replicate():
+        """Копия основной базы в реплику на текущий момент"""
+        for model in (User, Author, Book, BookIssue):
+            model.objects.using('replica').all().delete()
+            model.objects.using('replica').bulk_create(model.objects.using('default').all())
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens[user.pk]}")
+
+    def test_reads_from_replica(self):
+        Book.objects.using('replica').filter(pk=self.book.pk).update(title="С реплики")
+        self.authenticate(self.reader)
+        response = self.client.get(f'/books/{self.book.pk}/')
+        self.assertEqual(response.data['title'], "С реплики")
+        self.assertEqual(self.client.get('/books/').data['results'][0]['title'], "С реплики")
+
+        with override_settings(DATABASE_REPLICAS=[]):
+            caches['api'].clear()
+            self.assertEqual(self.client.get(f'/books/{self.book.pk}/').data['title'], "Евгений Онегин")
+
+    def test_read_your_writes(self):
+        """Вернувший книгу клиент видит выдачу закрытой, другие клиенты читают с отстающей реплики"""
+        path = f'/book-issues/{self.issue.pk}/'
+        self.authenticate(self.reader)
+        response = self.client.patch(path, {'return_date': datetime.date.today().isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(BookIssue.objects.using('replica').get(pk=self.issue.pk).is_returned)
+
+        self.assertTrue(self.client.get(path).data['is_returned'])
+        self.assertEqual(self.client.get('/books/?is_returned=false').data['results'], [])
+
+        self.authenticate(self.other)
+        self.assertFalse(self.client.get(path).data['is_returned'])
+
+        # Закрепление истекло - клиент снова читает с реплики
+        caches['default'].clear()
+        self.authenticate(self.reader)
+        self.assertFalse(self.client.get(path).data['is_returned'])
+
+    def test_cached_responses_by_source(self):
+        """Закрепленный клиент не получает из кеша ответ, посчитанный по реплике"""
+        path = f'/books/{self.book.pk}/'
+        self.authenticate(self.other)
+        self.client.get(path)
+        self.authenticate(self.reader)
+        self.assertEqual(self.client.patch(path, {"title": "Онегин"}).status_code, status.HTTP_200_OK)
+        self.authenticate(self.other)
+        self.assertEqual(self.client.get(path).data['title'], "Евгений Онегин")
+        self.authenticate(self.reader)
+        self.assertEqual(self.client.get(path).data['title'], "Онегин")
+
+    def test_outside_requests(self):
+        """Команды и фоновые задачи читают с основной базы, пользователи - всегда с основной базы"""
+        Book.objects.using('replica').filter(pk=self.book.pk).update(title="С реплики")
+        self.assertEqual(Book.objects.get(pk=self.book.pk).title, "Евгений Онегин")
+
+        User.objects.using('replica').filter(pk=self.reader.pk).update(is_active=False)
+        self.authenticate(self.reader)
+        self.assertEqual(self.client.get('/books/').status_code, status.HTTP_200_OK)
+
+    async def test_async_views(self):
+        path = f'/async/book-issues/{self.issue.pk}/'
+        await BookIssue.objects.using('replica').filter(pk=self.issue.pk).aupdate(rating=5)
+        headers = {'Authorization': f"Bearer {self.tokens[self.reader.pk]}"}
+        response = await self.async_client.get(path, headers=headers)
+        self.assertEqual(json.loads(response.content)['rating'], 5)
+
+        response = await self.async_client.patch(
+            f'/book-issues/{self.issue.pk}/', {'rating': 3}, content_type='application/json', headers=headers,
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = await self.async_client.get(path, headers=headers)
+        self.assertEqual(json.loads(response.content)['rating'], 3)
+
+
+class BulkIssueTestCase(APITestCase):
+    """
+        Пакетная выдача и возврат книг: одна транзакция, результат по каждой позиции,
+        книга не выдается повторно, счетчики и статистика совпадают с одиночными операциями
+    """
+
+    def setUp(self):
+        caches['api'].clear()
+        self.librarian = User.objects.create(email="librarian@example.com", password="password")
+        self.readers = [User.objects.create(email=f"reader{number}@example.com", password="password")
+                        for number in range(3)]
+        self.author = Author.objects.create(name="Пушкин А.С.")
+        self.books = [Book.objects.create(title=f"Книга {number}", genre="Роман", author=self.author,
+                                          user=self.librarian) for number in range(6)]
+        self.client.force_authenticate(user=self.librarian)
+
+    def bulk_issue(self, pairs):
+        return self.client.post('/book-issues/bulk-issue/', {
+            'items': [{'book': book.pk if isinstance(book, Book) else book, 'user': user.pk} for book, user in pairs]
+        }, format='json')
+
+    def test_single_issue_of_issued_book(self):
+        BookIssue.objects.create(book=self.books[0], user=self.readers[0])
+        response = self.client.post('/book-issues/', {'book': self.books[0].pk, 'user': self.readers[1].pk})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['book'], ["Книга уже выдана и еще не возвращена."])
+
+        with mock.patch('library.serializers.BookIssue.objects.filter') as filter_mock:
+            # Книгу выдали параллельно между проверкой и записью - ограничение базы вместо ошибки 500
+            filter_mock.return_value.exists.return_value = False
+            response = self.client.post('/book-issues/', {'book': self.books[0].pk, 'user': self.readers[1].pk})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(BookIssue.objects.filter(book=self.books[0]).count(), 1)
+
+    def test_bulk_issue(self):
+        BookIssue.objects.create(book=self.books[0], user=self.readers[0])
+        response = self.bulk_issue([
+            (self.books[0], self.readers[1]),
+            (self.books[1], self.readers[1]),
+            (self.books[2], self.readers[2]),
+            (self.books[1], self.readers[2]),
+            (100500, self.readers[0]),
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['succeeded'], response.data['failed']), (2, 3))
+        results = response.data['results']
+        self.assertEqual(results[0], {'error': "Книга уже выдана и еще не возвращена."})
+        self.assertEqual((results[1]['issue']['book'], results[1]['issue']['user_email']),
+                         (self.books[1].pk, "reader1@example.com"))
+        self.assertEqual(results[2]['issue']['book_title'], "Книга 2")
+        self.assertEqual(results[3], {'error': "Книга уже выдана и еще не возвращена."})
+        self.assertEqual(results[4], {'error': "Книга не найдена."})
+
+        self.assertEqual(list(Book.objects.issued().order_by('pk')), self.books[:3])
+        genre = ReadingStats.objects.get(dimension=ReadingStats.GENRE, key="Роман")
+        self.assertEqual((genre.issues_count, genre.open_issues_count), (3, 3))
+
+    def test_bulk_issue_conflict(self):
+        """Книгу выдали между проверкой и записью: пакет повторяется по одной выдаче, остальные книги выдаются"""
+        BookIssue.objects.create(book=self.books[0], user=self.readers[0])
+        with mock.patch('library.services.BookIssue.objects.filter') as filter_mock:
+            filter_mock.return_value.values_list.return_value = []
+            response = self.bulk_issue([(self.books[0], self.readers[1]), (self.books[1], self.readers[1])])
+        self.assertEqual([list(result) for result in response.data['results']], [['error'], ['issue']])
+        self.assertEqual(Book.objects.get(pk=self.books[1].pk).open_issues_count, 1)
+        self.assertEqual(Book.objects.get(pk=self.books[0].pk).open_issues_count, 1)
+
+    def test_bulk_return(self):
+        issues = [BookIssue.objects.create(book=book, user=reader) for book, reader in zip(self.books, self.readers)]
+        BookIssue.objects.filter(pk__in=[issue.pk for issue in issues]).update(issue_date=datetime.date(2024, 1, 1))
+        response = self.client.post('/book-issues/bulk-return/', {'items': [
+            {'id': issues[0].pk, 'return_date': '2024-01-05', 'rating': 5},
+            {'id': issues[1].pk, 'return_date': '2024-01-11'},
+            {'id': issues[0].pk},
+            {'id': issues[2].pk, 'return_date': '2023-12-31'},
+            {'id': 100500},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual((results[0]['issue']['is_returned'], results[0]['issue']['rating']), (True, 5))
+        self.assertEqual(results[1]['issue']['return_date'], '2024-01-11')
+        self.assertEqual(results[2], {'error': "Книга по этой выдаче уже возвращена."})
+        self.assertEqual(results[3], {'error': "Дата возврата не может быть раньше даты выдачи."})
+        self.assertEqual(results[4], {'error': "Выдача не найдена."})
+
+        readers = {user.pk: user for user in User.objects.filter(pk__in=[reader.pk for reader in self.readers])}
+        self.assertEqual((readers[self.readers[0].pk].total_books_taken,
+                          readers[self.readers[0].pk].total_days_held_books), (1, 4))
+        self.assertEqual(readers[self.readers[1].pk].total_days_held_books, 10)
+        self.assertEqual(readers[self.readers[2].pk].total_books_taken, 0)
+        self.assertEqual(list(Book.objects.issued()), [self.books[2]])
+        author = ReadingStats.objects.get(dimension=ReadingStats.AUTHOR, key=str(self.author.pk))
+        self.assertEqual((author.open_issues_count, author.returned_count, author.average_rating), (1, 2, 5))
+
+        incremental = {(row.dimension, row.key): row.issues_count for row in ReadingStats.objects.all()}
+        rebuild_reading_stats()
+        self.assertEqual({(row.dimension, row.key): row.issues_count for row in ReadingStats.objects.all()},
+                         incremental)
+
+    def test_bulk_return_race(self):
+        """Выдачу вернули параллельно после чтения пакета: она не учитывается второй раз в счетчиках и статистике"""
+        issues = [BookIssue.objects.create(book=book, user=reader) for book, reader in zip(self.books, self.readers)]
+        stale = list(BookIssue.objects.filter(pk__in=[issue.pk for issue in issues]).order_by('pk'))
+        return_book_issue(issues[1], datetime.date.today())
+        with mock.patch('library.services.BookIssue.objects.select_for_update') as select_mock:
+            # Строки не заблокированы (SQLite): пакет видит выдачу открытой
+            select_mock.return_value.filter.return_value.order_by.return_value = stale
+            response = self.client.post('/book-issues/bulk-return/', {'items': [
+                {'id': issue.pk, 'return_date': datetime.date.today().isoformat()} for issue in issues
+            ]}, format='json')
+        self.assertEqual([list(result) for result in response.data['results']], [['issue'], ['error'], ['issue']])
+        self.assertEqual([User.objects.get(pk=reader.pk).total_books_taken for reader in self.readers], [1, 1, 1])
+        genre = ReadingStats.objects.get(dimension=ReadingStats.GENRE, key="Роман")
+        self.assertEqual((genre.open_issues_count, genre.returned_count), (0, 3))
+
+    def test_queries_do_not_grow_with_batch(self):
+        books = [Book.objects.create(title=f"Книга {number}", genre="Роман", author=self.author, user=self.librarian)
+                 for number in range(6, 40)]
+        # Строки статистики уже существуют, дальше для любого размера пакета - одинаковый набор запросов
+        self.bulk_issue([(self.books[0], self.readers[0])])
+        counts = []
+        for batch in (books[:4], books[4:34]):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.bulk_issue([(book, self.readers[0]) for book in batch])
+            self.assertEqual(response.data['succeeded'], len(batch))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_payload(self):
+        for payload in ({}, {'items': []}, {'items': [{'book': 'книга', 'user': self.readers[0].pk}]}):
+            with self.subTest(payload):
+                response = self.client.post('/book-issues/bulk-issue/', payload, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(BOOK_ISSUE_BULK_MAX_ITEMS=2):
+            response = self.bulk_issue([(book, self.readers[0]) for book in self.books[:3]])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OverdueScanMixin:
+    """Выдачи на 30.06.2024 при сроке 14 дней: две просрочены (на 16 и 1 день), две в срок, одна возвращена"""
+
+    today = datetime.date(2024, 6, 30)
+
+    def create_issues(self):
+        self.user = User.objects.create(email="reader@example.com", password="password")
+        author = Author.objects.create(name="Пушкин А.С.")
+        self.issues = {}
+        for days_held in (3, 30, 14, 15):
+            book = Book.objects.create(title=f"Книга {days_held}", genre="Роман", author=author, user=self.user)
+            issue = BookIssue.objects.create(book=book, user=self.user)
+            BookIssue.objects.filter(pk=issue.pk).update(issue_date=self.today - datetime.timedelta(days=days_held))
+            self.issues[days_held] = issue
+        returned = BookIssue.objects.create(book=book, user=self.user, is_returned=True)
+        BookIssue.objects.filter(pk=returned.pk).update(issue_date=self.today - datetime.timedelta(days=100))
+
+    def notices(self):
+        return {notice.issue_id: notice.days_overdue for notice in OverdueNotice.objects.all()}
+
+    def scanner(self, **kwargs):
+        return OverdueScanner(**{'chunk_size': 2, 'today': self.today, 'loan_days': 14, **kwargs})
+
+
+@override_settings(BOOK_ISSUE_LOAN_DAYS=14)
+class OverdueScanTestCase(OverdueScanMixin, APITestCase):
+    """Поиск просроченных выдач частями с контрольной точкой"""
+
+    def setUp(self):
+        self.create_issues()
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'overdue.json')
+
+    def test_scan(self):
+        report = self.scanner().run()
+        self.assertEqual(self.notices(), {self.issues[30].pk: 16, self.issues[15].pk: 1})
+        self.assertEqual((report['chunks'], report['rows'], report['overdue'], report['created']), (3, 4, 2, 2))
+        notice = OverdueNotice.objects.get(issue=self.issues[30])
+        self.assertEqual(notice.due_date, datetime.date(2024, 6, 14))
+
+        report = self.scanner(today=self.today + datetime.timedelta(days=1)).run()
+        self.assertEqual((report['created'], report['updated'], report['deleted']), (1, 2, 0))
+        self.assertEqual(self.notices(), {self.issues[30].pk: 17, self.issues[15].pk: 2, self.issues[14].pk: 1})
+
+    def test_returned_issues(self):
+        self.scanner().run()
+        self.client.force_authenticate(user=self.user)
+        response = self.client.patch(f'/book-issues/{self.issues[30].pk}/', {'return_date': '2024-06-30'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.notices(), {self.issues[15].pk: 1})
+
+        # Возврат в обход сигналов: уведомление удаляет следующий прогон
+        BookIssue.objects.filter(pk=self.issues[15].pk).update(is_returned=True)
+        report = self.scanner().run()
+        self.assertEqual((report['deleted'], self.notices()), (1, {}))
+
+    def test_resume_from_checkpoint(self):
+        calls = []
+
+        def interrupted(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return scan_chunk(*args)
+
+        with mock.patch('library.overdue.scan_chunk', side_effect=interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                self.scanner(checkpoint_path=self.checkpoint).run()
+        with open(self.checkpoint) as file:
+            self.assertEqual(json.load(file)['done'], [0])
+        self.assertEqual(self.notices(), {self.issues[30].pk: 16})
+
+        report = self.scanner(checkpoint_path=self.checkpoint).run()
+        self.assertEqual((report['chunks'], report['chunks_skipped'], report['rows']), (2, 1, 2))
+        self.assertEqual(self.notices(), {self.issues[30].pk: 16, self.issues[15].pk: 1})
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        # Контрольная точка другого дня не используется
+        with mock.patch('library.overdue.scan_chunk', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.scanner(checkpoint_path=self.checkpoint).run()
+        report = self.scanner(checkpoint_path=self.checkpoint, today=self.today + datetime.timedelta(days=1)).run()
+        self.assertEqual(report['chunks_skipped'], 0)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('scan_overdue_issues', '--date', '2024-06-30', '--chunk-size', '3', '--loan-days', '14',
+                     '--checkpoint', self.checkpoint, stdout=stdout)
+        self.assertIn("просрочено: 2", stdout.getvalue())
+        self.assertIn("выдач/с", stdout.getvalue())
+        self.assertEqual(len(self.notices()), 2)
+
+
+class OverdueScanProcessPoolTestCase(OverdueScanMixin, TransactionTestCase):
+    """Части обрабатываются в пуле процессов, результат совпадает с обработкой в текущем процессе"""
+
+    def test_workers(self):
+        self.create_issues()
+        report = self.scanner(workers=2).run()
+        self.assertEqual((report['chunks'], report['rows'], report['created']), (3, 4, 2))
+        self.assertEqual(self.notices(), {self.issues[30].pk: 16, self.issues[15].pk: 1})
+
+
+@override_settings(BOOK_SIMILARITY_METRIC='cosine', BOOK_SIMILARITY_TOP_K=20, BOOK_SIMILARITY_MAX_READER_BOOKS=500)
+class BookSimilarityTestCase(QueryBudgetTestMixin, APITestCase):
+    """
+        Рекомендации "Читатели также брали": книга 0 - у трех читателей, книги 1 и 2 - у двух из них,
+        книга 3 - у отдельного читателя, книгу 4 никто не брал
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(email="user@example.com", password="password")
+        self.client.force_authenticate(user=self.user)
+        author = Author.objects.create(name="Пушкин А.С.")
+        self.books = [Book.objects.create(title=f"Книга {i}", genre="Роман", author=author, user=self.user)
+                      for i in range(5)]
+        self.readers = [User.objects.create(email=f"reader{i}@example.com", password="password") for i in range(4)]
+        for reader, books in zip(self.readers, ((0, 1, 2, 0), (0, 1), (0, 2), (3,))):
+            for book in books:
+                self.issue(reader, book)
+
+    def issue(self, reader, book):
+        return BookIssue.objects.create(book=self.books[book], user=reader, is_returned=True)
+
+    def neighbours(self, book):
+        return [(row.similar_book_id, row.score, row.co_readers)
+                for row in BookSimilarity.objects.filter(book=self.books[book]).order_by('rank')]
+
+    def test_build(self):
+        report = SimilarityBuilder().run()
+        self.assertEqual((report['full'], report['readers'], report['books'], report['rows']), (True, 4, 5, 6))
+        # Повторная выдача книги 0 первому читателю не увеличивает число общих читателей
+        cosine = round(2 / 6 ** 0.5, 6)
+        self.assertEqual(self.neighbours(0), [(self.books[1].pk, cosine, 2), (self.books[2].pk, cosine, 2)])
+        self.assertEqual(self.neighbours(1), [(self.books[0].pk, cosine, 2), (self.books[2].pk, 0.5, 1)])
+        self.assertEqual((self.neighbours(3), self.neighbours(4)), ([], []))
+
+        SimilarityBuilder(metric='cooccurrence', top_k=1).run()
+        self.assertEqual(self.neighbours(1), [(self.books[0].pk, 2.0, 2)])
+
+    def test_heavy_readers(self):
+        report = SimilarityBuilder(max_reader_books=2).run()
+        self.assertEqual(report['readers'], 3)
+        cosine = round(1 / 2 ** 0.5, 6)
+        self.assertEqual(self.neighbours(0), [(self.books[1].pk, cosine, 1), (self.books[2].pk, cosine, 1)])
+
+    def test_incremental_refresh(self):
+        SimilarityBuilder().run()
+        self.issue(self.readers[3], 1)
+
+        # Пересчитываются только книги читателя новой выдачи
+        report = SimilarityBuilder().run()
+        self.assertEqual((report['full'], report['books']), (False, 2))
+        self.assertEqual(self.neighbours(3), [(self.books[1].pk, round(1 / 3 ** 0.5, 6), 1)])
+        self.assertIn((self.books[3].pk, round(1 / 3 ** 0.5, 6), 1), self.neighbours(1))
+
+        report = SimilarityBuilder().run()
+        self.assertEqual((report['full'], report['books']), (False, 0))
+        # Другие параметры - полное перестроение
+        self.assertTrue(SimilarityBuilder(top_k=5).run()['full'])
+        self.assertEqual(BookSimilarityBuild.objects.count(), 4)
+
+    def test_similar_endpoint(self):
+        SimilarityBuilder().run()
+        path = f'/books/{self.books[0].pk}/similar/'
+        response = self.assertQueryBudget('GET', path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['book'], self.books[0].pk)
+        self.assertEqual(response.data['results'][0], {
+            'id': self.books[1].pk, 'title': "Книга 1", 'author': "Пушкин А.С.", 'genre': "Роман",
+            'score': round(2 / 6 ** 0.5, 6), 'co_readers': 2,
+        })
+        self.assertEqual(len(self.client.get(path, {'limit': 1}).data['results']), 1)
+        self.assertEqual(len(self.client.get(path, {'limit': 'x'}).data['results']), 2)
+
+        # Пустой список - третий запрос, проверка существования книги
+        response = self.assertQueryBudget('GET', f'/books/{self.books[4].pk}/similar/')
+        self.assertEqual((response.status_code, response.data['results']), (status.HTTP_200_OK, []))
+        self.assertEqual(self.client.get('/books/0/similar/').status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(path).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('build_book_similarity', '--top-k', '1', stdout=stdout)
+        self.assertIn("Полное перестроение: читателей 4, книг 5, строк 3", stdout.getvalue())
+        call_command('build_book_similarity', '--top-k', '1', stdout=stdout)
+        self.assertIn("Обновление: читателей 4, книг 0", stdout.getvalue())
+
+
+class AutocompleteTestCase(QueryBudgetTestMixin, APITestCase):
+    """Подсказки по началу слов названия книги и имени автора по убыванию числа выдач"""
+
+    def setUp(self):
+        autocomplete_index.reset()
+        self.user = User.objects.create(email="user@example.com", password="password")
+        self.client.force_authenticate(user=self.user)
+        self.pushkin = Author.objects.create(name="Пушкин Александр")
+        self.balzac = Author.objects.create(name="Бальзак Оноре")
+        self.onegin = self.create_book("Евгений Онёгин", self.pushkin, issues=3)
+        self.grandet = self.create_book("Евгения Гранде", self.balzac, issues=1)
+        self.daughter = self.create_book("Капитанская дочка", self.pushkin, issues=0)
+
+    def create_book(self, title, author, issues):
+        book = Book.objects.create(title=title, genre="Роман", author=author, user=self.user)
+        for _ in range(issues):
+            BookIssue.objects.create(book=book, user=self.user, is_returned=True)
+        return book
+
+    def complete(self, query, **params):
+        response = self.client.get('/autocomplete/', {'q': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(item['type'], item['text'], item['issues_count']) for item in response.data['results']]
+
+    @override_settings(QUERY_BUDGET_MODE='raise', AUTOCOMPLETE_INDEX_TTL=0)
+    def test_cold_index_within_budget(self):
+        """Построение индекса в запросе (первый запрос и истекший AUTOCOMPLETE_INDEX_TTL) укладывается в бюджет"""
+        self.client.force_authenticate(user=None)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        for _ in range(2):
+            self.assertEqual(self.complete("евг")[0], ('book', "Евгений Онёгин", 3))
+
+    def test_prefix_and_ranking(self):
+        self.assertEqual(self.complete("евг"), [('book', "Евгений Онёгин", 3), ('book', "Евгения Гранде", 1)])
+        self.assertEqual(self.complete("онег"), [('book', "Евгений Онёгин", 3)])
+        self.assertEqual(self.complete("ЕВГЕНИЙ  он"), [('book', "Евгений Онёгин", 3)])
+        self.assertEqual(self.complete("евгени "), [])
+        self.assertEqual(self.complete("дочка"), [('book', "Капитанская дочка", 0)])
+        # Популярность автора - сумма выдач его книг, при равенстве книга выше автора
+        self.assertEqual(self.complete("пушкин"), [('author', "Пушкин Александр", 3)])
+        self.assertEqual(self.complete("о", type='author'), [('author', "Бальзак Оноре", 1)])
+        self.assertEqual(self.complete("е", limit=1), [('book', "Евгений Онёгин", 3)])
+        self.assertEqual(self.complete(" "), [])
+
+    def test_incremental_updates(self):
+        self.complete("е")
+        with self.captureOnCommitCallbacks(execute=True):
+            book = self.create_book("Евгеника", self.balzac, issues=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.onegin.title = "Онегин"
+            self.onegin.author = self.balzac
+            self.onegin.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.grandet.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pushkin.name = "Александр Пушкин"
+            self.pushkin.save()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.complete("евг"), [('book', "Евгеника", 5)])
+        self.assertEqual(self.complete("он"), [('author', "Бальзак Оноре", 8), ('book', "Онегин", 3)])
+        self.assertEqual(self.complete("александр"), [('author', "Александр Пушкин", 0)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BookIssue.objects.filter(book=book).first().delete()
+        self.assertEqual(self.complete("евг"), [('book', "Евгеника", 4)])
+
+        # Индекс после изменений совпадает с построенным заново
+        autocomplete_index.reset()
+        self.assertEqual(self.complete("евг"), [('book', "Евгеника", 4)])
+        self.assertEqual(self.complete("он"), [('author', "Бальзак Оноре", 7), ('book', "Онегин", 3)])
+
+    @override_settings(AUTOCOMPLETE_CACHE_MIN_MATCHES=2)
+    def test_wide_prefix_cache(self):
+        """Запомненные подсказки широкого префикса сбрасываются при изменении выдач"""
+        self.assertEqual(self.complete("евг", limit=1), [('book', "Евгений Онёгин", 3)])
+        self.assertEqual(len(self.complete("евг")), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_book("Пустая", self.pushkin, issues=0)
+            for _ in range(3):
+                BookIssue.objects.create(book=self.grandet, user=self.user, is_returned=True)
+        self.assertEqual(self.complete("евг", limit=1), [('book', "Евгения Гранде", 4)])
+
+    def test_prefix_index(self):
+        titles = {1: "Война и мир", 2: "Мир приключений", 3: "Анна Каренина", 4: "Мирная война"}
+        index = PrefixIndex(titles.items())
+        self.assertEqual(len(index), 9)
+        self.assertEqual(index.match("мир"), {1, 2, 4})
+        self.assertEqual(index.match("война и"), {1})
+
+        index.remove(2)
+        index.add(4, "Тихий Дон")
+        index.add(5, "Мир")
+        expected = PrefixIndex([(1, "Война и мир"), (3, "Анна Каренина"), (4, "Тихий Дон"), (5, "Мир")])
+        self.assertEqual(sorted(zip(index.ids, index.offsets)), sorted(zip(expected.ids, expected.offsets)))
+        self.assertEqual([index._key(i) for i in range(len(index))],
+                         [expected._key(i) for i in range(len(expected))])
+
+    def test_endpoint(self):
+        self.complete("е")
+        response = self.assertQueryBudget('GET', '/autocomplete/', {'q': "евг"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0], {
+            'type': 'book', 'id': self.onegin.pk, 'text': "Евгений Онёгин", 'issues_count': 3,
+        })
+        response = self.client.get('/autocomplete/', {'q': "евг", 'type': 'genre'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get('/autocomplete/?q=евг').status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AuthorIncludesTestCase(QueryBudgetTestMixin, APITestCase):
+    """Статистика и книги авторов в ответе /authors/ по ?include= без запросов на каждого автора"""
+
+    def setUp(self):
+        caches['api'].clear()
+        self.user = User.objects.create(email="user@example.com", password="password")
+        self.client.force_authenticate(user=self.user)
+        self.pushkin = Author.objects.create(name="Пушкин А.С.")
+        self.gogol = Author.objects.create(name="Гоголь Н.В.")
+        self.lermontov = Author.objects.create(name="Лермонтов М.Ю.")
+        self.onegin = Book.objects.create(title="Евгений Онегин", genre="Роман", author=self.pushkin, user=self.user)
+        self.daughter = Book.objects.create(title="Капитанская дочка", genre="Повесть", author=self.pushkin,
+                                            user=self.user)
+        self.nose = Book.objects.create(title="Нос", genre="Повесть", author=self.gogol, user=self.user)
+        for book, rating in ((self.onegin, 5), (self.onegin, 4), (self.daughter, 3), (self.daughter, None)):
+            BookIssue.objects.create(book=book, user=self.user, is_returned=True, rating=rating)
+        BookIssue.objects.create(book=self.onegin, user=self.user)
+
+    def authors(self, **params):
+        response = self.client.get('/authors/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {author['name']: author for author in response.data['results']}
+
+    def test_stats(self):
+        with self.assertNumQueries(1):
+            authors = self.authors(include='stats')
+        self.assertEqual(
+            [(authors[name]['book_count'], authors[name]['open_issue_count'], authors[name]['average_rating'])
+             for name in ("Пушкин А.С.", "Гоголь Н.В.", "Лермонтов М.Ю.")],
+            [(2, 1, 4.0), (1, 0, 0), (0, 0, 0)],
+        )
+        self.assertNotIn('books', authors["Пушкин А.С."])
+        self.assertNotIn('book_count', self.authors()["Пушкин А.С."])
+
+        response = self.client.get(f'/authors/{self.gogol.pk}/', {'include': 'stats', 'fields': 'name,book_count'})
+        self.assertEqual(response.data, {'name': "Гоголь Н.В.", 'book_count': 1})
+
+    def test_books(self):
+        for page_size in (1, 3):
+            with self.subTest(page_size=page_size), self.assertNumQueries(2):
+                authors = self.authors(include='books,stats', page_size=page_size)
+        self.assertEqual([book['title'] for book in authors["Пушкин А.С."]['books']],
+                         ["Евгений Онегин", "Капитанская дочка"])
+        self.assertEqual(authors["Пушкин А.С."]['books'][0], {
+            'id': self.onegin.pk, 'title': "Евгений Онегин", 'genre': "Роман", 'published_date': None,
+            'open_issues_count': 1,
+        })
+        self.assertEqual(authors["Лермонтов М.Ю."]['books'], [])
+
+        authors = self.authors(include='books', fields='name,books.title')
+        self.assertEqual(authors["Гоголь Н.В."], {'name': "Гоголь Н.В.", 'books': [{'title': "Нос"}]})
+        response = self.assertQueryBudget('GET', '/authors/', {'include': 'stats,books'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_invalid_and_nested(self):
+        response = self.client.get('/authors/', {'include': 'issues'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Автор внутри книги и ответ на запись - без дополнительных полей
+        response = self.client.get(f'/books/{self.nose.pk}/', {'include': 'stats'})
+        self.assertNotIn('book_count', response.data['author'])
+        response = self.client.post('/authors/?include=stats,books', {'name': "Толстой Л.Н."})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('book_count', response.data)
+
+    def test_cache_follows_books(self):
+        self.assertEqual(self.authors(include='stats')["Гоголь Н.В."]['book_count'], 1)
+        self.assertEqual(self.authors()["Гоголь Н.В."]['name'], "Гоголь Н.В.")
+        Book.objects.create(title="Шинель", genre="Повесть", author=self.gogol, user=self.user)
+        BookIssue.objects.create(book=self.nose, user=self.user)
+        authors = self.authors(include='stats')
+        self.assertEqual((authors["Гоголь Н.В."]['book_count'], authors["Гоголь Н.В."]['open_issue_count']), (2, 1))
+        # Ответ без ?include= от книг не зависит и остается в кеше
+        with self.assertNumQueries(0):
+            self.authors()
+
+    def test_async(self):
+        params = {'include': 'stats,books'}
+        expected = self.client.get('/authors/', params).data
+        caches['api'].clear()
+        self.assertEqual(self.client.get('/async/authors/', params).data['results'], expected['results'])
+        response = self.client.get(f'/async/authors/{self.pushkin.pk}/', params)
+        self.assertEqual((response.data['book_count'], len(response.data['books'])), (2, 2))
+
+
+class AuthorIdentityTestCase(APITestCase):
+    """Автор книги находится по identity_key: имя без учета регистра и пробелов и дата рождения"""
+
+    def setUp(self):
+        caches['api'].clear()
+        self.user = User.objects.create(email="user@example.com", password="password")
+        self.client.force_authenticate(user=self.user)
+        self.tolstoy = Author.objects.create(name="Толстой Лев", birth_date="1828-09-09", biography="Писатель.")
+
+    def test_identity_key(self):
+        self.assertEqual(identity_key("  Толстой   ЛЁВ ", datetime.date(1828, 9, 9)), "толстой лев|1828-09-09")
+        self.assertEqual(self.tolstoy.identity_key, "толстой лев|1828-09-09")
+        self.tolstoy.name = "Толстой Л.Н."
+        self.tolstoy.save(update_fields=['name'])
+        self.assertEqual(Author.objects.get(pk=self.tolstoy.pk).identity_key, "толстой л.н.|1828-09-09")
+
+    def test_book_author_lookup(self):
+        for title, name, biography in (("Война и мир", "толстой  лев", ""), ("Анна Каренина", "ТОЛСТОЙ ЛЕВ", "Граф.")):
+            response = self.client.post('/books/', {
+                'title': title, 'genre': "Роман",
+                'author': {'name': name, 'birth_date': "1828-09-09", 'biography': biography},
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data['author']['id'], self.tolstoy.pk)
+            self.assertNotIn('identity_key', response.data['author'])
+        # Другая дата рождения - другой автор
+        response = self.client.patch(f"/books/{response.data['id']}/", {
+            'author': {'name': "Толстой Лев", 'birth_date': "1883-01-10"},
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Author.objects.count(), 2)
+        self.assertEqual(Author.objects.get(pk=self.tolstoy.pk).biography, "Писатель.")
+
+    def test_duplicate_author_rejected(self):
+        response = self.client.post('/authors/', {'name': " толстой лев", 'birth_date': "1828-09-09"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/authors/', {'name': "Толстой Лев"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.patch(f"/authors/{response.data['id']}/", {'birth_date': "1828-09-09"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(f'/authors/{self.tolstoy.pk}/', {'name': "ТОЛСТОЙ ЛЕВ"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_ingest_memo(self):
+        author = {"name": "Гоголь Н.В.", "birth_date": "1809-04-01"}
+        rows = [{"title": f"Книга {number}", "genre": "Повесть", "author": author} for number in range(4)]
+        body = "\n".join(json.dumps(row, ensure_ascii=False) for row in rows)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/books/bulk-ingest/?chunk_size=1", body.encode(),
+                                        content_type="application/x-ndjson")
+        self.assertEqual((response.data['books_created'], response.data['authors_created']), (4, 1))
+        # Автор запрашивается только в первой части
+        self.assertEqual(sum('"library_author"."identity_key" IN' in query['sql'] for query in queries), 1)
+
+    def test_merge_command(self):
+        duplicate = Author.objects.create(name="Толстой Л.", birth_date="1828-09-09")
+        pushkin = Author.objects.create(name="Пушкин", biography="Поэт.")
+        gogol = Author.objects.create(name="Гоголь")
+        book = Book.objects.create(title="Хаджи-Мурат", genre="Повесть", author=duplicate, user=self.user)
+        # Изменения в обход модели: ключи устарели, имена Пушкина и Гоголя поменялись местами
+        Author.objects.filter(pk=duplicate.pk).update(name=" толстой ЛЕВ", biography="Граф.")
+        Author.objects.filter(pk=self.tolstoy.pk).update(biography="")
+        Author.objects.filter(pk=pushkin.pk).update(name="Гоголь")
+        Author.objects.filter(pk=gogol.pk).update(name="Пушкин")
+
+        stdout = StringIO()
+        call_command('merge_duplicate_authors', '--dry-run', stdout=stdout)
+        self.assertIn("объединено 1, перенесено книг 1, исправлено ключей 2", stdout.getvalue())
+        self.assertTrue(Author.objects.filter(pk=duplicate.pk).exists())
+
+        call_command('merge_duplicate_authors', stdout=stdout)
+        self.assertFalse(Author.objects.filter(pk=duplicate.pk).exists())
+        book.refresh_from_db()
+        self.assertEqual(book.author_id, self.tolstoy.pk)
+        # Пустая биография оставшегося автора берется у дубликата
+        self.assertEqual(Author.objects.get(pk=self.tolstoy.pk).biography, "Граф.")
+        self.assertEqual(
+            dict(Author.objects.values_list('pk', 'identity_key')),
+            {self.tolstoy.pk: "толстой лев|1828-09-09", pushkin.pk: "гоголь|", gogol.pk: "пушкин|"},
+        )
+
+    def test_merge_moves_author_stats(self):
+        def author_stats():
+            return {row.key: (row.issues_count, row.open_issues_count, row.returned_count, row.rating_sum)
+                    for row in ReadingStats.objects.filter(dimension=ReadingStats.AUTHOR)}
+
+        duplicates = [Author.objects.create(name=f"Толстой Л.{number}", birth_date="1828-09-09") for number in range(2)]
+        pushkin = Author.objects.create(name="Пушкин")
+        pushkin_duplicate = Author.objects.create(name="Пушкин А.")
+        for author, rating in ((self.tolstoy, 5), (duplicates[0], 4), (duplicates[1], None), (pushkin_duplicate, 3)):
+            book = Book.objects.create(title=f"Книга {author.pk}", genre="Роман", author=author, user=self.user)
+            BookIssue.objects.create(book=book, user=self.user, is_returned=rating is not None, rating=rating)
+        Author.objects.filter(pk__in=[author.pk for author in duplicates]).update(name="Толстой Лев")
+        Author.objects.filter(pk=pushkin_duplicate.pk).update(name="Пушкин")
+
+        call_command('merge_duplicate_authors', stdout=StringIO())
+        # У Пушкина строки статистики не было, она создается из строки дубликата
+        self.assertEqual(author_stats(), {str(self.tolstoy.pk): (3, 1, 2, 9), str(pushkin.pk): (1, 0, 1, 3)})
+        rebuild_reading_stats()
+        self.assertEqual(author_stats(), {str(self.tolstoy.pk): (3, 1, 2, 9), str(pushkin.pk): (1, 0, 1, 3)})
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import SimpleRouter
 from library.apps import LibraryConfig
-from library.views import BookViewSet, AuthorViewSet, BookIssueViewSet
+from library.async_views import AsyncAuthorViewSet, AsyncBookIssueViewSet, AsyncBookViewSet
+from library.views import AutocompleteView, BookViewSet, AuthorViewSet, BookIssueViewSet, ReadingStatsViewSet
 
 # проводим стандартные настройки. Указываем приложение, импортируем из habits.apps.HabitsConfig
 app_name = LibraryConfig.name
@@ -13,10 +14,19 @@ router = SimpleRouter()
 router.register(r'authors', AuthorViewSet)
 router.register(r'books', BookViewSet)
 router.register(r'book-issues', BookIssueViewSet)
+router.register(r'stats', ReadingStatsViewSet)
+
+# Async варианты чтения для ASGI сервера (library/async_views.py)
+async_router = SimpleRouter()
+async_router.register(r'authors', AsyncAuthorViewSet, basename='async-author')
+async_router.register(r'books', AsyncBookViewSet, basename='async-book')
+async_router.register(r'book-issues', AsyncBookIssueViewSet, basename='async-bookissue')
 
 urlpatterns = [
     path('api/', include(router.urls)),
     path('api/auth/', include('rest_framework.urls')),
+    path('async/', include(async_router.urls)),
+    path('autocomplete/', AutocompleteView.as_view(), name='autocomplete'),
 ]
 # к urlpatterns добавляем наши urls
 urlpatterns += router.urls
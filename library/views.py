@@ -1,14 +1,33 @@
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets, filters
-from django.db.models import Q
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from library.filters import BookFilter
-from library.models import Book, Author, BookIssue
-from library.serializers import AuthorSerializer, BookSerializer, BookIssueSerializer
+from library.autocomplete import KINDS, autocomplete_index
+from library.cache import AUTHORS, BOOKS, CachedResponseMixin
+from library.exports import CONTENT_TYPES, STREAMS, export_queryset, iter_issue_rows
+from library.fast_lists import BookIssueValues, BookValues, ValuesListMixin
+from library.fieldsets import FieldSelection, requested_includes
+from library.filters import BookFilter, BookIssueExportFilter, ReadingStatsFilter, SearchOrderingFilter
+from library.ingest import READERS, BookIngestor
+from library.models import Book, Author, BookIssue, BookSimilarity, ReadingStats
+from library.paginators import KeysetPagination
+from library.serializers import (
+    AuthorBookSerializer, AuthorSerializer, BookIssueSerializer, BookSerializer, BulkIssueSerializer,
+    BulkReturnSerializer, ReadingStatsSerializer, SimilarBookSerializer,
+)
+from library.services import issue_books, return_book_issues
+from library.similarity import get_top_k
 from rest_framework.permissions import IsAuthenticated
+from users.permissions import IsModerator
 
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(CachedResponseMixin, ValuesListMixin, viewsets.ModelViewSet):
     """
         API для работы с книгами.
         Позволяет создавать, читать, изменять и удалять книги.
@@ -16,16 +35,30 @@ class BookViewSet(viewsets.ModelViewSet):
         Позволяет сортировать по полям название, автор, жанр, пример "http://127.0.0.1:8000/books/?title=онегин"
             фильтрация не чувствительна к регистру
         Фильтрация также возможна по полю is_returned, чтобы получить только список доступных книг
+        Поиск по названию, автору и жанру с учетом опечаток: "http://127.0.0.1:8000/books/?search=онегн",
+            результаты сортируются по релевантности, если не указан параметр 'ordering'
         сортировка по умолчанию по полю "title", либо через параметр 'ordering'
         Пример запроса с фильтрацией и сортировкой
             "http://127.0.0.1:8000/books/?is_returned=true&ordering=-published_date"
+        Список отдается страницами по курсору (KeysetPagination), ссылки на соседние страницы в полях next/previous
+        Ответы списка и карточки кешируются (CachedResponseMixin), карточка поддерживает ETag/If-None-Match
+        Список строится из .values() без сериализатора (ValuesListMixin, настройка API_FAST_LISTS)
+        Похожие книги "Читатели также брали": "http://127.0.0.1:8000/books/1/similar/?limit=10"
     """
 
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, SearchOrderingFilter]
     filterset_class = BookFilter  # ['title', 'author__name', 'genre']
+    pagination_class = KeysetPagination
+    values_representation_class = BookValues
+    cache_namespace = BOOKS
+    # Аутентификация + страница книг с автором, пользователем и рейтингом.
+    # list: еще один запрос, если ?search= застает индекс поиска пустым или устаревшим (BOOK_SEARCH_INDEX_TTL)
+    # и строит его в этом запросе.
+    # similar: соседи книги и, если список пуст, проверка существования книги (пустой список или 404)
+    query_budget = {'list': 3, 'retrieve': 2, 'similar': 3}
     ordering_fields = ['title', 'published_date', 'author__name']
     ordering = ['title']
 
@@ -34,51 +67,149 @@ class BookViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """
-        Возвращает книги, учитывая параметр фильтрации is_returned.
+        Возвращает книги со средним рейтингом, автором и пользователем в одном запросе.
+        Фильтрация по is_returned выполняется в BookFilter по счетчику Book.open_issues_count.
+        При выборочных полях (?fields=, ?omit=) не считается рейтинг, не загружаются описание,
+        биография и связи, которых нет в ответе.
         """
 
+        selection = FieldSelection.from_request(self.request)
         queryset = Book.objects.all()
+        # Автор нужен и для курсора пагинации при сортировке по author__name
+        if selection.includes('author') or 'author__name' in self.get_ordering_fields():
+            queryset = queryset.select_related('author')
+            if not selection.includes('author.biography'):
+                queryset = queryset.defer('author__biography')
+        if selection.includes('user'):
+            queryset = queryset.select_related('user')
+        if selection.includes('average_rating'):
+            queryset = queryset.with_average_rating()
+        if not selection.includes('description'):
+            queryset = queryset.defer('description')
+        return queryset
 
-        # Проверяем наличие параметра is_returned в запросе
-        is_returned = self.request.query_params.get('is_returned')
-        if is_returned is not None:
-            if is_returned.lower() == 'true':
-                # Фильтруем книги, где все записи в BookIssue отмечены как возвращенные
-                queryset = queryset.filter(
-                    # Инвертируем условие ~Q(...), чтобы оставить только свободные
-                    ~Q(issues__is_returned=False)  # Исключаем книги с активными записями
-                ).distinct()
-            elif is_returned.lower() == 'false':
-                # Фильтруем книги с активными (не возвращенными) записями
-                queryset = queryset.filter(
-                    issues__is_returned=False
-                ).distinct()
+    def get_ordering_fields(self):
+        """Поля сортировки из параметра ordering без направления"""
+        if self.request is None:
+            return []
+        return [field.strip().lstrip('-') for field in self.request.query_params.get('ordering', '').split(',')]
 
-        return queryset
+    @action(detail=True, methods=['get'], serializer_class=SimilarBookSerializer, pagination_class=None)
+    def similar(self, request, pk=None):
+        """
+            Книги, которые брали читатели этой книги, по убыванию сходства (library/similarity.py).
+            Соседи заранее посчитаны командой build_book_similarity, ответ читает не больше limit строк
+            по индексу (book, rank). Пример: "http://127.0.0.1:8000/books/1/similar/?limit=10"
+        """
 
+        try:
+            book_id = int(pk)
+        except ValueError:
+            raise NotFound()
+        try:
+            limit = min(max(int(request.query_params['limit']), 1), get_top_k())
+        except (KeyError, ValueError):
+            limit = get_top_k()
+        similar = list(BookSimilarity.objects.filter(book_id=book_id).select_related(
+            'similar_book__author').only(
+            'similar_book_id', 'score', 'co_readers', 'similar_book__title', 'similar_book__genre',
+            'similar_book__author__name',
+        ).order_by('rank')[:limit])
+        # Пустой список у существующей книги без общих читателей, 404 - книги нет
+        if not similar and not Book.objects.filter(pk=book_id).exists():
+            raise NotFound()
+        return Response({'book': book_id, 'results': self.get_serializer(similar, many=True).data})
 
-class AuthorViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'], url_path='bulk-ingest')
+    def bulk_ingest(self, request):
+        """
+            Массовая загрузка книг из тела запроса в формате NDJSON (Content-Type: application/x-ndjson)
+            или CSV (Content-Type: text/csv). Формат можно указать явно параметром ?input_format=ndjson|csv
+            Пример: "http://127.0.0.1:8000/books/bulk-ingest/?chunk_size=1000"
+            Возвращает отчет: количество строк, созданных книг и авторов, ошибки по строкам, скорость загрузки
+        """
+
+        input_format = request.query_params.get('input_format') or (
+            'csv' if 'csv' in request.content_type else 'ndjson'
+        )
+        if input_format not in READERS:
+            return Response({'input_format': f"Поддерживаются форматы: {', '.join(READERS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            chunk_size = min(max(int(request.query_params.get('chunk_size', 1000)), 1), 10000)
+        except ValueError:
+            return Response({'chunk_size': "Ожидается целое число"}, status=status.HTTP_400_BAD_REQUEST)
+
+        lines = request.stream or []
+        report = BookIngestor(user_id=request.user.pk, chunk_size=chunk_size).ingest(READERS[input_format](lines))
+        return Response(report)
+
+
+class AuthorViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
         API для работы с авторами.
         Позволяет создавать, читать, изменять и удалять авторов.
+        Ответы списка и карточки кешируются (CachedResponseMixin), карточка поддерживает ETag/If-None-Match
+        Статистика и книги авторов без отдельного запроса на каждого автора:
+            "http://127.0.0.1:8000/authors/?include=stats,books"
+            stats - число книг, выданных экземпляров и средний рейтинг, считаются в запросе списка
+            books - книги всех авторов страницы одним дополнительным запросом
     """
 
     queryset = Author.objects.all()
     serializer_class = AuthorSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    cache_namespace = AUTHORS
+    # Аутентификация, страница авторов и книги страницы (?include=books) при любом размере страницы
+    query_budget = {'list': 3, 'retrieve': 3}
+
+    def get_includes(self):
+        return requested_includes(self.request, AuthorSerializer.INCLUDES)
 
+    def get_cache_dependencies(self):
+        # Статистика и книги меняются вместе с книгами и выдачами, а не с авторами
+        return (BOOKS,) if self.get_includes() else ()
 
-class BookIssueViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        selection = FieldSelection.from_request(self.request)
+        includes = self.get_includes()
+        queryset = Author.objects.all()
+        # Биография не загружается, если ее нет в ответе (?fields=, ?omit=)
+        if not selection.includes('biography'):
+            queryset = queryset.defer('biography')
+        if 'stats' in includes:
+            queryset = queryset.with_stats()
+        if 'books' in includes and selection.includes('books'):
+            queryset = queryset.prefetch_related(Prefetch(
+                'books', queryset=Book.objects.only(*AuthorBookSerializer.Meta.fields, 'author_id').order_by(
+                    'title', 'id'),
+            ))
+        return queryset
+
+
+class BookIssueViewSet(ValuesListMixin, viewsets.ModelViewSet):
     """
         API для работы с выдачами книг.
         Позволяет создавать, читать, изменять и удалять записи о выдачах книг.
         При возврате книги, автоматически устанавливается статус 'is_returned' в True.
         При получении книги автоматически заполняется поле выдачи текущей датой
+        Список строится из .values() без сериализатора (ValuesListMixin, настройка API_FAST_LISTS)
     """
 
-    queryset = BookIssue.objects.all()
+    queryset = BookIssue.objects.select_related('book', 'user')  # book.title и user.email в сериализаторе
     serializer_class = BookIssueSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    values_representation_class = BookIssueValues
+    query_budget = {'list': 2, 'retrieve': 2}
+
+    def get_queryset(self):
+        # Книга и пользователь присоединяются, только если их поля есть в ответе (?fields=, ?omit=)
+        selection = FieldSelection.from_request(self.request)
+        related = [name for name, field in (('book', 'book_title'), ('user', 'user_email'))
+                   if selection.includes(field)]
+        return BookIssue.objects.select_related(*related)
 
     def perform_create(self, serializer):
         serializer.save()  # Создаем запись о выдаче книги
@@ -86,3 +217,109 @@ class BookIssueViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         # Логика обновления данных при возврате книги
         serializer.save()
+
+    @action(detail=False, methods=['post'], url_path='bulk-issue', serializer_class=BulkIssueSerializer)
+    def bulk_issue(self, request):
+        """
+            Выдача нескольких книг одним запросом и одной транзакцией (например, для класса):
+                {"items": [{"book": 1, "user": 2}, {"book": 5, "user": 3}]}
+            Занятая или несуществующая книга не прерывает пакет, результат возвращается по каждой позиции
+            в порядке items: {"issue": {...}} или {"error": "..."}
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = issue_books([(item['book'], item['user']) for item in serializer.validated_data['items']])
+        return self.bulk_response(results)
+
+    @action(detail=False, methods=['post'], url_path='bulk-return', serializer_class=BulkReturnSerializer)
+    def bulk_return(self, request):
+        """
+            Возврат нескольких книг одним запросом и одной транзакцией:
+                {"items": [{"id": 10, "return_date": "2024-12-01", "rating": 5}, {"id": 11}]}
+            return_date по умолчанию - текущая дата, rating необязателен. Результат - как у bulk-issue
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = return_book_issues([
+            (item['id'], item['return_date'], item['rating']) for item in serializer.validated_data['items']
+        ])
+        return self.bulk_response(results)
+
+    def bulk_response(self, results):
+        """Выдачи пакета загружаются для ответа одним запросом, связанные объекты - только для полей ответа"""
+        ids = [issue.pk for issue, _ in results if issue is not None]
+        issues = self.get_queryset().in_bulk(ids)
+        serializer = BookIssueSerializer([issues[pk] for pk in ids], many=True, context=self.get_serializer_context())
+        data = iter(serializer.data)
+        return Response({
+            'succeeded': len(ids),
+            'failed': len(results) - len(ids),
+            'results': [{'issue': next(data)} if issue is not None else {'error': error} for issue, error in results],
+        })
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+            Потоковая выгрузка всей истории выдач в CSV или NDJSON (?file_format=csv|ndjson)
+            Фильтры: date_from, date_to (по дате выдачи), user
+            Пример: "http://127.0.0.1:8000/book-issues/export/?file_format=ndjson&date_from=2024-01-01&user=1"
+        """
+
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in STREAMS:
+            return Response({'file_format': f"Поддерживаются форматы: {', '.join(STREAMS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        filterset = BookIssueExportFilter(request.query_params, queryset=export_queryset())
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            STREAMS[file_format](iter_issue_rows(filterset.qs)), content_type=CONTENT_TYPES[file_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="book-issues.{file_format}"'
+        return response
+
+
+class ReadingStatsViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+        API статистики чтения для модераторов.
+        Ответ читается из накопительной таблицы ReadingStats, поэтому его время не зависит от объема истории выдач.
+        Фильтрация по разрезу и ключу: "http://127.0.0.1:8000/stats/?dimension=genre&key=Роман"
+            dimension - genre, author (key - id автора) или user (key - id пользователя)
+    """
+
+    queryset = ReadingStats.objects.all()
+    serializer_class = ReadingStatsSerializer
+    permission_classes = [IsAuthenticated, IsModerator]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ReadingStatsFilter
+    pagination_class = KeysetPagination
+    # Аутентификация, группы модератора (при пустом кеше ролей) и страница статистики
+    query_budget = {'list': 3, 'retrieve': 3}
+
+
+class AutocompleteView(APIView):
+    """
+        Подсказки для строки поиска по началу слов названия книги и имени автора, по убыванию числа выдач.
+        Индекс в памяти процесса (library/autocomplete.py), к базе обращается только аутентификация
+        и перестроение индекса.
+        Пример: "http://127.0.0.1:8000/autocomplete/?q=евгений он&limit=10&type=book"
+            type - book или author, без параметра подсказываются и книги, и авторы
+    """
+
+    permission_classes = [IsAuthenticated]
+    # Аутентификация; индекс строится в запросе при первом обращении процесса и после AUTOCOMPLETE_INDEX_TTL:
+    # книги, число выдач книг и авторы - еще три запроса
+    query_budget = {'get': 4}
+
+    def get(self, request):
+        kind = request.query_params.get('type')
+        if kind is not None and kind not in KINDS:
+            return Response({'type': f"Допустимые значения: {', '.join(KINDS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        max_results = getattr(settings, 'AUTOCOMPLETE_MAX_RESULTS', 50)
+        try:
+            limit = min(max(int(request.query_params['limit']), 1), max_results)
+        except (KeyError, ValueError):
+            limit = getattr(settings, 'AUTOCOMPLETE_LIMIT', 10)
+        results = autocomplete_index.complete(request.query_params.get('q', ''), limit, [kind] if kind else KINDS)
+        return Response({'results': results})
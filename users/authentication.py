@@ -0,0 +1,105 @@
+"""
+    Аутентификация по JWT без запроса к таблице пользователей на каждый запрос.
+
+    Режим включается настройкой JWT_AUTH_MODE = 'claims' (по умолчанию 'db' - стандартный JWTAuthentication).
+    Пользователь запроса (ClaimsUser) строится из claims access токена: id, email, is_staff, groups.
+    Состояние учетной записи (активность, хеш пароля, email, is_staff) перепроверяется в базе не чаще
+    одного раза в JWT_CLAIMS_REVALIDATE_SECONDS секунд на пользователя и хранится в LRU кеше процесса
+    (не более JWT_CLAIMS_CACHE_SIZE пользователей), поэтому блокировка пользователя или смена пароля
+    отзывают токены не позже чем через это время. В процессе, где изменен пользователь, - сразу (users/signals.py).
+"""
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from users.local_cache import TTLCache
+from users.models import User
+
+account_cache = TTLCache('JWT_CLAIMS_REVALIDATE_SECONDS', 30, 'JWT_CLAIMS_CACHE_SIZE', 10000)
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Выдает токены с claims пользователя и хешем его пароля для режима JWT_AUTH_MODE = 'claims'"""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[api_settings.REVOKE_TOKEN_CLAIM] = get_md5_hash_password(user.password)
+        token['email'] = user.email
+        token['is_staff'] = user.is_staff
+        token['groups'] = sorted(user.groups.values_list('name', flat=True))
+        return token
+
+
+class ClaimsUser(TokenUser):
+    """
+        Пользователь из claims токена. Поддерживает то, что нужно представлениям и разрешениям:
+        pk, email, is_staff, названия групп (group_names). Записи в базу через него невозможны,
+        для связей используйте user.pk
+    """
+
+    def __init__(self, token, account=None):
+        super().__init__(token)
+        self.account = account or {}
+
+    def __str__(self):
+        return self.email
+
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def email(self):
+        return self.account.get('email', self.token.get('email', ''))
+
+    @cached_property
+    def username(self):
+        return self.email
+
+    @cached_property
+    def is_staff(self):
+        return self.account.get('is_staff', self.token.get('is_staff', False))
+
+    @cached_property
+    def group_names(self):
+        """Группы на момент выдачи токена, для проверок прав используйте users.roles.get_user_roles"""
+        return tuple(self.token.get('groups', ()))
+
+
+def load_account(user_id):
+    """Состояние учетной записи для перепроверки токена, None - пользователь удален"""
+    account = account_cache.get(user_id)
+    if account is None:
+        account = User.objects.filter(pk=user_id).values('is_active', 'password', 'email', 'is_staff').first()
+        if account is None:
+            return None
+        account['password'] = get_md5_hash_password(account['password'])
+        account_cache.set(user_id, account)
+    return account
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+    """JWT аутентификация без загрузки пользователя из базы на каждый запрос"""
+
+    def get_user(self, validated_token):
+        super().get_user(validated_token)  # проверка наличия id пользователя в токене
+        try:
+            user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        except (TypeError, ValueError):
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        account = load_account(user_id)
+        if account is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not account['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        # Хеш пароля проверяется всегда: токен без него выдан не в этом режиме
+        if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != account['password']:
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return ClaimsUser(validated_token, account)
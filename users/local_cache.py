@@ -0,0 +1,48 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class TTLCache:
+    """
+        Потокобезопасный LRU кеш в памяти процесса с временем жизни записей.
+        Время жизни и размер читаются из настроек ttl_setting и size_setting при каждой записи
+    """
+
+    def __init__(self, ttl_setting, ttl_default, size_setting, size_default):
+        self.ttl_setting, self.ttl_default = ttl_setting, ttl_default
+        self.size_setting, self.size_default = size_setting, size_default
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        ttl = getattr(settings, self.ttl_setting, self.ttl_default)
+        size = getattr(settings, self.size_setting, self.size_default)
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,51 @@
+import statistics
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from library.query_budget import QueryCounter
+from library.views import BookIssueViewSet
+from users.authentication import ClaimsJWTAuthentication, ClaimsTokenObtainPairSerializer
+from users.models import User
+
+MODES = {
+    'db': JWTAuthentication,
+    'claims': ClaimsJWTAuthentication,
+}
+
+
+class Command(BaseCommand):
+    help = "Сравнивает время ответа GET /book-issues/ в режимах JWT_AUTH_MODE 'db' и 'claims'"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-email', required=True, help="Пользователь, для которого выпускается токен")
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['user_email']).first()
+        if user is None:
+            raise CommandError(f"Пользователь {options['user_email']} не найден")
+        token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+        factory = RequestFactory()
+
+        for mode, authentication_class in MODES.items():
+            view = BookIssueViewSet.as_view({'get': 'list'}, authentication_classes=[authentication_class])
+            timings = []
+            with QueryCounter() as counter:
+                for _ in range(options['requests']):
+                    request = factory.get('/book-issues/', {'page_size': 1}, HTTP_AUTHORIZATION=f"Bearer {token}")
+                    started = time.perf_counter()
+                    response = view(request)
+                    response.render()
+                    timings.append((time.perf_counter() - started) * 1000)
+                    if response.status_code != 200:
+                        raise CommandError(f"{mode}: ответ {response.status_code} {response.content[:200]}")
+
+            percentiles = statistics.quantiles(timings, n=100)
+            self.stdout.write(
+                f"{mode:>6}: {len(timings) / (sum(timings) / 1000):.0f} запросов/с, "
+                f"p50 {percentiles[49]:.3f} мс, p95 {percentiles[94]:.3f} мс, "
+                f"SQL запросов на ответ {len(counter) / len(timings):.2f}"
+            )
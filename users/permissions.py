@@ -1,10 +1,24 @@
 from rest_framework.permissions import BasePermission
 
+from users.roles import get_user_roles
 
-class IsModerator(BasePermission):
+
+class HasGroupPermission(BasePermission):
     """
-    Разрешение для проверки, что пользователь принадлежит группе 'Moderators'.
+    Разрешение для пользователей, состоящих хотя бы в одной из групп required_groups.
+    Группы пользователя берутся из кеша ролей (users/roles.py), без запроса к базе на каждый запрос.
+    Пример: class IsLibrarian(HasGroupPermission): required_groups = ("Librarians",)
     """
 
+    required_groups = ()
+
     def has_permission(self, request, view):
-        return request.user.is_authenticated and request.user.groups.filter(name="Moderators").exists()
+        return bool(get_user_roles(request.user) & set(self.required_groups))
+
+
+class IsModerator(HasGroupPermission):
+    """
+    Разрешение для проверки, что пользователь принадлежит группе 'Moderators'.
+    """
+
+    required_groups = ("Moderators",)
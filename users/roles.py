@@ -0,0 +1,27 @@
+"""
+    Кеш ролей (названий групп) пользователей для проверок прав.
+
+    Группы пользователя загружаются одним запросом и хранятся в LRU кеше процесса
+    не дольше ROLE_CACHE_TTL секунд, не более ROLE_CACHE_SIZE пользователей.
+    Изменения состава групп (m2m_changed User.groups), переименование и удаление групп сбрасывают кеш
+    сигналами users/signals.py. Другие процессы увидят изменение не позже чем через ROLE_CACHE_TTL секунд.
+"""
+from django.contrib.auth.models import Group
+
+from users.local_cache import TTLCache
+
+role_cache = TTLCache('ROLE_CACHE_TTL', 60, 'ROLE_CACHE_SIZE', 10000)
+
+
+def get_user_roles(user):
+    """
+        Названия групп пользователя, запрос к базе только при отсутствии в кеше.
+        Работает и для пользователя из claims токена (users.authentication.ClaimsUser)
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    roles = role_cache.get(user.pk)
+    if roles is None:
+        roles = frozenset(Group.objects.filter(user__pk=user.pk).values_list('name', flat=True))
+        role_cache.set(user.pk, roles)
+    return roles
@@ -1,8 +1,13 @@
 from rest_framework import serializers
+
+from library.fieldsets import SparseFieldsetsMixin
+from library.instrumentation import TimedSerializerMixin
 from users.models import User
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, SparseFieldsetsMixin, serializers.ModelSerializer):
+    """Поддерживает выборочные поля ?fields=id,email и ?omit=groups (library/fieldsets.py)"""
+
     password = serializers.CharField(write_only=True)
 
     class Meta:
@@ -0,0 +1,37 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from users.authentication import account_cache
+from users.models import User
+from users.roles import role_cache
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_roles_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Изменение групп пользователя (user.groups) или состава группы (group.user_set)"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        role_cache.invalidate(instance.pk)
+    elif pk_set is not None:
+        role_cache.invalidate(*pk_set)
+    else:
+        # group.user_set.clear() не передает id пользователей
+        role_cache.clear()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_roles_on_group_change(sender, instance, created=False, **kwargs):
+    """Переименование или удаление группы меняет роли всех ее участников"""
+    if not created:
+        role_cache.clear()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_account_on_user_change(sender, instance, **kwargs):
+    """Блокировка, смена пароля или удаление пользователя отзывают его токены в режиме JWT_AUTH_MODE = 'claims'"""
+    account_cache.invalidate(instance.pk)
+    role_cache.invalidate(instance.pk)
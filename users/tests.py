@@ -1,7 +1,22 @@
+import time
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIRequestFactory
 from rest_framework.test import APITestCase
 from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
 from library.models import Author, Book, BookIssue
+from library.query_budget import QueryBudgetTestMixin
+from library.views import BookViewSet
+from users.authentication import ClaimsJWTAuthentication, ClaimsTokenObtainPairSerializer, account_cache
 from users.models import User
+from users.roles import role_cache
 
 
 class AuthorCRUDTestCase(APITestCase):
@@ -241,3 +256,146 @@ class UserBooksStatsTestCase(APITestCase):
         )
         self.assertEqual(self.user.total_books_taken, 1)
         self.assertEqual(self.user.total_days_held_books, 1)  # issue.calculate_days_held()
+
+
+class UserListQueryBudgetTestCase(QueryBudgetTestMixin, APITestCase):
+    """
+        Список пользователей для модератора: группы пользователей загружаются одним запросом
+    """
+
+    def setUp(self):
+        role_cache.clear()
+        self.moderator = User.objects.create(email="moderator@example.com", password="password")
+        moderators = Group.objects.create(name="Moderators")
+        self.moderator.groups.add(moderators)
+        for i in range(10):
+            User.objects.create(email=f"reader{i}@example.com").groups.add(moderators)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.moderator)}")
+
+    def test_user_list(self):
+        # Бюджет рассчитан на пустой кеш ролей: группы модератора загружаются первым запросом
+        response = self.assertQueryBudget("GET", "/users/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.assertQueryBudget("GET", "/users/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 11)
+
+    def test_user_list_fields(self):
+        """Без групп в ответе (?fields=) группы пользователей не загружаются"""
+        self.client.get("/users/")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/users/", {"fields": "id,email"})
+        self.assertEqual(set(response.data['results'][0]), {"id", "email"})
+        self.assertFalse([query for query in queries.captured_queries if "users_user_groups" in query['sql']])
+
+
+class RoleCacheTestCase(APITestCase):
+    """
+        Проверка группы Moderators без запроса к базе и сброс кеша ролей при изменении групп
+    """
+
+    def setUp(self):
+        role_cache.clear()
+        self.moderators = Group.objects.create(name="Moderators")
+        self.user = User.objects.create(email="moderator@example.com", password="password")
+        self.user.groups.add(self.moderators)
+        self.client.force_authenticate(user=self.user)
+
+    def assertUserListStatus(self, expected_status):
+        self.assertEqual(self.client.get("/users/").status_code, expected_status)
+
+    def test_roles_are_cached(self):
+        with CaptureQueriesContext(connection) as cold:
+            self.assertUserListStatus(status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as warm:
+            self.assertUserListStatus(status.HTTP_200_OK)
+        self.assertEqual(len(warm), len(cold) - 1)
+
+    def test_membership_change_invalidates_cache(self):
+        self.assertUserListStatus(status.HTTP_200_OK)
+        self.user.groups.remove(self.moderators)
+        self.assertUserListStatus(status.HTTP_403_FORBIDDEN)
+        self.moderators.user_set.add(self.user)
+        self.assertUserListStatus(status.HTTP_200_OK)
+        self.moderators.user_set.clear()
+        self.assertUserListStatus(status.HTTP_403_FORBIDDEN)
+
+    def test_group_rename_invalidates_cache(self):
+        self.assertUserListStatus(status.HTTP_200_OK)
+        self.moderators.name = "Readers"
+        self.moderators.save()
+        self.assertUserListStatus(status.HTTP_403_FORBIDDEN)
+
+
+class ClaimsAuthenticationTestCase(APITestCase):
+    """
+        Режим JWT_AUTH_MODE = 'claims': пользователь из claims токена без запроса к базе на каждый запрос,
+        блокировка и смена пароля отзывают токен
+    """
+
+    def setUp(self):
+        account_cache.clear()
+        role_cache.clear()
+        self.user = User.objects.create(email="reader@example.com", is_staff=True)
+        self.user.set_password("password")
+        self.user.save()
+        self.user.groups.add(Group.objects.create(name="Moderators"))
+        # /users/login/ выдает такие токены при JWT_AUTH_MODE = 'claims' (TOKEN_OBTAIN_SERIALIZER)
+        self.token = str(ClaimsTokenObtainPairSerializer.get_token(self.user).access_token)
+        self.factory = APIRequestFactory()
+
+    def authenticate(self):
+        request = self.factory.get("/books/", HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        return ClaimsJWTAuthentication().authenticate(request)[0]
+
+    def test_user_from_claims(self):
+        user = self.authenticate()
+        self.assertEqual((user.pk, user.email, user.is_staff), (self.user.pk, "reader@example.com", True))
+        self.assertEqual(user.group_names, ("Moderators",))
+        with CaptureQueriesContext(connection) as queries:
+            self.authenticate()
+        self.assertEqual(len(queries), 0)
+
+    def test_deactivation_and_password_change_revoke_token(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+        self.user.is_active = True
+        self.user.set_password("new-password")
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @skipUnless(settings.JWT_AUTH_MODE == 'db', "Токены режима 'db'")
+    def test_db_mode_tokens(self):
+        """В режиме 'db' (по умолчанию) вход выдает обычные токены, в режиме 'claims' они не принимаются"""
+        response = self.client.post("/users/login/", {"email": "reader@example.com", "password": "password"})
+        token = AccessToken(response.data['access'])
+        self.assertNotIn('email', token)
+        self.assertNotIn('hash_password', token)
+        self.token = str(token)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(JWT_CLAIMS_REVALIDATE_SECONDS=30)
+    def test_revalidation_window(self):
+        self.authenticate()
+        # Изменение в обход сигналов (другой процесс) видно только после окна перепроверки
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with mock.patch('users.local_cache.time.monotonic', return_value=time.monotonic() + 29):
+            self.authenticate()
+        with mock.patch('users.local_cache.time.monotonic', return_value=time.monotonic() + 31):
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate()
+
+    def test_create_book(self):
+        view = BookViewSet.as_view({'post': 'create'}, authentication_classes=[ClaimsJWTAuthentication])
+        request = self.factory.post("/books/", {
+            "title": "Евгений Онегин", "genre": "Роман", "author": {"name": "Пушкин А.С."},
+        }, format="json", HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        response = view(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Book.objects.get().user, self.user)
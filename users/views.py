@@ -1,5 +1,8 @@
 from rest_framework import generics
 from rest_framework.permissions import AllowAny, IsAuthenticated
+
+from library.fieldsets import FieldSelection
+from library.paginators import KeysetPagination
 from users.models import User
 from users.permissions import IsModerator
 from users.serializers import UserSerializer
@@ -20,6 +23,15 @@ class UserCreateAPIView(generics.CreateAPIView):
 
 
 class UserListAPIView(generics.ListAPIView):
-    queryset = User.objects.all()
+    queryset = User.objects.prefetch_related('groups')
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated, IsModerator]
+    pagination_class = KeysetPagination  # Сортировка по id
+    # Аутентификация, группы модератора (при пустом кеше ролей), страница пользователей и их группы
+    query_budget = {'get': 4}
+
+    def get_queryset(self):
+        # Группы загружаются, только если они есть в ответе (?fields=, ?omit=)
+        if FieldSelection.from_request(self.request).includes('groups'):
+            return User.objects.prefetch_related('groups')
+        return User.objects.all()